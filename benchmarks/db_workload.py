@@ -0,0 +1,303 @@
+"""
+Database workload benchmark for dislevel.
+
+Loads synthetic guilds into a local SQLite or Postgres database and drives a
+mixed read/write workload through the public ``dislevel.utils`` functions,
+then reports throughput, latency percentiles and the query plans of the
+statements involved.
+
+Examples::
+
+    python benchmarks/db_workload.py --url sqlite:///bench.db --rows 200000
+    python benchmarks/db_workload.py --url postgresql://localhost/bench \\
+        --driver asyncpg databases --rows 2000000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+from dislevel import init_dislevel
+from dislevel.utils import (
+    get_leaderboard_data,
+    get_member_data,
+    get_member_position,
+    update_xp,
+)
+
+OPERATIONS = {
+    "update_xp": lambda bot, m, g: update_xp(bot, m, g, amount=10),
+    "get_member_data": lambda bot, m, g: get_member_data(bot, m, g),
+    "get_member_position": lambda bot, m, g: get_member_position(bot, m, g),
+    "get_leaderboard_data": lambda bot, m, g: get_leaderboard_data(bot, g),
+}
+
+DEFAULT_MIX = "update_xp=70,get_member_data=15,get_member_position=10,get_leaderboard_data=5"
+
+
+class _Member:
+    def __init__(self, member_id: int):
+        self.id = member_id
+
+
+class _Guild:
+    """Every member is considered cached, so no REST calls are simulated"""
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+    def get_member(self, member_id: int):
+        return _Member(member_id)
+
+
+class BenchBot:
+    """The bare minimum of a bot that dislevel.utils touches"""
+
+    def __init__(self):
+        self.levelups = 0
+
+    def get_guild(self, guild_id: int):
+        return _Guild(guild_id)
+
+    def dispatch(self, event: str, **kwargs):
+        self.levelups += 1
+
+
+class Zipf:
+    """Samples ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self) -> int:
+        return bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def guild_sizes(rows: int, guilds: int, skew: float) -> List[int]:
+    weights = [1 / (rank + 1) ** skew for rank in range(guilds)]
+    total = sum(weights)
+    return [max(1, int(rows * weight / total)) for weight in weights]
+
+
+def parse_mix(mix: str) -> Tuple[List[str], List[int]]:
+    names, weights = [], []
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        names.append(name)
+        weights.append(int(weight))
+    return names, weights
+
+
+async def connect(url: str, driver: str, pool_size: int):
+    if driver == "asyncpg":
+        import asyncpg
+
+        pool = await asyncpg.create_pool(
+            url, min_size=pool_size, max_size=pool_size
+        )
+        return pool, pool.close
+
+    from databases import Database
+
+    options = {} if url.startswith("sqlite") else {"min_size": pool_size, "max_size": pool_size}
+    database = Database(url, **options)
+    await database.connect()
+    return database, database.disconnect
+
+
+async def bulk_insert(bot, driver: str, raw, table: str, rows: List[tuple]):
+    if driver == "asyncpg":
+        async with raw.acquire() as con:
+            await con.executemany(
+                f"INSERT INTO {table} (member_id, guild_id, xp, level) "
+                "VALUES ($1, $2, $3, $4)",
+                rows,
+            )
+    else:
+        await raw.execute_many(
+            f"INSERT INTO {table} (member_id, guild_id, xp, level) "
+            "VALUES (:member_id, :guild_id, :xp, :level)",
+            [
+                {"member_id": m, "guild_id": g, "xp": xp, "level": level}
+                for m, g, xp, level in rows
+            ],
+        )
+
+
+async def load(bot, driver: str, raw, args, rng: random.Random) -> Dict[int, int]:
+    """Loads the synthetic guilds, returns guild_id -> member count"""
+    table = args.table
+    database = bot.dislevel_config.database
+    await database.execute(f"DROP TABLE IF EXISTS {table}")
+    await init_dislevel(bot, raw, driver, table_name=table)
+
+    sizes = guild_sizes(args.rows, args.guilds, args.guild_skew)
+    started = time.perf_counter()
+    batch: List[tuple] = []
+    for index, size in enumerate(sizes):
+        guild_id = index + 1
+        for member_id in range(1, size + 1):
+            # Pareto distributed lifetime xp gives a long tail of lurkers
+            xp = int(rng.paretovariate(1.2) * 50) - 50
+            batch.append((member_id, guild_id, xp, int(xp ** (1 / 5))))
+
+            if len(batch) >= args.batch_size:
+                await bulk_insert(bot, driver, raw, table, batch)
+                batch = []
+
+    if batch:
+        await bulk_insert(bot, driver, raw, table, batch)
+
+    print(f"Loaded {sum(sizes)} rows in {len(sizes)} guilds "
+          f"in {time.perf_counter() - started:.1f}s")
+    return {index + 1: size for index, size in enumerate(sizes)}
+
+
+async def run_workload(bot, sizes: Dict[int, int], args, rng: random.Random):
+    names, weights = parse_mix(args.mix)
+    guild_ids = sorted(sizes, key=sizes.get, reverse=True)
+    guild_picker = Zipf(len(guild_ids), args.guild_skew, rng)
+    member_pickers = {
+        guild_id: Zipf(size, args.activity_skew, rng)
+        for guild_id, size in sizes.items()
+    }
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            guild_id = guild_ids[guild_picker.sample()]
+            member_id = member_pickers[guild_id].sample() + 1
+
+            started = time.perf_counter()
+            try:
+                await OPERATIONS[name](bot, member_id, guild_id)
+            except Exception:
+                errors[name] += 1
+                continue
+            latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(values: List[float], pct: float) -> float:
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(driver: str, latencies, errors, elapsed: float):
+    print(f"\n== {driver}: {elapsed:.1f}s ==")
+    header = f"{'operation':<22}{'ops':>9}{'ops/s':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+
+    total = 0
+    for name in OPERATIONS:
+        values = sorted(latencies.get(name, []))
+        if not values and not errors.get(name):
+            continue
+
+        total += len(values)
+        pcts = [percentile(values, p) * 1000 if values else 0 for p in (50, 90, 99, 100)]
+        print(
+            f"{name:<22}{len(values):>9}{len(values) / elapsed:>10.1f}"
+            + "".join(f"{value:>9.2f}" for value in pcts)
+            + f"{errors.get(name, 0):>8}"
+        )
+
+    print(f"{'total':<22}{total:>9}{total / elapsed:>10.1f}")
+
+
+PLANNED = {
+    "get_member_data": "member_data",
+    "get_member_position": "member_position",
+    "get_leaderboard_data": "leaderboard",
+    "update_xp": "update_xp",
+}
+
+
+async def dump_plans(bot, guild_id: int):
+    config = bot.dislevel_config
+    values = {"guild_id": guild_id, "member_id": 1, "xp": 0, "level": 0, "limit": 10, "offset": 0}
+    prefix = "EXPLAIN QUERY PLAN " if config.dialect == "sqlite" else "EXPLAIN "
+
+    print("\n== query plans ==")
+    for name, attribute in PLANNED.items():
+        query = getattr(config.queries, attribute)
+        used = {key: value for key, value in values.items() if f":{key}" in query}
+        rows = await config.database.fetch_all(prefix + query, used)
+        print(f"-- {name}")
+        for row in rows:
+            print("   " + " | ".join(str(value) for value in row.values()))
+
+
+async def bench(driver: str, args):
+    rng = random.Random(args.seed)
+    raw, close = await connect(args.url, driver, args.pool_size)
+    bot = BenchBot()
+
+    try:
+        await init_dislevel(bot, raw, driver, table_name=args.table)
+        if args.load:
+            sizes = await load(bot, driver, raw, args, rng)
+        else:
+            sizes = dict(
+                (row["guild_id"], row["members"])
+                for row in await bot.dislevel_config.database.fetch_all(
+                    f"SELECT guild_id, COUNT(*) AS members FROM {args.table} GROUP BY guild_id"
+                )
+            )
+
+        latencies, errors, elapsed = await run_workload(bot, sizes, args, rng)
+        report(driver, latencies, errors, elapsed)
+        print(f"level-ups dispatched: {bot.levelups}")
+
+        if args.explain:
+            await dump_plans(bot, max(sizes, key=sizes.get))
+    finally:
+        await close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--url", default="sqlite:///dislevel_bench.db")
+    parser.add_argument("--driver", nargs="+", default=["databases"], choices=["databases", "asyncpg"])
+    parser.add_argument("--table", default="dislevel_bench")
+    parser.add_argument("--rows", type=int, default=100_000, help="total member rows to load")
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--guild-skew", type=float, default=1.1, help="zipf exponent of guild size and traffic")
+    parser.add_argument("--activity-skew", type=float, default=1.2, help="zipf exponent of member activity")
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--no-load", dest="load", action="store_false", help="reuse the existing table")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run the workload for")
+    parser.add_argument("--explain", action="store_true", help="dump query plans after the run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for driver in args.driver:
+        if driver == "asyncpg" and args.url.startswith("sqlite"):
+            raise SystemExit("The asyncpg driver needs a postgresql:// url")
+
+        asyncio.run(bench(driver, args))
+        # Later drivers reuse the rows loaded by the first one
+        args.load = False
+
+
+if __name__ == "__main__":
+    main()
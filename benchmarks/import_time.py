@@ -0,0 +1,75 @@
+"""
+Import-time benchmark for dislevel.
+
+Imports each module in a fresh interpreter several times and reports the
+median wall time and which heavy third party packages the import pulled in.
+Run it on two checkouts to compare cold start.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 20 dislevel.utils dislevel.discord.slash
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    "dislevel",
+    "dislevel.utils",
+    "dislevel.card",
+    "dislevel.discord",
+    "dislevel.discord.slash",
+    "dislevel.nextcord",
+    "dislevel.nextcord.slash",
+]
+HEAVY = ["discord", "nextcord", "PIL", "easy_pil", "numerize", "aiohttp"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+try:
+    __import__({module!r})
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "elapsed": elapsed,
+    "error": error,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'module':<26}{'median ms':>11}{'min ms':>9}  pulled in")
+    for module in args.modules:
+        results = [probe(module) for _ in range(args.runs)]
+        if results[0]["error"]:
+            print(f"{module:<26}{'-':>11}{'-':>9}  {results[0]['error']}")
+            continue
+
+        times = [result["elapsed"] * 1000 for result in results]
+        heavy = ", ".join(results[0]["heavy"]) or "-"
+        print(f"{module:<26}{statistics.median(times):>11.1f}{min(times):>9.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
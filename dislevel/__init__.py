@@ -1,6 +1,23 @@
 from dislevel.connector import init_dislevel
 
-from ._models import Field
+from ._models import Field, Leaderboard, MemberStats
+from ._render import close_rendering, configure_rendering
+from .config import DislevelConfig
 from ._version import __version__, version_info
+from .metrics import REGISTRY, start_metrics_server
+from .tracing import configure_tracing
 
-__all__ = ["init_dislevel", "__version__", "version_info", "Field"]
+__all__ = [
+    "init_dislevel",
+    "__version__",
+    "version_info",
+    "Field",
+    "MemberStats",
+    "Leaderboard",
+    "DislevelConfig",
+    "REGISTRY",
+    "start_metrics_server",
+    "configure_tracing",
+    "configure_rendering",
+    "close_rendering",
+]
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A small LRU cache whose entries expire ``ttl`` seconds after being set"""
+
+    def __init__(self, ttl: float, max_size: int = 10_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class VersionCounter:
+    """
+    A counter per key that moves whenever the key's data changes, e.g. to
+    validate ETags. Versions include the process start, so they never repeat
+    across restarts.
+    """
+
+    def __init__(self):
+        self.epoch = int(time.time() * 1000)
+        self.counts: Dict[Hashable, int] = {}
+
+    def bump(self, key: Hashable) -> None:
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def get(self, key: Hashable) -> str:
+        return f"{self.epoch:x}.{self.counts.get(key, 0)}"
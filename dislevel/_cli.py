@@ -0,0 +1,18 @@
+from typing import Any, Awaitable, Callable, Tuple
+
+
+async def connect(url: str) -> Tuple[Any, Callable[[], Awaitable[None]]]:
+    """Opens a database for the command line tools, returns it and its close function"""
+    if url.startswith(("postgres://", "postgresql://")):
+        import asyncpg
+
+        from ._db_adapter import DbAdapter
+
+        pool = await asyncpg.create_pool(url)
+        return DbAdapter(pool), pool.close
+
+    from databases import Database
+
+    database = Database(url)
+    await database.connect()
+    return database, database.disconnect
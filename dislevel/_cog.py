@@ -1,17 +1,26 @@
-import os
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 
-from discord import Embed, File, Member, Interaction
+from discord import Embed, File, Member, Role, User, VoiceState, Interaction
 from discord.ext import commands
 from discord import app_commands
-from easy_pil.utils import run_in_executor
 
-from .card import get_card
+from ._render import close_rendering, rank_card, rank_text, remember_upload, window_text
+from .global_xp import get_global_rank
+from .periods import leaderboard_title, parse_period
+from .rewards import get_level_rewards, remove_level_reward, set_level_reward
+from .tracing import span, trace
 from .utils import (
     get_leaderboard_data,
-    get_member_data,
-    get_member_position,
+    get_leaderboard_window,
+    handle_cog_load,
+    handle_cog_unload,
+    handle_member_join,
+    handle_member_remove,
+    handle_voice_state_update,
+    reset_guild_xp,
+    scale_guild_xp,
     set_bg_image,
+    transfer_xp,
 )
 
 
@@ -20,78 +29,199 @@ class Leveling(commands.Cog):
 
     def __init__(self, bot: Union[commands.Bot, commands.AutoShardedBot]):
         self.bot = bot
+        handle_cog_load(bot)
+
+    async def cog_unload(self):
+        await handle_cog_unload(self.bot)
+        await close_rendering()
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: Member):
+        await handle_member_remove(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: Member):
+        await handle_member_join(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        await handle_voice_state_update(self.bot, member, before, after)
 
     @commands.command()
     async def rank(self, ctx: commands.Context, *, member: Optional[Member] = None):
         """Check rank of a user (prefix command)"""
         member = member or ctx.author
 
-        user_data = await get_member_data(self.bot, member.id, ctx.guild.id)
-        user_data["position"] = await get_member_position(self.bot, member.id, ctx.guild.id)
-        user_data["profile_image"] = str(member.display_avatar.url)
-
-        # Use member attributes directly
-        user_data["name"] = member.name
-        user_data["descriminator"] = member.discriminator or "0000"  # Default if no discriminator
+        with trace("rank", guild_id=ctx.guild.id):
+            async with ctx.typing():
+                try:
+                    card = await rank_card(
+                        self.bot, member, ctx.guild.id, member.name, member.discriminator or "0000"
+                    )
+                except ValueError as e:
+                    return await ctx.send(str(e))
 
-        image = await run_in_executor(get_card, data=user_data)
-        file = File(fp=image, filename="card.png")
+            if card.url is not None:
+                # The same card was uploaded before, its attachment is still valid
+                return await ctx.send(embed=Embed().set_image(url=card.url))
+            if card.image is None:
+                # The renderer is overloaded, a text rank is cheap
+                embed = Embed(title=member.display_name, description=rank_text(card.data))
+                return await ctx.send(embed=embed)
 
-        await ctx.send(file=file)
+            with span("upload"):
+                message = await ctx.send(file=File(fp=card.image, filename="card.png"))
+            remember_upload(card, message)
 
     @app_commands.command(name="rank", description="Check rank of a user (slash command)")
     async def rank_slash(self, interaction: Interaction, member: Optional[Member] = None):
         """Slash command to check rank of a user"""
         member = member or interaction.user
 
-        user_data = await get_member_data(self.bot, member.id, interaction.guild.id)
-        user_data["position"] = await get_member_position(self.bot, member.id, interaction.guild.id)
-        user_data["profile_image"] = str(member.display_avatar.url)
+        # Deferring first keeps slow cards clear of the 3 second interaction deadline
+        await interaction.response.defer()
 
-        # Use member attributes directly
-        user_data["name"] = member.name
-        user_data["descriminator"] = member.discriminator or "0000"  # Default if no discriminator
+        with trace("rank", guild_id=interaction.guild.id):
+            try:
+                card = await rank_card(
+                    self.bot, member, interaction.guild.id, member.name, member.discriminator or "0000"
+                )
+            except ValueError as e:
+                return await interaction.followup.send(str(e))
 
-        image = await run_in_executor(get_card, data=user_data)
-        file = File(fp=image, filename="card.png")
+            if card.url is not None:
+                # The same card was uploaded before, its attachment is still valid
+                return await interaction.followup.send(embed=Embed().set_image(url=card.url))
+            if card.image is None:
+                # The renderer is overloaded, a text rank is cheap
+                embed = Embed(title=member.display_name, description=rank_text(card.data))
+                return await interaction.followup.send(embed=embed)
 
-        await interaction.response.send_message(file=file)
+            with span("upload"):
+                message = await interaction.followup.send(file=File(fp=card.image, filename="card.png"))
+            remember_upload(card, message)
 
     @commands.command(aliases=["lb"])
-    async def leaderboard(self, ctx: commands.Context):
-        """See the server leaderboard"""
-        leaderboard_data = await get_leaderboard_data(self.bot, ctx.guild.id)
+    async def leaderboard(self, ctx: commands.Context, period: Optional[str] = None):
+        """See the server leaderboard of all time, this week, month or season"""
+        try:
+            period = parse_period(period, self.bot.dislevel_config)
+        except ValueError as e:
+            return await ctx.send(str(e))
 
-        embed = Embed(title="Leaderboard", description="")
-        embed.set_thumbnail(url=os.environ.get("DISLEVEL_LEADERBOARD_ICON", ""))
+        with trace("leaderboard", guild_id=ctx.guild.id):
+            leaderboard_data = await get_leaderboard_data(self.bot, ctx.guild.id, period=period)
 
-        for position, data in enumerate(leaderboard_data, start=1):
-            member = ctx.guild.get_member(data["member_id"]) if self.bot.intents.members else await ctx.guild.fetch_member(data["member_id"])
-            if member:
-                embed.description += f"{position}. {member.mention} - {data['xp']} XP\n"
+            embed = Embed(title=leaderboard_title(period), description="")
+            embed.set_thumbnail(url=self.bot.dislevel_config.leaderboard_icon_url)
 
-        await ctx.send(embed=embed)
+            for position, data in enumerate(leaderboard_data, start=1):
+                embed.description += f"{position}. <@{data['member_id']}> - {data['xp']} XP\n"
+
+            with span("respond"):
+                await ctx.send(embed=embed)
+
+    @commands.command(aliases=["near"])
+    async def around(self, ctx: commands.Context, *, member: Optional[Member] = None):
+        """See the members ranked right above and below you or another member"""
+        member = member or ctx.author
+
+        with trace("around", guild_id=ctx.guild.id):
+            window = await get_leaderboard_window(self.bot, member.id, ctx.guild.id)
+            if window is None:
+                return await ctx.send(f"{member.display_name} has no XP yet.")
+
+            embed = Embed(title=f"Around {member.display_name}", description=window_text(window, member.id))
+            with span("respond"):
+                await ctx.send(embed=embed)
+
+    @commands.command(aliases=["grank"])
+    async def globalrank(self, ctx: commands.Context, *, member: Optional[Member] = None):
+        """Check a user's rank over every server of the bot"""
+        member = member or ctx.author
+
+        with trace("globalrank", guild_id=ctx.guild.id):
+            try:
+                rank = await get_global_rank(self.bot, member.id)
+            except ValueError as e:
+                return await ctx.send(str(e))
+            if rank is None:
+                return await ctx.send(f"{member.display_name} has no XP yet.")
+
+            embed = Embed(
+                title=f"{member.display_name} globally",
+                description=f"**{rank['rank_label']}** \u2022 Level **{rank['level']}**\n{rank['xp']:,} XP",
+            )
+            with span("respond"):
+                await ctx.send(embed=embed)
 
     @app_commands.command(name="leaderboard", description="See the server leaderboard (slash command)")
-    async def leaderboard_slash(self, interaction: Interaction):
+    async def leaderboard_slash(
+        self, interaction: Interaction, period: Optional[Literal["week", "month", "season"]] = None
+    ):
         """Slash command to view the server leaderboard"""
-        leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id)
+        try:
+            period = parse_period(period, self.bot.dislevel_config)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
 
-        embed = Embed(title="Leaderboard", description="")
-        embed.set_thumbnail(url=os.environ.get("DISLEVEL_LEADERBOARD_ICON", ""))
+        with trace("leaderboard", guild_id=interaction.guild.id):
+            leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id, period=period)
 
-        for position, data in enumerate(leaderboard_data, start=1):
-            member = interaction.guild.get_member(data["member_id"]) if self.bot.intents.members else await interaction.guild.fetch_member(data["member_id"])
-            if member:
-                embed.description += f"{position}. {member.mention} - {data['xp']} XP\n"
+            embed = Embed(title=leaderboard_title(period), description="")
+            embed.set_thumbnail(url=self.bot.dislevel_config.leaderboard_icon_url)
 
-        await interaction.response.send_message(embed=embed)
+            for position, data in enumerate(leaderboard_data, start=1):
+                embed.description += f"{position}. <@{data['member_id']}> - {data['xp']} XP\n"
+
+            with span("respond"):
+                await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="around", description="See the members ranked around a member (slash command)")
+    async def around_slash(self, interaction: Interaction, member: Optional[Member] = None):
+        """See the members ranked right above and below you or another member"""
+        member = member or interaction.user
+
+        with trace("around", guild_id=interaction.guild.id):
+            window = await get_leaderboard_window(self.bot, member.id, interaction.guild.id)
+            if window is None:
+                return await interaction.response.send_message(
+                    f"{member.display_name} has no XP yet.", ephemeral=True
+                )
+
+            embed = Embed(title=f"Around {member.display_name}", description=window_text(window, member.id))
+            with span("respond"):
+                await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="globalrank", description="Check a user's rank over every server (slash command)")
+    async def globalrank_slash(self, interaction: Interaction, member: Optional[Member] = None):
+        """Check a user's rank over every server of the bot"""
+        member = member or interaction.user
+
+        with trace("globalrank", guild_id=interaction.guild.id):
+            try:
+                rank = await get_global_rank(self.bot, member.id)
+            except ValueError as e:
+                return await interaction.response.send_message(str(e), ephemeral=True)
+            if rank is None:
+                return await interaction.response.send_message(
+                    f"{member.display_name} has no XP yet.", ephemeral=True
+                )
+
+            embed = Embed(
+                title=f"{member.display_name} globally",
+                description=f"**{rank['rank_label']}** \u2022 Level **{rank['level']}**\n{rank['xp']:,} XP",
+            )
+            with span("respond"):
+                await interaction.response.send_message(embed=embed)
 
     @commands.command()
     async def setbg(self, ctx: commands.Context, *, url: str):
         """Set background image of your card"""
-        await set_bg_image(self.bot, ctx.author.id, ctx.guild.id, url)
-        await ctx.send("Background image has been updated.")
+        with trace("setbg", guild_id=ctx.guild.id):
+            await set_bg_image(self.bot, ctx.author.id, ctx.guild.id, url)
+            with span("respond"):
+                await ctx.send("Background image has been updated.")
 
     @commands.command()
     async def resetbg(self, ctx: commands.Context):
@@ -102,8 +232,10 @@ class Leveling(commands.Cog):
     @app_commands.command(name="setbg", description="Set the background image of your card (slash command)")
     async def setbg_slash(self, interaction: Interaction, url: str):
         """Slash command to set background image of your card"""
-        await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, url)
-        await interaction.response.send_message("Background image has been updated.")
+        with trace("setbg", guild_id=interaction.guild.id):
+            await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, url)
+            with span("respond"):
+                await interaction.response.send_message("Background image has been updated.")
 
     @app_commands.command(name="resetbg", description="Reset the background image of your card to default (slash command)")
     async def resetbg_slash(self, interaction: Interaction):
@@ -111,6 +243,133 @@ class Leveling(commands.Cog):
         await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, "")
         await interaction.response.send_message("Background image has been reset to default.")
 
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def resetxp(self, ctx: commands.Context):
+        """Reset the XP of every member of the server"""
+        with trace("resetxp", guild_id=ctx.guild.id):
+            await reset_guild_xp(self.bot, ctx.guild.id)
+            await ctx.send("XP of every member has been reset.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def scalexp(self, ctx: commands.Context, factor: float):
+        """Multiply the XP of every member of the server, e.g. 0.5 to halve it"""
+        if factor < 0:
+            return await ctx.send("The factor must not be negative.")
+
+        with trace("scalexp", guild_id=ctx.guild.id):
+            await scale_guild_xp(self.bot, ctx.guild.id, factor)
+            await ctx.send(f"XP of every member has been multiplied by {factor:g}.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def transferxp(self, ctx: commands.Context, source: User, target: Member):
+        """Move all XP of an account (e.g. an old one) to a member"""
+        moved = await transfer_xp(self.bot, ctx.guild.id, source.id, target.id, delete_source=True)
+        await ctx.send(f"Moved {moved} XP from {source.mention} to {target.mention}.")
+
+    @app_commands.command(name="resetxp", description="Reset the XP of every member of the server")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def resetxp_slash(self, interaction: Interaction):
+        """Slash command to reset the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("resetxp", guild_id=interaction.guild.id):
+            await reset_guild_xp(self.bot, interaction.guild.id)
+            await interaction.followup.send("XP of every member has been reset.")
+
+    @app_commands.command(name="scalexp", description="Multiply the XP of every member, e.g. 0.5 to halve it")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def scalexp_slash(self, interaction: Interaction, factor: app_commands.Range[float, 0]):
+        """Slash command to multiply the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("scalexp", guild_id=interaction.guild.id):
+            await scale_guild_xp(self.bot, interaction.guild.id, factor)
+            await interaction.followup.send(f"XP of every member has been multiplied by {factor:g}.")
+
+    @app_commands.command(name="transferxp", description="Move all XP of an account to a member")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def transferxp_slash(self, interaction: Interaction, source: User, target: Member):
+        """Slash command to move all XP of an account (e.g. an old one) to a member"""
+        moved = await transfer_xp(self.bot, interaction.guild.id, source.id, target.id, delete_source=True)
+        await interaction.response.send_message(f"Moved {moved} XP from {source.mention} to {target.mention}.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def setreward(self, ctx: commands.Context, level: int, role: Role):
+        """Grant a role to members who reach a level"""
+        try:
+            await set_level_reward(self.bot, ctx.guild.id, level, role.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        await ctx.send(embed=Embed(description=f"Members reaching level {level} will get {role.mention}."))
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def removereward(self, ctx: commands.Context, role: Role):
+        """Stop granting a role as a level reward"""
+        try:
+            await remove_level_reward(self.bot, ctx.guild.id, role.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        await ctx.send(embed=Embed(description=f"{role.mention} is no longer a level reward."))
+
+    @commands.command()
+    @commands.guild_only()
+    async def rewards(self, ctx: commands.Context):
+        """Show the level reward roles of the server"""
+        try:
+            rewards = await get_level_rewards(self.bot, ctx.guild.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        lines = [f"Level {level}: <@&{role_id}>" for level, role_id in rewards]
+        embed = Embed(title="Level rewards", description="\n".join(lines) or "No level rewards yet.")
+        await ctx.send(embed=embed)
+
+    @app_commands.command(name="setreward", description="Grant a role to members who reach a level")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def setreward_slash(self, interaction: Interaction, level: app_commands.Range[int, 1], role: Role):
+        """Grant a role to members who reach a level"""
+        try:
+            await set_level_reward(self.bot, interaction.guild.id, level, role.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        embed = Embed(description=f"Members reaching level {level} will get {role.mention}.")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="removereward", description="Stop granting a role as a level reward")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def removereward_slash(self, interaction: Interaction, role: Role):
+        """Stop granting a role as a level reward"""
+        try:
+            await remove_level_reward(self.bot, interaction.guild.id, role.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        embed = Embed(description=f"{role.mention} is no longer a level reward.")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="rewards", description="Show the level reward roles of the server")
+    @app_commands.guild_only()
+    async def rewards_slash(self, interaction: Interaction):
+        """Show the level reward roles of the server"""
+        try:
+            rewards = await get_level_rewards(self.bot, interaction.guild.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        lines = [f"Level {level}: <@&{role_id}>" for level, role_id in rewards]
+        embed = Embed(title="Level rewards", description="\n".join(lines) or "No level rewards yet.")
+        await interaction.response.send_message(embed=embed)
+
 
 async def setup(bot):
     await bot.add_cog(Leveling(bot))
\ No newline at end of file
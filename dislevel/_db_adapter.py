@@ -1,4 +1,28 @@
 import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Tuple
+
+from .metrics import POOL_ACQUIRE_SECONDS
+from .tracing import record_span
+
+
+@lru_cache(maxsize=256)
+def _compile(query: str) -> Tuple[str, Tuple[str, ...]]:
+    """Converts :name parameters to asyncpg's $n, returns the query and the names in order"""
+    names: List[str] = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    # A name used twice binds to the same parameter, ``::type`` casts are left alone
+    query = re.sub(r"(?<!:):([a-zA-Z_][a-zA-Z0-9_]*)", replace, query)
+    return query, tuple(names)
 
 
 class DbAdapter:
@@ -6,43 +30,73 @@ class DbAdapter:
     An adapter that allows databases type queries in asyncpg
     """
 
-    def __init__(self, pool):
+    def __init__(self, pool, read_pools: list = ()):
         self.pool = pool
+        # Adapters of read replica pools, dislevel routes its reads to them
+        self.replicas = [DbAdapter(read_pool) for read_pool in read_pools]
+        # Connection of the transaction the current task is in, if any
+        self._connection = ContextVar(f"dislevel_connection_{id(self)}", default=None)
 
     def get_data(self, query, values: dict = dict()):
         if not values:
             return [query, []]
 
-        items = []
-        vars = re.findall(r"(:[a-zA-Z_]+)", query)
+        query, names = _compile(query)
+        return [query, [values[name] for name in names]]
+
+    @asynccontextmanager
+    async def acquire(self):
+        con = self._connection.get()
+        if con is not None:
+            yield con
+            return
 
-        for index, match in enumerate(vars):
-            var = match[1:]
-            items.append(values[var])
-            query = query.replace(match, f"${index+1}")
+        started = time.perf_counter()
+        async with self.pool.acquire() as con:
+            acquired = time.perf_counter()
+            POOL_ACQUIRE_SECONDS.observe(acquired - started)
+            record_span("pool_acquire", started, acquired)
+            yield con
 
-        return [query, items]
+    @asynccontextmanager
+    async def transaction(self):
+        """Runs every query of the block on one connection in a transaction, like ``databases``"""
+        async with self.acquire() as con:
+            async with con.transaction():
+                token = self._connection.set(con)
+                try:
+                    yield con
+                finally:
+                    self._connection.reset(token)
 
     async def fetch_one(self, query: str, values: dict = dict()):
         nq, nv = self.get_data(query, values)
 
-        async with self.pool.acquire() as con:
+        async with self.acquire() as con:
             data = await con.fetchrow(nq, *nv)
             return data
 
     async def fetch_all(self, query: str, values: dict = dict()):
         nq, nv = self.get_data(query, values)
-        async with self.pool.acquire() as con:
+        async with self.acquire() as con:
             data = await con.fetch(nq, *nv)
             return data
 
     async def fetch_val(self, query: str, values: dict = dict()):
         nq, nv = self.get_data(query, values)
-        async with self.pool.acquire() as con:
+        async with self.acquire() as con:
             data = await con.fetchval(nq, *nv)
             return data
 
     async def execute(self, query: str, values: dict = dict()):
         nq, nv = self.get_data(query, values)
-        async with self.pool.acquire() as con:
+        async with self.acquire() as con:
             await con.execute(nq, *nv)
+
+    async def execute_many(self, query: str, values: list):
+        if not values:
+            return
+
+        nq, _ = self.get_data(query, values[0])
+        async with self.acquire() as con:
+            await con.executemany(nq, [self.get_data(query, value)[1] for value in values])
@@ -1,4 +1,6 @@
+from array import array
 from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 @dataclass
@@ -8,3 +10,154 @@ class Field:
     primary: bool = False
     null: bool = True
     default: str = None
+
+
+class MemberStats:
+    """
+    A member's row, as returned by ``get_member_data``. Attributes are the
+    table's columns, additional fields are in ``extra``. ``percentage`` and
+    ``next_level_xp`` are computed on access. Also readable like the dicts of
+    earlier versions, e.g. ``stats["xp"]`` or ``dict(stats.items())``.
+    """
+
+    __slots__ = ("member_id", "guild_id", "xp", "level", "bg_image", "active", "extra")
+
+    COLUMNS = ("member_id", "guild_id", "xp", "level", "bg_image", "active")
+
+    def __init__(
+        self,
+        member_id: int,
+        guild_id: int,
+        xp: int,
+        level: int,
+        bg_image: Optional[str] = None,
+        active: bool = True,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.member_id = member_id
+        self.guild_id = guild_id
+        self.xp = xp
+        self.level = level
+        self.bg_image = bg_image
+        self.active = active
+        self.extra = extra or {}
+
+    @classmethod
+    def from_row(cls, row, extra_fields: Iterable[str] = ()) -> "MemberStats":
+        return cls(
+            row["member_id"],
+            row["guild_id"],
+            row["xp"],
+            row["level"],
+            row["bg_image"],
+            row["active"],
+            {name: row[name] for name in extra_fields},
+        )
+
+    @property
+    def next_level_xp(self) -> int:
+        return (self.level + 1) ** 5
+
+    @property
+    def percentage(self) -> float:
+        min_xp = self.level**5
+        return 100 * (self.xp - min_xp) / (self.next_level_xp - min_xp)
+
+    def keys(self) -> List[str]:
+        return list(self.COLUMNS) + list(self.extra) + ["percentage", "next_level_xp"]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.extra:
+            return self.extra[key]
+        if key in self.COLUMNS or key in ("percentage", "next_level_xp"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.COLUMNS:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.extra or key in self.COLUMNS or key in ("percentage", "next_level_xp")
+
+    def __repr__(self) -> str:
+        return f"MemberStats(member_id={self.member_id}, guild_id={self.guild_id}, xp={self.xp}, level={self.level})"
+
+
+class LeaderboardEntry:
+    """One row of a ``Leaderboard``, readable as ``entry.xp`` or ``entry["xp"]``"""
+
+    __slots__ = ("member_id", "xp", "member")
+
+    def __init__(self, member_id: int, xp: int, member: Any = None):
+        self.member_id = member_id
+        self.xp = xp
+        self.member = member
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __repr__(self) -> str:
+        return f"LeaderboardEntry(member_id={self.member_id}, xp={self.xp})"
+
+
+class Leaderboard:
+    """
+    Leaderboard rows in column arrays rather than a dict per row. Iterating
+    or indexing yields ``LeaderboardEntry`` views. Read only, so one page can
+    be shared by every caller that asked for it at the same time.
+
+    ``start`` is the position of the first row, 1 for the top of the board.
+    """
+
+    __slots__ = ("member_ids", "xp", "members", "start")
+
+    def __init__(self, start: int = 1):
+        self.start = start
+        self.member_ids = array("q")
+        self.xp = array("q")
+        self.members: List[Any] = []
+
+    def append(self, member_id: int, xp: int, member: Any = None) -> None:
+        self.member_ids.append(member_id)
+        self.xp.append(xp)
+        self.members.append(member)
+
+    def __len__(self) -> int:
+        return len(self.member_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rows = range(len(self))[index]
+            page = Leaderboard(self.start + (rows[0] if rows else 0))
+            page.member_ids, page.xp, page.members = (
+                self.member_ids[index], self.xp[index], self.members[index]
+            )
+            return page
+        return LeaderboardEntry(self.member_ids[index], self.xp[index], self.members[index])
+
+    def __iter__(self) -> Iterator[LeaderboardEntry]:
+        for member_id, xp, member in zip(self.member_ids, self.xp, self.members):
+            yield LeaderboardEntry(member_id, xp, member)
+
+    def __repr__(self) -> str:
+        return f"Leaderboard({len(self)} rows)"
@@ -0,0 +1,865 @@
+from functools import lru_cache
+from typing import List
+
+from ._models import Field
+
+DEFAULT_FIELDS = [
+    Field(name="id", type="BIGSERIAL", primary=True),
+    Field(name="member_id", type="BIGINT", null=False),
+    Field(name="guild_id", type="BIGINT", null=False),
+    Field(name="xp", type="BIGINT", null=False, default=0),
+    Field(name="level", type="BIGINT", null=False, default=1),
+    Field(name="bg_image", type="TEXT"),
+    Field(name="active", type="BOOLEAN", null=False, default=True),
+    # Unix time of the last XP write, 0 until ``dislevel.archive`` backfills it
+    Field(name="last_active", type="BIGINT", null=False, default=0),
+]
+
+
+def field_schema(fields: List[Field], partition_key: str = None) -> str:
+    statements = []
+    primary = []
+    for field in fields:
+        statement = f"{field.name} {field.type}"
+
+        # The primary key of a partitioned table has to include the partition key
+        if field.primary and partition_key:
+            primary.append(field.name)
+        elif field.primary:
+            statement += " PRIMARY KEY"
+
+        if not field.null:
+            statement += " NOT NULL"
+
+        if field.default != None:
+            statement = f"{statement} DEFAULT %r" % field.default
+
+        statements.append(statement)
+
+    if primary:
+        statements.append(f"PRIMARY KEY ({', '.join([partition_key] + primary)})")
+
+    return ", ".join(statements)
+
+
+class Queries:
+    """Every SQL statement dislevel runs against one table, built once per config"""
+
+    def __init__(
+        self,
+        table: str,
+        dialect: str,
+        additional_fields: List[Field] = list(),
+        partitions: int = None,
+    ):
+        self.table = table
+        self.dialect = dialect
+        self.fields = DEFAULT_FIELDS + list(additional_fields)
+        self.extra_fields = [field.name for field in additional_fields]
+        # Declarative hash partitioning by guild is Postgres only
+        self.partitions = partitions if dialect == "postgresql" else None
+
+        if self.partitions:
+            self.create_table = (
+                f"CREATE TABLE IF NOT EXISTS {table}({field_schema(self.fields, 'guild_id')}) "
+                "PARTITION BY HASH (guild_id)"
+            )
+        else:
+            self.create_table = f"CREATE TABLE IF NOT EXISTS {table}({field_schema(self.fields)})"
+
+        # Indexes created on a partitioned table are created on every partition
+        self.create_partitions = [
+            f"""CREATE TABLE IF NOT EXISTS {table}_p{remainder} PARTITION OF {table}
+                FOR VALUES WITH (MODULUS {self.partitions}, REMAINDER {remainder})"""
+            for remainder in range(self.partitions or 0)
+        ]
+
+        self.is_partitioned = f"""
+            SELECT  EXISTS (
+                        SELECT  1
+                          FROM  pg_partitioned_table
+                         WHERE  partrelid = to_regclass('{table}')
+                    )
+        """
+
+        # Tables created by older versions predate these, so each may already exist
+        self.migrations = [
+            f"ALTER TABLE {table} ADD COLUMN active BOOLEAN NOT NULL DEFAULT TRUE",
+            f"""CREATE INDEX IF NOT EXISTS {table}_member_idx
+                ON {table} (guild_id, member_id)""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_active_xp_idx
+                ON {table} (guild_id, xp DESC) WHERE active""",
+            f"ALTER TABLE {table} ADD COLUMN last_active BIGINT NOT NULL DEFAULT 0",
+        ]
+
+        if dialect == "sqlite":
+            self.now = "CAST(strftime('%s', 'now') AS INTEGER)"
+        else:
+            self.now = "CAST(EXTRACT(EPOCH FROM NOW()) AS BIGINT)"
+
+        # Only the columns ``MemberStats`` holds, not the surrogate id
+        member_columns = ", ".join(
+            ["member_id", "guild_id", "xp", "level", "bg_image", "active"] + self.extra_fields
+        )
+        self.member_data = f"""
+            SELECT  {member_columns}
+              FROM  {table}
+             WHERE  guild_id = :guild_id
+               AND  member_id = :member_id
+        """
+
+        self.leaderboard = f"""
+            SELECT   member_id, xp
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+          ORDER BY   xp DESC, member_id
+             LIMIT   :limit
+            OFFSET   :offset
+        """
+
+        self.member_position = f"""
+            SELECT  COUNT(*) + 1
+              FROM  {table}
+             WHERE  guild_id = :guild_id
+               AND  active
+               AND  xp > (
+                        SELECT  xp
+                          FROM  {table}
+                         WHERE  guild_id = :guild_id
+                           AND  member_id = :member_id
+                    )
+        """
+
+        # The rows right above and right below a member, as two scans of the
+        # active XP index that start at their XP and stop after ``limit`` rows.
+        # Ties are ordered by member ID so the two never overlap.
+        self.window_above = f"""
+            SELECT   member_id, xp
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+               AND   xp >= :xp
+               AND   (xp > :xp OR member_id < :member_id)
+          ORDER BY   xp ASC, member_id DESC
+             LIMIT   :limit
+        """
+
+        self.window_below = f"""
+            SELECT   member_id, xp
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+               AND   xp <= :xp
+               AND   (xp < :xp OR member_id > :member_id)
+          ORDER BY   xp DESC, member_id ASC
+             LIMIT   :limit
+        """
+
+        self.xp_counts = f"""
+            SELECT   xp, COUNT(*) AS members
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+          GROUP BY   xp
+        """
+
+        self.update_xp = f"""
+            UPDATE  {table}
+               SET  xp = :xp,
+                    level = :level,
+                    active = TRUE,
+                    last_active = {self.now}
+             WHERE  member_id = :member_id
+               AND  guild_id = :guild_id
+        """
+
+        self.insert_member = f"""
+            INSERT  INTO {table}
+                    (member_id, guild_id, xp, level, last_active)
+            VALUES  (:member_id, :guild_id, :xp, :level, {self.now})
+        """
+
+        self.delete_member = f"""
+            DELETE  FROM {table}
+             WHERE  member_id = :member_id
+               AND  guild_id = :guild_id
+        """
+
+        self.set_bg_image = f"""
+            UPDATE  {table}
+               SET  bg_image = :bg_image
+             WHERE  guild_id = :guild_id
+               AND  member_id = :member_id
+        """
+
+        self.set_active = f"""
+            UPDATE  {table}
+               SET  active = :active
+             WHERE  guild_id = :guild_id
+               AND  member_id = :member_id
+        """
+
+        self.guild_memberships = f"""
+            SELECT  member_id, active
+              FROM  {table}
+             WHERE  guild_id = :guild_id
+        """
+
+        # Top ``size`` rows per guild, kept by ``dislevel.snapshot``
+        self.create_top_table = f"""
+            CREATE TABLE IF NOT EXISTS {table}_top (
+                guild_id BIGINT NOT NULL,
+                member_id BIGINT NOT NULL,
+                xp BIGINT NOT NULL,
+                PRIMARY KEY (guild_id, member_id)
+            )
+        """
+
+        self.top_leaderboard = f"""
+            SELECT   member_id, xp
+              FROM   {table}_top
+             WHERE   guild_id = :guild_id
+          ORDER BY   xp DESC, member_id
+             LIMIT   :limit
+            OFFSET   :offset
+        """
+
+        self.top_threshold = f"""
+            SELECT  COUNT(*) AS members, MIN(xp) AS kth
+              FROM  {table}_top
+             WHERE  guild_id = :guild_id
+        """
+
+        self.top_upsert = f"""
+            INSERT  INTO {table}_top
+                    (guild_id, member_id, xp)
+            VALUES  (:guild_id, :member_id, :xp)
+                ON  CONFLICT (guild_id, member_id) DO UPDATE
+               SET  xp = excluded.xp
+        """
+
+        self.top_trim = f"""
+            DELETE  FROM {table}_top
+             WHERE  guild_id = :guild_id
+               AND  member_id NOT IN (
+                        SELECT   member_id
+                          FROM   {table}_top
+                         WHERE   guild_id = :guild_id
+                      ORDER BY   xp DESC, member_id
+                         LIMIT   :size
+                    )
+        """
+
+        self.top_clear = f"""
+            DELETE  FROM {table}_top
+             WHERE  guild_id = :guild_id
+        """
+
+        self.top_expected = f"""
+            SELECT   member_id, xp
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+          ORDER BY   xp DESC, member_id
+             LIMIT   :size
+        """
+
+        self.top_fill = f"""
+            INSERT   INTO {table}_top
+                     (guild_id, member_id, xp)
+            SELECT   guild_id, member_id, xp
+              FROM   {table}
+             WHERE   guild_id = :guild_id
+               AND   active
+          ORDER BY   xp DESC, member_id
+             LIMIT   :size
+        """
+
+        self.guild_ids = f"SELECT DISTINCT guild_id FROM {table}"
+
+        # XP per week, month and season, kept by ``dislevel.periods``
+        self.create_period_table = [
+            f"""CREATE TABLE IF NOT EXISTS {table}_periods (
+                    guild_id BIGINT NOT NULL,
+                    member_id BIGINT NOT NULL,
+                    period TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    xp BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, period, bucket, member_id)
+                )""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_periods_xp_idx
+                ON {table}_periods (guild_id, period, bucket, xp DESC)""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_periods_expiry_idx
+                ON {table}_periods (period, bucket)""",
+        ]
+
+        self.period_upsert = f"""
+            INSERT  INTO {table}_periods
+                    (guild_id, member_id, period, bucket, xp)
+            VALUES  (:guild_id, :member_id, :period, :bucket, :xp)
+                ON  CONFLICT (guild_id, period, bucket, member_id) DO UPDATE
+               SET  xp = {table}_periods.xp + excluded.xp
+        """
+
+        self.period_leaderboard = f"""
+            SELECT   p.member_id, p.xp
+              FROM   {table}_periods AS p
+              JOIN   {table} AS m
+                ON   m.guild_id = p.guild_id
+               AND   m.member_id = p.member_id
+             WHERE   p.guild_id = :guild_id
+               AND   p.period = :period
+               AND   p.bucket = :bucket
+               AND   m.active
+          ORDER BY   p.xp DESC, p.member_id
+             LIMIT   :limit
+            OFFSET   :offset
+        """
+
+        self.period_position = f"""
+            SELECT  COUNT(*) + 1
+              FROM  {table}_periods AS p
+              JOIN  {table} AS m
+                ON  m.guild_id = p.guild_id
+               AND  m.member_id = p.member_id
+             WHERE  p.guild_id = :guild_id
+               AND  p.period = :period
+               AND  p.bucket = :bucket
+               AND  m.active
+               AND  p.xp > (
+                        SELECT  COALESCE(MAX(xp), 0)
+                          FROM  {table}_periods
+                         WHERE  guild_id = :guild_id
+                           AND  period = :period
+                           AND  bucket = :bucket
+                           AND  member_id = :member_id
+                    )
+        """
+
+        self.period_expire = f"""
+            DELETE  FROM {table}_periods
+             WHERE  period = :period
+               AND  bucket < :oldest
+        """
+
+        # Append only history of XP changes, kept by ``dislevel.journal``
+        self.create_journal = [
+            f"""CREATE TABLE IF NOT EXISTS {table}_journal (
+                    ts BIGINT NOT NULL,
+                    guild_id BIGINT NOT NULL,
+                    member_id BIGINT NOT NULL,
+                    delta BIGINT NOT NULL,
+                    source TEXT NOT NULL
+                )""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_journal_member_idx
+                ON {table}_journal (guild_id, member_id, ts)""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_journal_ts_idx
+                ON {table}_journal (guild_id, ts)""",
+            f"""CREATE TABLE IF NOT EXISTS {table}_checkpoints (
+                    guild_id BIGINT NOT NULL,
+                    member_id BIGINT NOT NULL,
+                    ts BIGINT NOT NULL,
+                    xp BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, member_id)
+                )""",
+        ]
+
+        self.journal_append = f"""
+            INSERT  INTO {table}_journal
+                    (ts, guild_id, member_id, delta, source)
+            VALUES  (:ts, :guild_id, :member_id, :delta, :source)
+        """
+
+        self.journal_history = f"""
+            SELECT   ts, delta, source
+              FROM   {table}_journal
+             WHERE   guild_id = :guild_id
+               AND   member_id = :member_id
+          ORDER BY   ts DESC
+             LIMIT   :limit
+        """
+
+        self.journal_range_sums = f"""
+            SELECT   member_id, SUM(delta) AS delta
+              FROM   {table}_journal
+             WHERE   guild_id = :guild_id
+               AND   ts >= :since
+               AND   ts < :until
+          GROUP BY   member_id
+        """
+
+        self.journal_source_range_sums = f"""
+            SELECT   member_id, SUM(delta) AS delta
+              FROM   {table}_journal
+             WHERE   guild_id = :guild_id
+               AND   ts >= :since
+               AND   ts < :until
+               AND   source = :source
+          GROUP BY   member_id
+        """
+
+        self.journal_balances = f"""
+            SELECT   member_id, SUM(xp) AS xp
+              FROM   (
+                        SELECT  member_id, xp
+                          FROM  {table}_checkpoints
+                         WHERE  guild_id = :guild_id
+                     UNION ALL
+                        SELECT  member_id, delta
+                          FROM  {table}_journal
+                         WHERE  guild_id = :guild_id
+                     ) AS history
+          GROUP BY   member_id
+        """
+
+        self.checkpoint_fold = f"""
+            INSERT   INTO {table}_checkpoints
+                     (guild_id, member_id, ts, xp)
+            SELECT   guild_id, member_id, :before, SUM(delta)
+              FROM   {table}_journal
+             WHERE   ts < :before
+          GROUP BY   guild_id, member_id
+                ON   CONFLICT (guild_id, member_id) DO UPDATE
+               SET   ts = excluded.ts,
+                     xp = {table}_checkpoints.xp + excluded.xp
+        """
+
+        self.journal_truncate = f"""
+            DELETE  FROM {table}_journal
+             WHERE  ts < :before
+        """
+
+        # Checkpoints stay empty until the first compaction, only both empty means a new journal
+        self.journal_used = f"""
+            SELECT  (SELECT COUNT(*) FROM (SELECT 1 FROM {table}_checkpoints LIMIT 1) AS checkpoints)
+                  + (SELECT COUNT(*) FROM (SELECT 1 FROM {table}_journal LIMIT 1) AS events)
+        """
+
+        # XP earned before the journal existed becomes each member's first checkpoint
+        self.checkpoint_seed = f"""
+            INSERT  INTO {table}_checkpoints
+                    (guild_id, member_id, ts, xp)
+            SELECT  guild_id, member_id, :ts, xp
+              FROM  {table}
+             WHERE  NOT EXISTS (
+                        SELECT  1
+                          FROM  {table}_journal AS journal
+                         WHERE  journal.guild_id = {table}.guild_id
+                           AND  journal.member_id = {table}.member_id
+                    )
+                ON  CONFLICT (guild_id, member_id) DO NOTHING
+        """
+
+        self.guild_xp = f"""
+            SELECT  member_id, xp
+              FROM  {table}
+             WHERE  guild_id = :guild_id
+        """
+
+        # Bulk operations walk a guild in chunks of member ids, one statement per chunk
+        chunk = "guild_id = :guild_id AND member_id > :after AND member_id <= :until"
+        if dialect == "sqlite":
+            # power() needs SQLite's math functions, see ``levels_in_sql``
+            self.scaled_xp = "CAST(xp * CAST(:factor AS REAL) AS INTEGER)"
+            root = "CAST(power(max(xp, 0), 0.2) AS INTEGER)"
+        else:
+            self.scaled_xp = "CAST(FLOOR(xp * CAST(:factor AS DOUBLE PRECISION)) AS BIGINT)"
+            root = "CAST(FLOOR(POWER(CAST(GREATEST(xp, 0) AS DOUBLE PRECISION), 0.2)) AS BIGINT)"
+        self.levels_in_sql = True
+        self.level_probe = "SELECT power(32, 0.2)"
+
+        self.chunk_end = f"""
+            SELECT  MAX(member_id)
+              FROM  (
+                        SELECT   member_id
+                          FROM   {table}
+                         WHERE   guild_id = :guild_id
+                           AND   member_id > :after
+                      ORDER BY   member_id
+                         LIMIT   :batch_size
+                    ) AS chunk
+        """
+
+        self.chunk_xp = f"SELECT member_id, xp FROM {table} WHERE {chunk}"
+
+        self.recompute_levels = f"""
+            UPDATE  {table}
+               SET  level = CASE WHEN xp > 0 THEN {root} ELSE 0 END
+             WHERE  {chunk}
+        """
+
+        self.set_level = f"""
+            UPDATE  {table}
+               SET  level = :level
+             WHERE  guild_id = :guild_id
+               AND  member_id = :member_id
+        """
+
+        self.reset_xp = f"UPDATE {table} SET xp = 0 WHERE {chunk}"
+
+        self.scale_xp = f"UPDATE {table} SET xp = {self.scaled_xp} WHERE {chunk}"
+
+        # Members of the source guild, by the target guild's chunk of member ids
+        source_chunk = f"""
+            SELECT  member_id
+              FROM  {table}
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+        """
+
+        self.merge_add = f"""
+            UPDATE  {table}
+               SET  xp = xp + (
+                        SELECT  source.xp
+                          FROM  {table} AS source
+                         WHERE  source.guild_id = :source_guild_id
+                           AND  source.member_id = {table}.member_id
+                    )
+             WHERE  {chunk}
+               AND  member_id IN ({source_chunk})
+        """
+
+        self.merge_insert = f"""
+            INSERT  INTO {table}
+                    (member_id, guild_id, xp, level, bg_image, active, last_active)
+            SELECT  member_id, :guild_id, xp, level, bg_image, active, last_active
+              FROM  {table} AS source
+             WHERE  source.guild_id = :source_guild_id
+               AND  source.member_id > :after
+               AND  source.member_id <= :until
+               AND  NOT EXISTS (
+                        SELECT  1
+                          FROM  {table} AS target
+                         WHERE  target.guild_id = :guild_id
+                           AND  target.member_id = source.member_id
+                    )
+        """
+
+        self.merge_delete = f"""
+            DELETE  FROM {table}
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+        """
+
+        self.merge_journal = f"""
+            INSERT  INTO {table}_journal
+                    (ts, guild_id, member_id, delta, source)
+            SELECT  :ts, guild_id, member_id, -xp, :source
+              FROM  {table}
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+               AND  xp <> 0
+             UNION  ALL
+            SELECT  :ts, :guild_id, member_id, xp, :source
+              FROM  {table}
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+               AND  xp <> 0
+        """
+
+        # Period rollups follow the bulk operations, chunk by chunk
+        self.period_reset = f"DELETE FROM {table}_periods WHERE {chunk}"
+
+        self.period_scale = f"UPDATE {table}_periods SET xp = {self.scaled_xp} WHERE {chunk}"
+
+        self.period_merge_add = f"""
+            INSERT  INTO {table}_periods
+                    (guild_id, member_id, period, bucket, xp)
+            SELECT  :guild_id, member_id, period, bucket, xp
+              FROM  {table}_periods
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+                ON  CONFLICT (guild_id, period, bucket, member_id) DO UPDATE
+               SET  xp = {table}_periods.xp + excluded.xp
+        """
+
+        self.period_merge_delete = f"""
+            DELETE  FROM {table}_periods
+             WHERE  guild_id = :source_guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+        """
+
+        self.chunk_levels = f"SELECT member_id, level FROM {table} WHERE {chunk}"
+
+        # Level reward roles, granted by ``dislevel.rewards``
+        self.create_rewards = f"""
+            CREATE TABLE IF NOT EXISTS {table}_rewards (
+                guild_id BIGINT NOT NULL,
+                role_id BIGINT NOT NULL,
+                level INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, role_id)
+            )
+        """
+
+        self.level_rewards = f"""
+            SELECT  level, role_id
+              FROM  {table}_rewards
+             WHERE  guild_id = :guild_id
+        """
+
+        self.reward_upsert = f"""
+            INSERT  INTO {table}_rewards
+                    (guild_id, role_id, level)
+            VALUES  (:guild_id, :role_id, :level)
+                ON  CONFLICT (guild_id, role_id) DO UPDATE
+               SET  level = excluded.level
+        """
+
+        self.reward_delete = f"""
+            DELETE  FROM {table}_rewards
+             WHERE  guild_id = :guild_id
+               AND  role_id = :role_id
+        """
+
+        # XP of every member summed over guilds, kept by ``dislevel.global_xp``
+        self.create_global = [
+            f"""CREATE TABLE IF NOT EXISTS {table}_global (
+                    member_id BIGINT NOT NULL PRIMARY KEY,
+                    xp BIGINT NOT NULL
+                )""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_global_xp_idx
+                ON {table}_global (xp DESC)""",
+        ]
+
+        self.global_add = f"""
+            INSERT  INTO {table}_global
+                    (member_id, xp)
+            VALUES  (:member_id, :xp)
+                ON  CONFLICT (member_id) DO UPDATE
+               SET  xp = {table}_global.xp + excluded.xp
+        """
+
+        self.global_any = f"SELECT 1 FROM {table}_global LIMIT 1"
+
+        self.global_clear = f"DELETE FROM {table}_global"
+
+        # Members inactive for long, moved out of the hot table by ``dislevel.archive``
+        self.copy_columns = [field.name for field in self.fields if field.name != "id"]
+        # Restored members count as active from the moment they are back
+        self.restored_columns = ", ".join(
+            self.now if name == "last_active" else name for name in self.copy_columns
+        )
+        self.create_archive = [
+            f"""CREATE TABLE IF NOT EXISTS {table}_archive (
+                    {field_schema([field for field in self.fields if field.name != "id"])}
+                )""",
+            f"""CREATE UNIQUE INDEX IF NOT EXISTS {table}_archive_member_idx
+                ON {table}_archive (guild_id, member_id)""",
+            f"""CREATE TABLE IF NOT EXISTS {table}_archive_levels (
+                    guild_id BIGINT NOT NULL,
+                    level BIGINT NOT NULL,
+                    members BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, level)
+                )""",
+            f"""CREATE INDEX IF NOT EXISTS {table}_last_active_idx
+                ON {table} (last_active)""",
+            # Rows from before ``last_active`` existed start their clock now
+            f"UPDATE {table} SET last_active = {self.now} WHERE last_active = 0",
+        ]
+
+        self.archive_candidates = f"""
+            SELECT   guild_id, member_id, xp, active
+              FROM   {table}
+             WHERE   last_active < :cutoff
+          ORDER BY   last_active
+             LIMIT   :limit
+        """
+
+        self.restore_guild = self._archive_move(
+            f"{table}_archive", table, "guild_id = :guild_id", "-", self.restored_columns, returning=False
+        )
+
+        self.archived_levels = f"""
+            SELECT  level, members
+              FROM  {table}_archive_levels
+             WHERE  guild_id = :guild_id
+               AND  members > 0
+        """
+
+        self.global_leaderboard = f"""
+            SELECT   member_id, xp
+              FROM   {table}_global
+          ORDER BY   xp DESC, member_id
+             LIMIT   :limit
+            OFFSET   :offset
+        """
+
+        self.global_xp = f"SELECT xp FROM {table}_global WHERE member_id = :member_id"
+
+        self.global_position = f"""
+            SELECT  COUNT(*) + 1
+              FROM  {table}_global
+             WHERE  xp > :xp
+        """
+
+    @lru_cache(maxsize=None)
+    def journal_bulk(self, new_xp: str) -> str:
+        """Journals the change of every row of a chunk to ``new_xp``, an expression of ``xp``"""
+        return f"""
+            INSERT  INTO {self.table}_journal
+                    (ts, guild_id, member_id, delta, source)
+            SELECT  :ts, guild_id, member_id, {new_xp} - xp, :source
+              FROM  {self.table}
+             WHERE  guild_id = :guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+               AND  {new_xp} <> xp
+        """
+
+    @lru_cache(maxsize=None)
+    def global_bulk(self, new_xp: str) -> str:
+        """Adds the change of every row of a chunk to ``new_xp`` to the global totals"""
+        return f"""
+            INSERT  INTO {self.table}_global
+                    (member_id, xp)
+            SELECT  member_id, {new_xp} - xp
+              FROM  {self.table}
+             WHERE  guild_id = :guild_id
+               AND  member_id > :after
+               AND  member_id <= :until
+               AND  {new_xp} <> xp
+                ON  CONFLICT (member_id) DO UPDATE
+               SET  xp = {self.table}_global.xp + excluded.xp
+        """
+
+    def _member_xp(self, archived: bool) -> str:
+        """Every row's member and XP, archived rows included when there is an archive"""
+        rows = f"SELECT member_id, xp FROM {self.table}"
+        if archived:
+            rows += f" UNION ALL SELECT member_id, xp FROM {self.table}_archive"
+        return rows
+
+    @lru_cache(maxsize=None)
+    def global_fill(self, archived: bool) -> str:
+        return f"""
+            INSERT    INTO {self.table}_global
+                      (member_id, xp)
+            SELECT    member_id, SUM(xp)
+              FROM    ({self._member_xp(archived)}) AS rows
+          GROUP BY    member_id
+        """
+
+    @lru_cache(maxsize=None)
+    def global_drift(self, archived: bool) -> str:
+        return f"""
+            SELECT     sums.member_id, sums.xp AS expected, stored.xp AS stored
+              FROM     (
+                           SELECT    member_id, SUM(xp) AS xp
+                             FROM    ({self._member_xp(archived)}) AS rows
+                         GROUP BY    member_id
+                       ) AS sums
+         LEFT JOIN     {self.table}_global AS stored
+                ON     stored.member_id = sums.member_id
+             WHERE     stored.xp IS NULL
+                OR     stored.xp <> sums.xp
+        """
+
+    def _archive_move(
+        self, source: str, target: str, where: str, sign: str, columns: str, returning: bool = True
+    ) -> List[str]:
+        """
+        Statements moving the rows of ``source`` matching ``where`` to ``target``
+        and adding them to the archived level counts with ``sign``. Postgres
+        does it in one statement, SQLite in three that run in one transaction.
+        With ``returning``, the first statement returns the member, XP and
+        active flag of the rows actually moved, run it with ``fetch_all``.
+        """
+        counts = f"""
+            INSERT    INTO {self.table}_archive_levels
+                      (guild_id, level, members)
+            SELECT    guild_id, level, {sign}COUNT(*)
+              FROM    {{rows}}
+          GROUP BY    guild_id, level
+                ON    CONFLICT (guild_id, level) DO UPDATE
+               SET    members = {self.table}_archive_levels.members + excluded.members
+        """
+        copied = ", ".join(self.copy_columns)
+
+        if self.dialect == "postgresql":
+            if returning:
+                counted = f"counted AS ({counts.format(rows='moved')}),"
+                result = "SELECT member_id, xp, active FROM moved"
+            else:
+                counted = ""
+                result = counts.format(rows="moved")
+            return [
+                f"""
+                WITH  moved AS (
+                          DELETE  FROM {source}
+                           WHERE  {where}
+                       RETURNING  {copied}
+                      ),
+                      {counted}
+                      copied AS (
+                          INSERT  INTO {target} ({copied})
+                          SELECT  {columns}
+                            FROM  moved
+                      )
+                {result}
+                """
+            ]
+
+        statements = [
+            counts.format(rows=f"{source} WHERE {where}"),
+            f"INSERT INTO {target} ({copied}) SELECT {columns} FROM {source} WHERE {where}",
+            f"DELETE FROM {source} WHERE {where}",
+        ]
+        if returning:
+            statements.insert(0, f"SELECT member_id, xp, active FROM {source} WHERE {where}")
+        return statements
+
+    @lru_cache(maxsize=None)
+    def archive_many(self, count: int) -> List[str]:
+        """Archives ``count`` members of a guild passed as :m0 .. :m{count-1}, unless they became active"""
+        placeholders = ", ".join(f":m{index}" for index in range(count))
+        where = f"guild_id = :guild_id AND member_id IN ({placeholders}) AND last_active < :cutoff"
+        return self._archive_move(
+            self.table, f"{self.table}_archive", where, "", ", ".join(self.copy_columns)
+        )
+
+    @lru_cache(maxsize=None)
+    def restore_many(self, count: int) -> List[str]:
+        """Restores ``count`` archived members of a guild passed as :m0 .. :m{count-1}"""
+        placeholders = ", ".join(f":m{index}" for index in range(count))
+        where = f"guild_id = :guild_id AND member_id IN ({placeholders})"
+        return self._archive_move(f"{self.table}_archive", self.table, where, "-", self.restored_columns)
+
+    @lru_cache(maxsize=None)
+    def archived_many(self, count: int) -> str:
+        """XP of those of ``count`` members passed as :m0 .. :m{count-1} who are archived"""
+        placeholders = ", ".join(f":m{index}" for index in range(count))
+        return f"""
+            SELECT  member_id, xp, active
+              FROM  {self.table}_archive
+             WHERE  guild_id = :guild_id
+               AND  member_id IN ({placeholders})
+        """
+
+    @lru_cache(maxsize=None)
+    def set_active_many(self, count: int) -> str:
+        """``set_active`` for ``count`` members passed as :m0 .. :m{count-1}"""
+        placeholders = ", ".join(f":m{index}" for index in range(count))
+        return f"""
+            UPDATE  {self.table}
+               SET  active = :active
+             WHERE  guild_id = :guild_id
+               AND  member_id IN ({placeholders})
+        """
+
+    @lru_cache(maxsize=None)
+    def member_data_many(self, count: int) -> str:
+        """XP and level of ``count`` members passed as :m0 .. :m{count-1}"""
+        placeholders = ", ".join(f":m{index}" for index in range(count))
+        return f"""
+            SELECT  member_id, xp, level, active
+              FROM  {self.table}
+             WHERE  guild_id = :guild_id
+               AND  member_id IN ({placeholders})
+        """
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from io import BytesIO
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from ._cache import TTLCache
+from ._scheduler import RenderScheduler
+from ._singleflight import SingleFlight
+from .metrics import CACHE_REQUESTS, CARD_BYTES, RANK_RESPONSES, RENDER_SECONDS
+from .tracing import span
+from .utils import get_member_data, get_member_rank
+
+log = logging.getLogger(__name__)
+
+RENDERER = RenderScheduler()
+# A render whose callers all gave up is cancelled, so the scheduler drops it if it did not start
+_renders = SingleFlight(cancel_abandoned=True)
+_session = None
+# card key -> CDN URL of the same card uploaded before
+_uploads = TTLCache(ttl=3600, max_size=10_000)
+
+# Seconds each stage of the rank pipeline may take
+DATA_TIMEOUT = 2.0
+IMAGE_TIMEOUT = 1.5
+RENDER_TIMEOUT = 5.0
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+# Uploaded cards are reused until this long before their CDN URL expires
+UPLOAD_EXPIRY_MARGIN = 300
+
+
+@dataclass
+class RankCard:
+    """
+    A rank response: the card to upload, the URL of the same card uploaded
+    before, or neither when the renderer is shedding and ``data`` should be
+    shown as ``rank_text``.
+    """
+
+    data: dict
+    image: Optional[BytesIO] = None
+    url: Optional[str] = None
+    key: Optional[str] = None
+
+
+async def _render(data) -> bytes:
+    # The imaging stack is only imported by processes that actually render
+    from .card import get_card
+
+    with span("render"), RENDER_SECONDS.time():
+        image = await asyncio.get_running_loop().run_in_executor(None, partial(get_card, data=data))
+
+    CARD_BYTES.observe(image.getbuffer().nbytes)
+    return image.getvalue()
+
+
+def configure_rendering(
+    workers: int = None,
+    shed_depth: int = None,
+    resume_depth: int = None,
+    shed_latency: float = None,
+    resume_latency: float = None,
+) -> RenderScheduler:
+    """
+    Configures the shared render scheduler.
+
+    workers: renders run at the same time
+    shed_depth, shed_latency: queued renders or average seconds per render at
+        which rank commands answer with text instead of a card
+    resume_depth, resume_latency: both must be back under these to render again
+    """
+    for name, value in (
+        ("workers", workers),
+        ("shed_depth", shed_depth),
+        ("resume_depth", resume_depth),
+        ("shed_latency", shed_latency),
+        ("resume_latency", resume_latency),
+    ):
+        if value is not None:
+            setattr(RENDERER, name, value)
+    return RENDERER
+
+
+async def render_card(data, guild_id: int = None) -> BytesIO:
+    """
+    Renders a rank card off the event loop, queued fairly with other guilds'
+    renders. Concurrent renders of the same data share one.
+    """
+    try:
+        key = ("render_card", frozenset(data.items()))
+    except TypeError:
+        # Unhashable extra data, e.g. from additional fields
+        return BytesIO(await RENDERER.run(guild_id, _render, data))
+
+    return BytesIO(await _renders.do(key, RENDERER.run, guild_id, _render, dict(data)))
+
+
+def rank_text(data) -> str:
+    """The text version of a rank card, for embeds while cards are shed"""
+    label = data.get("rank_label") or f"#{data['position']}"
+    filled = min(max(int(data["percentage"] // 10), 0), 10)
+    bar = "\u2588" * filled + "\u2591" * (10 - filled)
+    return (
+        f"**{label}** \u2022 Level **{data['level']}**\n"
+        f"`{bar}` {data['percentage']:.0f}%\n"
+        f"{data['xp']:,} / {data['next_level_xp']:,} XP"
+    )
+
+
+def window_text(window, member_id: int) -> str:
+    """Embed lines of a ``get_leaderboard_window`` window, the member's own in bold"""
+    lines = []
+    for position, entry in enumerate(window, start=window.start):
+        line = f"{position}. <@{entry.member_id}> - {entry.xp} XP"
+        lines.append(f"**{line}**" if entry.member_id == member_id else line)
+    return "\n".join(lines)
+
+
+async def _download(url: str) -> bytes:
+    global _session
+    # aiohttp comes with both discord.py and nextcord
+    import aiohttp
+
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=IMAGE_TIMEOUT))
+
+    async with _session.get(url) as response:
+        response.raise_for_status()
+        if (response.content_length or 0) > MAX_IMAGE_BYTES:
+            raise ValueError(f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+        return await response.read()
+
+
+async def close_rendering() -> None:
+    """Closes the HTTP session background images are downloaded with, the next download opens a new one"""
+    global _session
+    session, _session = _session, None
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def _stage(name: str, coro, timeout: float):
+    with span(name):
+        return await asyncio.wait_for(coro, timeout)
+
+
+async def _fetch_image(name: str, coro) -> Optional[bytes]:
+    """Image bytes, or None so the card falls back to its default"""
+    try:
+        return await _stage(name, coro, IMAGE_TIMEOUT)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.debug("Could not fetch %s: %r", name, e)
+        return None
+
+
+async def _no_image() -> None:
+    return None
+
+
+def _card_key(data) -> str:
+    """Hash of everything a card shows, its avatar and background go in by URL"""
+    visible = sorted((key, value) for key, value in data.items() if not key.endswith("_bytes"))
+    return hashlib.sha256(repr(visible).encode()).hexdigest()
+
+
+def _url_ttl(url: str) -> Optional[float]:
+    """Seconds until a signed CDN URL stops working, from its hex ``ex`` parameter"""
+    expires = parse_qs(urlsplit(url).query).get("ex")
+    if not expires:
+        return None
+    try:
+        return int(expires[0], 16) - time.time() - UPLOAD_EXPIRY_MARGIN
+    except ValueError:
+        return None
+
+
+def remember_upload(card: RankCard, message) -> None:
+    """Remembers the attachment URL of a sent card, so the same card is not uploaded again"""
+    if card.key is None or not getattr(message, "attachments", None):
+        return
+
+    url = message.attachments[0].url
+    ttl = _url_ttl(url)
+    if ttl is None or ttl > 0:
+        _uploads.set(card.key, url, ttl)
+
+
+async def rank_card(bot, member, guild_id: int, name: str, discriminator: str) -> RankCard:
+    """
+    Builds a member's rank response. The avatar is downloaded while the
+    member's data is read, their rank and background while it is ranked, and
+    every stage has its own deadline, so the card takes about as long as its
+    slowest stage rather than all of them together. Images that do not arrive
+    in time are replaced by the defaults.
+
+    A card identical to one uploaded before (and passed to ``remember_upload``)
+    is answered with its URL, without rendering. While the renderer is
+    overloaded, or when the render misses its deadline, there is no card and
+    the caller answers with ``rank_text``. Raises ValueError with a message
+    for the user when the member has no XP or their rank is not loaded in time.
+    """
+    shed = RENDERER.overloaded()
+    if shed:
+        avatar = asyncio.ensure_future(_no_image())
+    else:
+        avatar = asyncio.ensure_future(
+            _fetch_image("fetch_avatar", member.display_avatar.with_size(256).read())
+        )
+
+    background = None
+    try:
+        stats = await _stage("member_data", get_member_data(bot, member.id, guild_id), DATA_TIMEOUT)
+        if stats is None:
+            raise ValueError(f"{name} has no XP yet.")
+        data = stats.to_dict()
+
+        bg_url = data["bg_image"]
+        fetch_bg = bool(bg_url) and bg_url.startswith(("http://", "https://"))
+        if fetch_bg and not shed:
+            background = asyncio.ensure_future(_fetch_image("fetch_background", _download(bg_url)))
+        else:
+            background = asyncio.ensure_future(_no_image())
+
+        rank = await _stage(
+            "member_rank", get_member_rank(bot, member.id, guild_id, data["xp"]), DATA_TIMEOUT
+        )
+        data.update(rank)
+        data["name"] = name
+        data["descriminator"] = discriminator
+        data["profile_image"] = str(member.display_avatar.url)
+
+        key = _card_key(data)
+        url = _uploads.get(key)
+        CACHE_REQUESTS.inc(cache="card_upload", result="hit" if url else "miss")
+        if url is not None:
+            RANK_RESPONSES.inc(mode="reused")
+            return RankCard(data, url=url)
+        if shed:
+            RANK_RESPONSES.inc(mode="text")
+            return RankCard(data)
+
+        bg_bytes, profile_bytes = await asyncio.gather(background, avatar)
+    except asyncio.TimeoutError:
+        raise ValueError("Loading the rank took too long, please try again.")
+    finally:
+        avatar.cancel()
+        if background is not None:
+            background.cancel()
+
+    # Cards with a default image standing in for a late one are not reused
+    if profile_bytes is None or (fetch_bg and bg_bytes is None):
+        key = None
+    if fetch_bg and bg_bytes is None:
+        data["bg_image"] = None
+    data["bg_bytes"] = bg_bytes
+    data["profile_bytes"] = profile_bytes
+
+    try:
+        image = await asyncio.wait_for(render_card(data, guild_id), RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        RANK_RESPONSES.inc(mode="text")
+        return RankCard(data)
+
+    RANK_RESPONSES.inc(mode="card")
+    return RankCard(data, image=image, key=key)
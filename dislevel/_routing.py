@@ -0,0 +1,85 @@
+import logging
+import time
+from itertools import cycle
+from typing import Any, Hashable, List, Optional
+
+from ._cache import TTLCache
+from .metrics import DB_READS, REPLICA_FAILURES
+
+log = logging.getLogger(__name__)
+
+
+class DbRouter:
+    """
+    Routes reads to read replicas and everything else to the primary.
+
+    After a write, reads keyed by the same member are pinned to the primary
+    for ``pin_window`` seconds so members see their own writes despite
+    replication lag. A replica whose read fails is skipped for
+    ``retry_after`` seconds and the read is retried on the primary.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas: List[Any] = (),
+        pin_window: float = 5.0,
+        retry_after: float = 30.0,
+    ):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.retry_after = retry_after
+        self.pinned = TTLCache(pin_window, max_size=100_000)
+        self.down_until = {id(replica): 0.0 for replica in self.replicas}
+        self._next = cycle(self.replicas) if self.replicas else None
+
+    def note_write(self, key: Hashable) -> None:
+        """Pins reads of ``key`` to the primary, a guild id pins every ``(guild_id, member_id)``"""
+        if self.replicas:
+            self.pinned.set(key, True)
+
+    def _is_pinned(self, key: Hashable) -> bool:
+        return key in self.pinned or (isinstance(key, tuple) and key[0] in self.pinned)
+
+    def _replica(self) -> Optional[Any]:
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            if self.down_until[id(replica)] <= now:
+                return replica
+        return None
+
+    async def _read(self, method: str, query: str, values: dict, key: Hashable):
+        if not self.replicas:
+            DB_READS.inc(target="primary", reason="no_replica")
+            return await getattr(self.primary, method)(query, values)
+
+        if key is not None and self._is_pinned(key):
+            DB_READS.inc(target="primary", reason="pinned")
+            return await getattr(self.primary, method)(query, values)
+
+        replica = self._replica()
+        if replica is None:
+            DB_READS.inc(target="primary", reason="replicas_down")
+            return await getattr(self.primary, method)(query, values)
+
+        try:
+            result = await getattr(replica, method)(query, values)
+        except Exception as e:
+            REPLICA_FAILURES.inc()
+            self.down_until[id(replica)] = time.monotonic() + self.retry_after
+            log.warning("Read replica failed, falling back to the primary: %s", e)
+            DB_READS.inc(target="primary", reason="fallback")
+            return await getattr(self.primary, method)(query, values)
+
+        DB_READS.inc(target="replica", reason="routed")
+        return result
+
+    async def fetch_one(self, query: str, values: dict = dict(), key: Hashable = None):
+        return await self._read("fetch_one", query, values, key)
+
+    async def fetch_all(self, query: str, values: dict = dict(), key: Hashable = None):
+        return await self._read("fetch_all", query, values, key)
+
+    async def fetch_val(self, query: str, values: dict = dict(), key: Hashable = None):
+        return await self._read("fetch_val", query, values, key)
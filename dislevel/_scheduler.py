@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Hashable, Tuple, TypeVar
+
+from .metrics import RENDER_QUEUE, RENDER_QUEUE_DECISIONS, RENDER_SHEDDING
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RenderScheduler:
+    """
+    Runs card renders at most ``workers`` at a time, fairly across guilds.
+
+    Every guild has its own queue and guilds take turns, one render each,
+    so a raid in one guild delays its own cards, not everyone else's. Renders
+    whose caller stopped waiting are dropped before they start.
+
+    The scheduler starts shedding load once ``shed_depth`` renders are
+    queued or renders take ``shed_latency`` seconds from queueing to done (a
+    moving average), and stops once both are back under ``resume_depth`` and
+    ``resume_latency``. The gap between the two keeps it from flapping.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        shed_depth: int = 16,
+        resume_depth: int = 4,
+        shed_latency: float = 2.0,
+        resume_latency: float = 0.75,
+        smoothing: float = 0.2,
+    ):
+        self.workers = workers
+        self.shed_depth = shed_depth
+        self.resume_depth = resume_depth
+        self.shed_latency = shed_latency
+        self.resume_latency = resume_latency
+        self.smoothing = smoothing
+        self.queues: "OrderedDict[Hashable, Deque[Tuple]]" = OrderedDict()
+        self.queued = 0
+        self.running = 0
+        self.latency = 0.0
+        self.shedding = False
+
+    def overloaded(self) -> bool:
+        """Whether renders should be skipped right now"""
+        if not self.running and not self.queued:
+            # An idle renderer counts as a fast one, or shedding would never end
+            self.latency -= self.smoothing * self.latency
+
+        if not self.shedding and (self.queued >= self.shed_depth or self.latency >= self.shed_latency):
+            self.shedding = True
+            log.warning(
+                "Shedding rank card renders, %d queued, %.2fs average latency", self.queued, self.latency
+            )
+        elif self.shedding and self.queued <= self.resume_depth and self.latency <= self.resume_latency:
+            self.shedding = False
+            log.info("Rendering rank cards again, %d queued, %.2fs average latency", self.queued, self.latency)
+
+        RENDER_SHEDDING.set(int(self.shedding))
+        return self.shedding
+
+    async def run(self, guild_id: Hashable, func: Callable[..., Awaitable[T]], *args) -> T:
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(guild_id, deque()).append((future, func, args, time.perf_counter()))
+        self.queued += 1
+        RENDER_QUEUE.set(self.queued)
+
+        RENDER_QUEUE_DECISIONS.inc(decision="queued" if self.running >= self.workers else "immediate")
+        self._start_next()
+        return await future
+
+    def _start_next(self) -> None:
+        while self.running < self.workers and self.queues:
+            guild_id, queue = next(iter(self.queues.items()))
+            item = queue.popleft()
+            self.queued -= 1
+            RENDER_QUEUE.set(self.queued)
+
+            if queue:
+                # The guild goes to the back, behind every other guild with work
+                self.queues.move_to_end(guild_id)
+                if len(self.queues) > 1:
+                    RENDER_QUEUE_DECISIONS.inc(decision="yielded")
+            else:
+                del self.queues[guild_id]
+
+            if item[0].done():
+                RENDER_QUEUE_DECISIONS.inc(decision="dropped")
+                continue
+
+            self.running += 1
+            asyncio.ensure_future(self._run(*item))
+
+    async def _run(self, future: asyncio.Future, func, args, queued_at: float) -> None:
+        try:
+            result = await func(*args)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            if not future.done():
+                future.cancel()
+            self.running -= 1
+            elapsed = time.perf_counter() - queued_at
+            self.latency += self.smoothing * (elapsed - self.latency)
+            self._start_next()
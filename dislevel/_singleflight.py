@@ -0,0 +1,62 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from .metrics import COALESCED_REQUESTS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that ask for a key while
+    its call is in flight await that call and share its result or error.
+
+    Keys are tuples whose first item names the operation, for the metrics.
+    The call runs as its own task, so a caller that is cancelled (e.g. a timed
+    out interaction) does not cancel it for the others. With
+    ``cancel_abandoned``, the call is cancelled once every caller waiting for
+    it was, for work nobody should do once nobody waits for it.
+    """
+
+    def __init__(self, cancel_abandoned: bool = False):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.cancel_abandoned = cancel_abandoned
+        # call -> callers waiting for it, with ``cancel_abandoned``
+        self.waiters: Dict[asyncio.Future, int] = {}
+
+    def _done(self, key: Tuple, future: asyncio.Future) -> None:
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # Errors nobody waits for any more are not logged as never retrieved
+        if not future.cancelled():
+            future.exception()
+
+    def forget(self, match: Callable[[Tuple], bool]) -> None:
+        """
+        Lets later callers of the keys ``match`` accepts start a call of their
+        own, e.g. because a write made the running one stale. Callers already
+        waiting keep sharing it.
+        """
+        for key in [key for key in self.calls if match(key)]:
+            del self.calls[key]
+
+    async def do(self, key: Tuple, func: Callable[..., Awaitable[T]], *args) -> T:
+        future = self.calls.get(key)
+        if future is None:
+            future = self.calls[key] = asyncio.ensure_future(func(*args))
+            future.add_done_callback(lambda done: self._done(key, done))
+            COALESCED_REQUESTS.inc(operation=key[0], result="leader")
+        else:
+            COALESCED_REQUESTS.inc(operation=key[0], result="shared")
+
+        if not self.cancel_abandoned:
+            return await asyncio.shield(future)
+
+        self.waiters[future] = self.waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.waiters[future] -= 1
+            if not self.waiters[future]:
+                del self.waiters[future]
+                future.cancel()
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Runs a coroutine function every ``interval`` seconds until stopped. Started
+    with ``immediately``, it also runs once right away, and only then when
+    ``interval`` is None.
+    """
+
+    def __init__(self, name: str, interval: Optional[float], func: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, immediately: bool = False) -> None:
+        if not self.running:
+            self.task = asyncio.ensure_future(self._run(immediately))
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self, immediately: bool) -> None:
+        if immediately:
+            await self._once()
+        while self.interval is not None:
+            await asyncio.sleep(self.interval)
+            await self._once()
+
+    async def _once(self) -> None:
+        try:
+            await self.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Periodic task %s failed", self.name)
@@ -0,0 +1,253 @@
+import gzip
+import hmac
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from ._cache import TTLCache
+from .config import get_config
+from .metrics import API_REQUESTS
+from .periods import parse_period
+from .utils import get_leaderboard_data, get_leaderboard_window, get_member_data, get_member_rank
+
+log = logging.getLogger(__name__)
+
+# Deepest leaderboard row a page may reach, pages are cut from the top
+MAX_ROWS = 1000
+MAX_PER_PAGE = 100
+MAX_RADIUS = 25
+GZIP_MIN_BYTES = 1024
+
+
+class _RateLimiter:
+    """A token bucket per client, ``rate`` requests per ``per`` seconds"""
+
+    def __init__(self, rate: int, per: float, max_clients: int = 10_000):
+        self.rate = rate
+        self.per = per
+        # An idle bucket is full again after ``per`` seconds, so it can be forgotten
+        self.buckets = TTLCache(per, max_clients)
+
+    def retry_after(self, client: str) -> float:
+        """0 if the client may make a request now, otherwise seconds until it may"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(client, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - updated) * self.rate / self.per)
+
+        if tokens < 1:
+            self.buckets.set(client, (tokens, now))
+            return (1 - tokens) * self.per / self.rate
+        self.buckets.set(client, (tokens - 1, now))
+        return 0.0
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag[2:] == etag if tag.startswith("W/") else tag == etag:
+            return True
+    return False
+
+
+class LeaderboardApi:
+    """
+    Read only JSON API over one dislevel config.
+
+        GET /guilds/{guild_id}/leaderboard?page=1&per_page=25&period=week
+        GET /guilds/{guild_id}/members/{member_id}
+        GET /guilds/{guild_id}/members/{member_id}/around?radius=5
+
+    Responses carry an ETag made of the guild's version, which every XP or
+    membership write of this process moves. A request whose If-None-Match
+    still matches gets a 304 without touching the database, and bodies are
+    kept per URL and version, so repeated reads of an unchanged guild are
+    served from memory, gzipped when the client accepts it.
+
+    The API never fetches members over REST, so it cannot spend the bot's
+    rate limits. Guilds without member tracking list only members the bot
+    has cached, from a single read of the table.
+    """
+
+    def __init__(self, bot, rate: int = 10, per: float = 1.0, token: str = None, cache_size: int = 1000):
+        self.config = get_config(bot)
+        self.limiter = _RateLimiter(rate, per)
+        self.token = token
+        # URL -> (etag, body, gzipped body or None)
+        self.bodies = TTLCache(ttl=300, max_size=cache_size)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/guilds/{guild_id}/leaderboard", self.leaderboard)
+        app.router.add_get("/guilds/{guild_id}/members/{member_id}", self.member)
+        app.router.add_get("/guilds/{guild_id}/members/{member_id}/around", self.around)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "other"
+        response = await self._guarded(request, handler)
+        API_REQUESTS.inc(route=route, status=response.status)
+        return response
+
+    async def _guarded(self, request: web.Request, handler) -> web.StreamResponse:
+        if self.token is not None:
+            given = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(given.encode(), f"Bearer {self.token}".encode()):
+                return web.json_response({"error": "unauthorized"}, status=401)
+
+        retry_after = self.limiter.retry_after(request.remote or "")
+        if retry_after:
+            return web.json_response(
+                {"error": "rate limited"},
+                status=429,
+                headers={"Retry-After": str(max(int(retry_after + 0.999), 1))},
+            )
+
+        try:
+            return await handler(request)
+        except web.HTTPException as e:
+            return web.json_response({"error": e.reason}, status=e.status)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+    async def _respond(
+        self, request: web.Request, guild_id: int, build: Callable[[], Awaitable[object]]
+    ) -> web.Response:
+        etag = f'"{self.config.versions.get(guild_id)}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if _etag_matches(request.headers.get("If-None-Match"), etag):
+            return web.Response(status=304, headers=headers)
+
+        cached = self.bodies.get(request.path_qs)
+        if cached is not None and cached[0] == etag:
+            _, body, gzipped = cached
+        else:
+            body = json.dumps(await build(), separators=(",", ":")).encode()
+            gzipped = gzip.compress(body) if len(body) >= GZIP_MIN_BYTES else None
+            self.bodies.set(request.path_qs, (etag, body, gzipped))
+
+        if gzipped is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = gzipped
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    def _guild_id(self, request: web.Request) -> int:
+        guild_id = int(request.match_info["guild_id"])
+        if self.config.bot.get_guild(guild_id) is None:
+            raise web.HTTPNotFound(reason="unknown guild")
+        return guild_id
+
+    async def leaderboard(self, request: web.Request) -> web.Response:
+        guild_id = self._guild_id(request)
+        page = int(request.query.get("page", 1))
+        per_page = int(request.query.get("per_page", 25))
+        period = parse_period(request.query.get("period"), self.config)
+
+        if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+            raise ValueError(f"page must be at least 1 and per_page between 1 and {MAX_PER_PAGE}")
+        if page * per_page > MAX_ROWS:
+            raise ValueError(f"Only the top {MAX_ROWS} rows are served")
+
+        async def build():
+            leaderboard = await get_leaderboard_data(
+                self.config, guild_id, limit=page * per_page, period=period, fetch_members=False
+            )
+            start = (page - 1) * per_page
+            return {
+                "guild_id": str(guild_id),
+                "period": period,
+                "page": page,
+                "per_page": per_page,
+                "entries": [
+                    {
+                        "position": start + index + 1,
+                        "member_id": str(entry.member_id),
+                        "name": getattr(entry.member, "display_name", None),
+                        "xp": entry.xp,
+                        "level": None if period else int(max(entry.xp, 0) ** (1 / 5)),
+                    }
+                    for index, entry in enumerate(leaderboard[start:])
+                ],
+            }
+
+        return await self._respond(request, guild_id, build)
+
+    async def member(self, request: web.Request) -> web.Response:
+        guild_id = self._guild_id(request)
+        member_id = int(request.match_info["member_id"])
+
+        async def build():
+            stats = await get_member_data(self.config, member_id, guild_id)
+            if stats is None:
+                raise web.HTTPNotFound(reason="unknown member")
+            rank = await get_member_rank(self.config, member_id, guild_id, stats.xp)
+            return {
+                "guild_id": str(guild_id),
+                "member_id": str(member_id),
+                "xp": stats.xp,
+                "level": stats.level,
+                "percentage": stats.percentage,
+                "next_level_xp": stats.next_level_xp,
+                "active": bool(stats.active),
+                **rank,
+            }
+
+        return await self._respond(request, guild_id, build)
+
+    async def around(self, request: web.Request) -> web.Response:
+        guild_id = self._guild_id(request)
+        member_id = int(request.match_info["member_id"])
+        radius = int(request.query.get("radius", 5))
+        if not 1 <= radius <= MAX_RADIUS:
+            raise ValueError(f"radius must be between 1 and {MAX_RADIUS}")
+
+        async def build():
+            window = await get_leaderboard_window(
+                self.config, member_id, guild_id, radius, fetch_members=False
+            )
+            if window is None:
+                raise web.HTTPNotFound(reason="unknown member")
+            return {
+                "guild_id": str(guild_id),
+                "member_id": str(member_id),
+                "entries": [
+                    {
+                        "position": position,
+                        "member_id": str(entry.member_id),
+                        "name": getattr(entry.member, "display_name", None),
+                        "xp": entry.xp,
+                        "level": int(max(entry.xp, 0) ** (1 / 5)),
+                    }
+                    for position, entry in enumerate(window, start=window.start)
+                ],
+            }
+
+        return await self._respond(request, guild_id, build)
+
+
+async def start_api_server(
+    bot,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    rate: int = 10,
+    per: float = 1.0,
+    token: str = None,
+) -> web.AppRunner:
+    """
+    Serves ``LeaderboardApi`` for the bot (or a config), ``rate`` requests
+    per ``per`` seconds per client address. With ``token``, requests need an
+    ``Authorization: Bearer <token>`` header. Stop it with ``await runner.cleanup()``.
+    """
+    runner = web.AppRunner(LeaderboardApi(bot, rate, per, token).app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Serving dislevel API on http://%s:%s", host, port)
+    return runner
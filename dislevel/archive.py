@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from ._cache import TTLCache
+from ._tasks import PeriodicTask
+from .metrics import ARCHIVE_MOVES
+from .utils import _query, _written
+
+log = logging.getLogger(__name__)
+
+
+class MemberArchive:
+    """
+    Moves members without XP writes for ``after_days`` days from the table
+    into ``<table>_archive``, ``batch_size`` rows at a time every ``interval``
+    seconds, so the indexes rank and leaderboard queries walk only hold
+    members who are around.
+
+    Archived members are restored by the first read or write of their row
+    (``get_member_data``, ``update_xp`` and the like), and guilds are restored
+    as a whole before bulk operations. Archiving keeps a count of archived
+    members per guild and level, which ``get_member_rank`` adds to positions
+    when ``count_in_ranks`` is set. Archived members of the member's own level
+    count as ranked below them.
+    """
+
+    def __init__(
+        self,
+        config,
+        after_days: float,
+        interval: float = 3600,
+        batch_size: int = 1000,
+        count_in_ranks: bool = False,
+    ):
+        self.config = config
+        self.after = after_days * 86400
+        self.batch_size = batch_size
+        self.count_in_ranks = count_in_ranks
+        # guild id -> {level: archived members}
+        self.levels = TTLCache(60, max_size=100_000)
+        self.task = PeriodicTask("archive_inactive", interval, self.run)
+
+    async def run(self) -> int:
+        """Archives inactive members until none are left, returns how many were archived"""
+        config = self.config
+        cutoff = int(time.time() - self.after)
+        archived = 0
+
+        while True:
+            with _query("archive_candidates"):
+                rows = await config.database.fetch_all(
+                    config.queries.archive_candidates, {"cutoff": cutoff, "limit": self.batch_size}
+                )
+
+            by_guild: Dict[int, List] = defaultdict(list)
+            for row in rows:
+                by_guild[row["guild_id"]].append(row)
+            for guild_id, guild_rows in by_guild.items():
+                archived += await self._archive(guild_id, guild_rows, cutoff)
+
+            if len(rows) < self.batch_size:
+                break
+
+        if archived:
+            log.info("Archived %d inactive members of %s", archived, config.table_name)
+        return archived
+
+    async def _move(self, statements: List[str], values: dict) -> List:
+        """Runs ``_archive_move`` statements in one transaction, returns the rows moved"""
+        database = self.config.database
+        async with database.transaction():
+            moved = await database.fetch_all(statements[0], values)
+            for statement in statements[1:]:
+                await database.execute(statement, values)
+        return moved
+
+    async def _archive(self, guild_id: int, rows: List, cutoff: int) -> int:
+        """Archives those candidates still inactive at ``cutoff``, returns how many were archived"""
+        config = self.config
+        values = {f"m{index}": row["member_id"] for index, row in enumerate(rows)}
+        values.update(guild_id=guild_id, cutoff=cutoff)
+
+        with _query("archive_members"):
+            # Members who gained XP since they were picked are skipped
+            moved = await self._move(config.queries.archive_many(len(rows)), values)
+
+        if moved:
+            ARCHIVE_MOVES.inc(len(moved), direction="archived")
+            self._moved(guild_id, moved, config.ranking.record_remove if config.ranking else None)
+        return len(moved)
+
+    async def restore(self, guild_id: int, member_ids: List[int]) -> List[int]:
+        """Moves those of the members who are archived back, returns their IDs"""
+        config = self.config
+        values = {f"m{index}": member_id for index, member_id in enumerate(member_ids)}
+        values["guild_id"] = guild_id
+
+        with _query("archived_members"):
+            rows = await config.database.fetch_all(config.queries.archived_many(len(member_ids)), values)
+        if not rows:
+            return []
+
+        with _query("restore_members"):
+            # Another process may have restored some of them since
+            rows = await self._move(config.queries.restore_many(len(member_ids)), values)
+        if not rows:
+            return []
+
+        ARCHIVE_MOVES.inc(len(rows), direction="restored")
+        self._moved(guild_id, rows, config.ranking.record_add if config.ranking else None)
+        return [row["member_id"] for row in rows]
+
+    async def restore_guild(self, guild_id: int) -> None:
+        """Moves every archived member of a guild back, e.g. before resetting its XP"""
+        config = self.config
+        with _query("restore_guild"):
+            async with config.database.transaction():
+                for statement in config.queries.restore_guild:
+                    await config.database.execute(statement, {"guild_id": guild_id})
+
+        if config.ranking is not None:
+            config.ranking.invalidate(guild_id)
+        self._moved(guild_id, [], None)
+
+    def _moved(self, guild_id: int, rows: List, record) -> None:
+        """Brings the caches of a guild in step with rows that left or entered the table"""
+        config = self.config
+        for row in rows:
+            _written(config, guild_id, row["member_id"])
+            if record is not None and row["active"]:
+                record(guild_id, row["xp"])
+
+        _written(config, guild_id)
+        if config.snapshot is not None:
+            config.snapshot.invalidate(guild_id)
+        self.levels.pop(guild_id)
+
+    async def counts_above(self, guild_id: int, level: int) -> Tuple[int, int]:
+        """Archived members of a guild above ``level``, and in total"""
+        levels = self.levels.get(guild_id)
+        if levels is None:
+            with _query("archived_levels"):
+                rows = await self.config.database.fetch_all(
+                    self.config.queries.archived_levels, {"guild_id": guild_id}
+                )
+            levels = {row["level"]: row["members"] for row in rows}
+            self.levels.set(guild_id, levels)
+
+        above = sum(members for archived_level, members in levels.items() if archived_level > level)
+        return above, sum(levels.values())
+
+    def start(self) -> None:
+        self.task.start()
+
+    def stop(self) -> None:
+        self.task.stop()
@@ -1,7 +1,9 @@
 import os
 import re
+from io import BytesIO
 
 from easy_pil import Canvas, Editor, Font, load_image
+from PIL import Image
 from numerize.numerize import numerize
 
 URL_REGEX = re.compile(
@@ -9,11 +11,27 @@ URL_REGEX = re.compile(
 )
 
 
+def _open(image_bytes: bytes):
+    return Image.open(BytesIO(image_bytes)).convert("RGBA")
+
+
 def get_card(data):
-    profile_image = load_image(data["profile_image"])
+    # Images downloaded ahead by the rank pipeline are passed as bytes
+    if data.get("profile_bytes"):
+        profile_image = _open(data["profile_bytes"])
+    elif "profile_bytes" in data:
+        # The avatar did not arrive in time, a blank one beats a blocking download
+        profile_image = Canvas((200, 200), color=(47, 49, 54, 255))
+    else:
+        profile_image = load_image(data["profile_image"])
     profile = Editor(profile_image).resize((200, 200))
 
-    if data["bg_image"] and URL_REGEX.match(data["bg_image"]):
+    if data.get("bg_bytes"):
+        try:
+            bg_image = _open(data["bg_bytes"])
+        except Exception as e:
+            bg_image = os.path.join(os.path.dirname(__file__), "assets", "bg.png")
+    elif data["bg_image"] and URL_REGEX.match(data["bg_image"]):
         try:
             bg_image = load_image(data["bg_image"])
         except Exception as e:
@@ -60,7 +78,7 @@ def get_card(data):
     )
     background.text(
         (875, 42),
-        f'#{data["position"]}',
+        data.get("rank_label") or f'#{data["position"]}',
         font=Font.montserrat(size=45),
         color="#ffffff",
         align="right",
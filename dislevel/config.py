@@ -0,0 +1,83 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, List, Optional, Set
+
+from ._cache import VersionCounter
+from ._db_adapter import DbAdapter
+from ._models import Field
+from ._queries import Queries
+from ._routing import DbRouter
+from ._singleflight import SingleFlight
+from ._tasks import PeriodicTask
+from .members import MemberResolver
+from .ranking import RankEstimator
+
+if TYPE_CHECKING:
+    from .archive import MemberArchive
+    from .global_xp import GlobalLeaderboard
+    from .journal import XpJournal
+    from .periods import PeriodRollup
+    from .rewards import RewardsEngine
+    from .snapshot import LeaderboardSnapshot
+    from .voice import VoiceTracker
+
+DEFAULT_LEADERBOARD_ICON = "https://cdn.discordapp.com/attachments/776345413132877854/974390375026401320/360_F_385427790_M4qA77J7nYgZCMP6Ezn9qo6PglF0j4mv-removebg-preview.png"
+
+
+def get_dialect(database) -> str:
+    """The SQL dialect behind an asyncpg adapter or a ``databases.Database``"""
+    if isinstance(database, DbAdapter):
+        return "postgresql"
+
+    url = getattr(database, "url", None)
+    return getattr(url, "dialect", None) or "postgresql"
+
+
+@dataclass
+class DislevelConfig:
+    """
+    Everything one dislevel instance needs: its database, table and the SQL
+    statements prebuilt for them. ``init_dislevel`` attaches one to the bot as
+    ``bot.dislevel_config``. Every ``dislevel.utils`` function accepts either
+    the bot or a config, so several instances can share a process or a bot.
+    """
+
+    bot: Any
+    database: Any
+    table_name: str = "dislevel_data"
+    dialect: str = "postgresql"
+    additional_fields: List[Field] = field(default_factory=list)
+    leaderboard_icon_url: str = DEFAULT_LEADERBOARD_ICON
+    track_members: bool = False
+    # Guilds whose active flags were reconciled with their member list since startup
+    reconciled: Set[int] = field(default_factory=set)
+    partitions: Optional[int] = None
+    queries: Queries = None
+    reads: DbRouter = None
+    member_resolver: MemberResolver = field(default_factory=MemberResolver)
+    flights: SingleFlight = field(default_factory=SingleFlight)
+    versions: VersionCounter = field(default_factory=VersionCounter)
+    reconciler: Optional[PeriodicTask] = None
+    voice: Optional["VoiceTracker"] = None
+    ranking: Optional[RankEstimator] = None
+    rank_display: str = "position"
+    snapshot: Optional["LeaderboardSnapshot"] = None
+    periods: Optional["PeriodRollup"] = None
+    journal: Optional["XpJournal"] = None
+    rewards: Optional["RewardsEngine"] = None
+    global_xp: Optional["GlobalLeaderboard"] = None
+    archive: Optional["MemberArchive"] = None
+
+    def __post_init__(self):
+        if self.reads is None:
+            self.reads = DbRouter(self.database)
+        if self.queries is None:
+            self.queries = Queries(
+                self.table_name, self.dialect, self.additional_fields, self.partitions
+            )
+
+
+def get_config(bot) -> DislevelConfig:
+    """Returns the config of a bot, configs are passed through"""
+    if isinstance(bot, DislevelConfig):
+        return bot
+    return bot.dislevel_config
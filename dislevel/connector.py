@@ -1,11 +1,21 @@
-import os
 from typing import List
 
-from typing_extensions import Literal
+try:
+    from typing import Literal
+except ImportError:  # Python 3.7
+    from typing_extensions import Literal
 
 from ._db_adapter import DbAdapter
 from ._models import Field
-from .utils import prepare_db
+from ._routing import DbRouter
+from ._tasks import PeriodicTask
+from .archive import MemberArchive
+from .periods import PeriodRollup
+from .ranking import RankEstimator
+from .rewards import RewardsEngine
+from .config import DEFAULT_LEADERBOARD_ICON, DislevelConfig, get_dialect
+from .utils import prepare_db, reconcile_members
+from .voice import VoiceTracker
 
 
 async def init_dislevel(
@@ -15,17 +25,158 @@ async def init_dislevel(
     table_name: str = None,
     additional_fields: List[Field] = list(),
     leaderboard_icon_url: str = None,
-):
+    track_members: bool = None,
+    reconcile_interval: float = None,
+    partitions: int = None,
+    read_databases: list = (),
+    read_your_writes: float = 5.0,
+    voice_xp_per_minute: float = None,
+    voice_flush_interval: float = 60.0,
+    approximate_ranks: bool = False,
+    exact_top: int = 1000,
+    rank_display: Literal["position", "percentile"] = "position",
+    leaderboard_snapshot: int = None,
+    period_leaderboards: bool = False,
+    period_retention: int = 2,
+    xp_journal: bool = False,
+    journal_keep_days: float = 30,
+    level_rewards: bool = False,
+    stack_rewards: bool = True,
+    global_leaderboard: bool = False,
+    archive_after_days: float = None,
+    archive_interval: float = 3600,
+    count_archived: bool = False,
+    attach: bool = True,
+) -> DislevelConfig:
+    """
+    Prepares the database and attaches dislevel to the bot.
+
+    track_members: keep an ``active`` flag per row from member join/leave events so
+        leaderboards need no REST validation. Defaults to whether the members intent is on.
+        The flags of chunked guilds are reconciled with their gateway member lists once the
+        bot is ready, guilds are validated over REST until theirs are.
+    reconcile_interval: seconds between reconciling the flags again, only on startup when None.
+    partitions: create a new table hash partitioned by guild into this many
+        partitions (Postgres only). Existing tables are moved with ``dislevel.migrate``.
+    read_databases: read replicas (pools or Databases of the same driver) that rank,
+        leaderboard and member data reads are routed to. Failed replicas fall back to the primary.
+    read_your_writes: seconds a member's reads stay on the primary after they wrote.
+    voice_xp_per_minute: award this much XP per minute spent unmuted in voice channels,
+        written in batches every ``voice_flush_interval`` seconds. Disabled when None.
+    approximate_ranks: estimate ranks outside the top ``exact_top`` from per-guild XP
+        histograms instead of counting rows, for guilds with millions of members.
+    rank_display: show approximate ranks on cards as a position or as "Top 3%".
+    leaderboard_snapshot: keep the top this many rows of every guild in a ``<table>_top``
+        table that XP writes update only when they cross its lowest score, and serve
+        leaderboards from it. Check or rebuild it with ``dislevel.snapshot``.
+    period_leaderboards: also keep XP per week, month and season (calendar quarter)
+        for period leaderboards and ranks. Gains are written in batches every few seconds.
+    period_retention: how many buckets of each period are kept, the current one included.
+    xp_journal: append every XP change to a ``<table>_journal`` table in batches, for
+        history, reverting and rebuilding balances with ``dislevel.journal``.
+    journal_keep_days: days of events kept before they are folded into checkpoints.
+    level_rewards: grant the roles set with ``dislevel.rewards.set_level_reward`` (or the
+        ``setreward`` command) on level-ups, with rate limited role edits coalesced per member.
+    stack_rewards: keep the rewards of lower levels, otherwise members only have the highest.
+    global_leaderboard: keep every member's XP summed over all guilds in a ``<table>_global``
+        table, updated with each XP write, for ``dislevel.global_xp`` ranks and leaderboards.
+        An empty table is filled from the guild rows, check or rebuild it with ``dislevel.global_xp``.
+    archive_after_days: move members without XP writes for this many days to a ``<table>_archive``
+        table every ``archive_interval`` seconds. They are restored when their row is read or
+        written again. Disabled when None.
+    count_archived: add archived members of higher levels to rank positions.
+    attach: set the config as ``bot.dislevel_config``. Pass False for additional
+        instances (e.g. a second table) and hand the returned config to ``dislevel.utils``.
+    """
     if driver == "asyncpg":
-        database = DbAdapter(database)
+        database = DbAdapter(database, read_databases)
+        replicas = database.replicas
     else:
         database = database
+        replicas = list(read_databases)
+
+    if track_members is None:
+        intents = getattr(bot, "intents", None)
+        track_members = bool(intents and intents.members)
 
-    bot.dislevel_database = database
-    os.environ["DISLEVEL_TABLE"] = table_name or "dislevel_data"
-    os.environ["DISLEVEL_LEADERBOARD_ICON"] = (
-        leaderboard_icon_url
-        or "https://cdn.discordapp.com/attachments/776345413132877854/974390375026401320/360_F_385427790_M4qA77J7nYgZCMP6Ezn9qo6PglF0j4mv-removebg-preview.png"
+    config = DislevelConfig(
+        bot=bot,
+        database=database,
+        table_name=table_name or "dislevel_data",
+        dialect=get_dialect(database),
+        additional_fields=list(additional_fields),
+        leaderboard_icon_url=leaderboard_icon_url or DEFAULT_LEADERBOARD_ICON,
+        track_members=track_members,
+        partitions=partitions,
+        reads=DbRouter(database, replicas, pin_window=read_your_writes),
+        ranking=RankEstimator(exact_top) if approximate_ranks else None,
+        rank_display=rank_display,
     )
 
-    await prepare_db(database, additional_fields)
+    if level_rewards:
+        config.rewards = RewardsEngine(config, stack=stack_rewards)
+    if period_leaderboards:
+        config.periods = PeriodRollup(config, retention=period_retention)
+
+    # Imported here so ``python -m dislevel.journal``, ``python -m dislevel.snapshot`` and
+    # ``python -m dislevel.global_xp`` do not find their module imported already
+    if xp_journal:
+        from .journal import XpJournal
+
+        config.journal = XpJournal(config, keep_days=journal_keep_days)
+
+    if leaderboard_snapshot:
+        from .snapshot import LeaderboardSnapshot
+
+        config.snapshot = LeaderboardSnapshot(leaderboard_snapshot)
+
+    if archive_after_days is not None:
+        config.archive = MemberArchive(
+            config, after_days=archive_after_days, interval=archive_interval, count_in_ranks=count_archived
+        )
+
+    if global_leaderboard:
+        from .global_xp import GlobalLeaderboard
+
+        config.global_xp = GlobalLeaderboard()
+
+    if attach:
+        previous = getattr(bot, "dislevel_config", None)
+        if previous is not None and previous.reconciler is not None:
+            previous.reconciler.stop()
+        if previous is not None and previous.voice is not None:
+            await previous.voice.close()
+        if previous is not None and previous.periods is not None:
+            await previous.periods.close()
+        if previous is not None and previous.journal is not None:
+            await previous.journal.close()
+        if previous is not None and previous.rewards is not None:
+            previous.rewards.stop()
+        if previous is not None and previous.archive is not None:
+            previous.archive.stop()
+
+        bot.dislevel_config = config
+        bot.dislevel_database = database
+
+    await prepare_db(config)
+
+    if track_members:
+        config.reconciler = PeriodicTask(
+            "reconcile_members", reconcile_interval, lambda: reconcile_members(config)
+        )
+        config.reconciler.start(immediately=True)
+
+    if voice_xp_per_minute:
+        config.voice = VoiceTracker(
+            config, xp_per_minute=voice_xp_per_minute, flush_interval=voice_flush_interval
+        )
+        config.voice.start()
+
+    if config.periods is not None:
+        config.periods.start()
+    if config.journal is not None:
+        config.journal.start()
+    if config.archive is not None:
+        config.archive.start()
+
+    return config
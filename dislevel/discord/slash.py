@@ -1,21 +1,29 @@
-import os
-import discord
-from typing import Optional, Union
+import logging
+from typing import Literal, Optional, Union
 
-from discord import Embed, File, Interaction, Member, app_commands
+from discord import Embed, File, Interaction, Member, Role, User, VoiceState, app_commands
 from discord.ext import commands
-from easy_pil.utils import run_in_executor
 
-from ..card import get_card
+from .._render import close_rendering, rank_card, rank_text, remember_upload, window_text
+from ..global_xp import get_global_rank
+from ..periods import leaderboard_title, parse_period
+from ..rewards import get_level_rewards, remove_level_reward, set_level_reward
+from ..tracing import span, trace
 from ..utils import (
     get_leaderboard_data,
-    get_member_data,
-    get_member_position,
+    get_leaderboard_window,
+    handle_cog_load,
+    handle_cog_unload,
+    handle_member_join,
+    handle_member_remove,
+    handle_voice_state_update,
+    reset_guild_xp,
+    scale_guild_xp,
     set_bg_image,
+    transfer_xp,
 )
 
-# Confirm import works
-print(f"DEBUG: Imported discord module: {discord.__name__}")
+log = logging.getLogger(__name__)
 
 
 class LevelingSlash(commands.Cog):
@@ -23,6 +31,23 @@ class LevelingSlash(commands.Cog):
 
     def __init__(self, bot: Union[commands.Bot, commands.AutoShardedBot]):
         self.bot = bot
+        handle_cog_load(bot)
+
+    async def cog_unload(self):
+        await handle_cog_unload(self.bot)
+        await close_rendering()
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: Member):
+        await handle_member_remove(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: Member):
+        await handle_member_join(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        await handle_voice_state_update(self.bot, member, before, after)
 
     @app_commands.command(description="Check rank of a user")
     @app_commands.allowed_installs(guilds=True, users=True)  # Allow both guild and user installations
@@ -31,84 +56,168 @@ class LevelingSlash(commands.Cog):
         """Check rank of a user"""
         member = member or interaction.user
 
-        # Fetch user data
-        user_data = await get_member_data(self.bot, member.id, interaction.guild.id)
-        user_data["position"] = await get_member_position(self.bot, member.id, interaction.guild.id)
-        user_data["profile_image"] = str(member.display_avatar.url)
-
-        # Handle username and discriminator
-        user_data["name"] = member.name
-        user_data["descriminator"] = member.discriminator or "0000"  # Default if no discriminator
-
-        # Generate the rank card
-        image = await run_in_executor(get_card, data=user_data)
-        file = File(fp=image, filename="card.png")
-
-        await interaction.response.send_message(file=file)
+        # Deferring first keeps slow cards clear of the 3 second interaction deadline
+        await interaction.response.defer()
+
+        with trace("rank", guild_id=interaction.guild.id):
+            try:
+                card = await rank_card(
+                    self.bot, member, interaction.guild.id, member.name, member.discriminator or "0000"
+                )
+            except ValueError as e:
+                return await interaction.followup.send(str(e))
+
+            if card.url is not None:
+                # The same card was uploaded before, its attachment is still valid
+                return await interaction.followup.send(embed=Embed().set_image(url=card.url))
+            if card.image is None:
+                # The renderer is overloaded, a text rank is cheap
+                embed = Embed(title=member.display_name, description=rank_text(card.data))
+                return await interaction.followup.send(embed=embed)
+
+            with span("upload"):
+                message = await interaction.followup.send(file=File(fp=card.image, filename="card.png"))
+            remember_upload(card, message)
 
     @app_commands.command(description="See the server leaderboard")
     @app_commands.allowed_installs(guilds=True, users=True)  # Allow both guild and user installations
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)  # Allow usage in all contexts
-    async def leaderboard(self, interaction: Interaction):
-        """See the server leaderboard"""
-        print("DEBUG: Starting leaderboard command execution.")
+    async def leaderboard(
+        self, interaction: Interaction, period: Optional[Literal["week", "month", "season"]] = None
+    ):
+        """See the server leaderboard of all time, this week, month or season"""
+        try:
+            period = parse_period(period, self.bot.dislevel_config)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
 
         try:
             await interaction.response.defer()
-            print("DEBUG: Deferred interaction response.")
-
-            leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id)
-            print(f"DEBUG: Retrieved leaderboard data: {leaderboard_data}")
-
-            embed = Embed(title="Leaderboard", description="")
-            embed.set_thumbnail(url=os.environ.get("DISLEVEL_LEADERBOARD_ICON", ""))
-
-            position = 0
-            skipped_members = []
-
-            for data in leaderboard_data:
-                try:
-                    print(f"DEBUG: Processing member ID {data['member_id']}")
-                    member = interaction.guild.get_member(data["member_id"]) or await interaction.guild.fetch_member(data["member_id"])
-
-                    position += 1
-                    embed.description += f"{position}. {member.mention} - {data['xp']} XP\n"
-                    print(f"DEBUG: Successfully added member {member} to leaderboard.")
-
-                except discord.NotFound:
-                    skipped_members.append(data["member_id"])
-                    print(f"WARNING: Member ID {data['member_id']} not found. Skipping.")
-                except discord.Forbidden:
-                    skipped_members.append(data["member_id"])
-                    print(f"WARNING: Insufficient permissions to fetch member ID {data['member_id']}. Skipping.")
-                except discord.HTTPException as e:
-                    skipped_members.append(data["member_id"])
-                    print(f"WARNING: API error when fetching member {data['member_id']}: {e}")
-                except Exception as e:
-                    skipped_members.append(data["member_id"])
-                    print(f"ERROR: Unexpected error with member ID {data['member_id']}: {e}")
-
-            print(f"DEBUG: Total skipped members: {len(skipped_members)}")
-            print(f"DEBUG: Skipped member IDs: {skipped_members}")
-
-            if position == 0:
-                embed.description = "No valid members found for leaderboard."
-                print("DEBUG: No valid members found for leaderboard.")
-
-            print(f"DEBUG: Successfully generated leaderboard with {position} members.")
-            await interaction.followup.send(embed=embed)
-
-        except Exception as e:
-            print(f"ERROR: Unexpected error in leaderboard command: {e}")
+
+            with trace("leaderboard", guild_id=interaction.guild.id):
+                leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id, period=period)
+
+                embed = Embed(title=leaderboard_title(period), description="")
+                embed.set_thumbnail(url=self.bot.dislevel_config.leaderboard_icon_url)
+
+                for position, data in enumerate(leaderboard_data, start=1):
+                    embed.description += f"{position}. <@{data['member_id']}> - {data['xp']} XP\n"
+
+                if not leaderboard_data:
+                    embed.description = "No valid members found for leaderboard."
+
+                with span("respond"):
+                    await interaction.followup.send(embed=embed)
+
+        except Exception:
+            log.exception("Unexpected error in leaderboard command")
             await interaction.followup.send(
                 "An error occurred while retrieving the leaderboard. Please try again later.",
                 ephemeral=True,
             )
-        finally:
-            print("DEBUG: Finished leaderboard command execution.")
+
+    @app_commands.command(description="See the members ranked right above and below a member")
+    async def around(self, interaction: Interaction, member: Optional[Member] = None):
+        """See the members ranked right above and below you or another member"""
+        member = member or interaction.user
+
+        with trace("around", guild_id=interaction.guild.id):
+            window = await get_leaderboard_window(self.bot, member.id, interaction.guild.id)
+            if window is None:
+                return await interaction.response.send_message(
+                    f"{member.display_name} has no XP yet.", ephemeral=True
+                )
+
+            embed = Embed(title=f"Around {member.display_name}", description=window_text(window, member.id))
+            with span("respond"):
+                await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(description="Check a user's rank over every server of the bot")
+    async def globalrank(self, interaction: Interaction, member: Optional[Member] = None):
+        """Check a user's rank over every server of the bot"""
+        member = member or interaction.user
+
+        with trace("globalrank", guild_id=interaction.guild.id):
+            try:
+                rank = await get_global_rank(self.bot, member.id)
+            except ValueError as e:
+                return await interaction.response.send_message(str(e), ephemeral=True)
+            if rank is None:
+                return await interaction.response.send_message(
+                    f"{member.display_name} has no XP yet.", ephemeral=True
+                )
+
+            embed = Embed(
+                title=f"{member.display_name} globally",
+                description=f"**{rank['rank_label']}** \u2022 Level **{rank['level']}**\n{rank['xp']:,} XP",
+            )
+            with span("respond"):
+                await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(description="Reset the XP of every member of the server")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def resetxp(self, interaction: Interaction):
+        """Reset the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("resetxp", guild_id=interaction.guild.id):
+            await reset_guild_xp(self.bot, interaction.guild.id)
+            await interaction.followup.send("XP of every member has been reset.")
+
+    @app_commands.command(description="Multiply the XP of every member, e.g. 0.5 to halve it")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def scalexp(self, interaction: Interaction, factor: app_commands.Range[float, 0]):
+        """Multiply the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("scalexp", guild_id=interaction.guild.id):
+            await scale_guild_xp(self.bot, interaction.guild.id, factor)
+            await interaction.followup.send(f"XP of every member has been multiplied by {factor:g}.")
+
+    @app_commands.command(description="Move all XP of an account to a member")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def transferxp(self, interaction: Interaction, source: User, target: Member):
+        """Move all XP of an account (e.g. an old one) to a member"""
+        moved = await transfer_xp(self.bot, interaction.guild.id, source.id, target.id, delete_source=True)
+        await interaction.response.send_message(f"Moved {moved} XP from {source.mention} to {target.mention}.")
+
+    @app_commands.command(description="Grant a role to members who reach a level")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def setreward(self, interaction: Interaction, level: app_commands.Range[int, 1], role: Role):
+        """Grant a role to members who reach a level"""
+        try:
+            await set_level_reward(self.bot, interaction.guild.id, level, role.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        embed = Embed(description=f"Members reaching level {level} will get {role.mention}.")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(description="Stop granting a role as a level reward")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def removereward(self, interaction: Interaction, role: Role):
+        """Stop granting a role as a level reward"""
+        try:
+            await remove_level_reward(self.bot, interaction.guild.id, role.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        embed = Embed(description=f"{role.mention} is no longer a level reward.")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(description="Show the level reward roles of the server")
+    @app_commands.guild_only()
+    async def rewards(self, interaction: Interaction):
+        """Show the level reward roles of the server"""
+        try:
+            rewards = await get_level_rewards(self.bot, interaction.guild.id)
+        except ValueError as e:
+            return await interaction.response.send_message(str(e), ephemeral=True)
+        lines = [f"Level {level}: <@&{role_id}>" for level, role_id in rewards]
+        embed = Embed(title="Level rewards", description="\n".join(lines) or "No level rewards yet.")
+        await interaction.response.send_message(embed=embed)
 
 
 async def setup(bot: commands.Bot):
-    print("DEBUG: Loading LevelingSlash cog.")
-    await bot.add_cog(LevelingSlash(bot))
-    print("DEBUG: LevelingSlash cog loaded.")
\ No newline at end of file
+    await bot.add_cog(LevelingSlash(bot))
\ No newline at end of file
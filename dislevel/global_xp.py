@@ -0,0 +1,157 @@
+"""
+Checks or rebuilds the global leaderboard table of a dislevel table.
+
+    python -m dislevel.global_xp postgresql://localhost/bot
+    python -m dislevel.global_xp sqlite:///leveling.db --rebuild
+
+Totals are kept up to date by the processes that write XP, in the same
+transaction as the guild rows, so they only drift when rows change outside
+dislevel or were written while the global leaderboard was off.
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from ._cli import connect
+from ._models import Leaderboard
+from .archive import MemberArchive
+from .config import DislevelConfig, get_config, get_dialect
+from .utils import _query
+
+log = logging.getLogger(__name__)
+
+
+class GlobalLeaderboard:
+    """
+    Keeps every member's XP summed over all guilds in a ``<table>_global``
+    table, indexed by XP for the global top and ranks.
+
+    XP writes add their change to the member's total with an upsert that
+    runs in the write's transaction, bulk operations add the change of a whole
+    chunk with one ``INSERT ... SELECT``. Nothing is summed at read time.
+    Levels follow from the total like guild levels do, so only XP is stored.
+    """
+
+    async def record(self, config: DislevelConfig, deltas: Dict[int, int]) -> None:
+        """Adds ``{member_id: xp change}`` to the totals, call inside the write's transaction"""
+        values = [{"member_id": member_id, "xp": delta} for member_id, delta in deltas.items() if delta]
+        if values:
+            with _query("global_add"):
+                await config.database.execute_many(config.queries.global_add, values)
+
+    async def seed(self, config: DislevelConfig) -> None:
+        """Fills an empty table from the guild rows, e.g. when it was just created"""
+        if await config.database.fetch_val(config.queries.global_any) is None:
+            await self.rebuild(config)
+
+    async def rebuild(self, config: DislevelConfig) -> None:
+        """Recomputes every total from the guild rows, one pass over the table"""
+        with _query("global_rebuild"):
+            async with config.database.transaction():
+                await config.database.execute(config.queries.global_clear)
+                await config.database.execute(config.queries.global_fill(config.archive is not None))
+        log.info("Rebuilt the global leaderboard of %s", config.table_name)
+
+
+def _global(config: DislevelConfig) -> GlobalLeaderboard:
+    if config.global_xp is None:
+        raise ValueError("The global leaderboard is not enabled on this bot")
+    return config.global_xp
+
+
+def _level(xp: int) -> int:
+    return int(max(xp, 0) ** (1 / 5))
+
+
+async def get_global_leaderboard(bot, limit: int = 10, offset: int = 0) -> Leaderboard:
+    """
+    The members with the most XP over every guild. Rows carry the cached
+    user (``bot.get_user``) as their ``member``, or None.
+    """
+    config = get_config(bot)
+    _global(config)
+
+    with _query("global_leaderboard"):
+        rows = await config.reads.fetch_all(
+            config.queries.global_leaderboard, {"limit": limit, "offset": offset}
+        )
+
+    get_user = getattr(config.bot, "get_user", None)
+    leaderboard = Leaderboard(start=offset + 1)
+    for row in rows:
+        leaderboard.append(row["member_id"], row["xp"], get_user(row["member_id"]) if get_user else None)
+    return leaderboard
+
+
+async def get_global_rank(bot, member_id: int) -> Optional[dict]:
+    """A member's XP over every guild, its level and global position, None without XP"""
+    config = get_config(bot)
+    _global(config)
+
+    with _query("global_rank"):
+        xp = await config.reads.fetch_val(config.queries.global_xp, {"member_id": member_id})
+        if xp is None:
+            return None
+        position = await config.reads.fetch_val(config.queries.global_position, {"xp": xp})
+
+    return {"xp": xp, "level": _level(xp), "position": position, "rank_label": f"#{position}"}
+
+
+async def check_global(bot) -> Dict[int, Tuple[Optional[int], int]]:
+    """
+    Compares the totals with the guild rows, returns
+    ``{member_id: (stored xp, expected xp)}`` for every member that differs.
+    """
+    config = get_config(bot)
+    rows = await config.database.fetch_all(config.queries.global_drift(config.archive is not None))
+    return {row["member_id"]: (row["stored"], row["expected"]) for row in rows}
+
+
+async def rebuild_global(bot) -> None:
+    """Recomputes the global totals from the guild rows, e.g. after writes outside dislevel"""
+    config = get_config(bot)
+    await _global(config).rebuild(config)
+
+
+async def _main(args) -> None:
+    database, close = await connect(args.url)
+    try:
+        config = DislevelConfig(
+            bot=None,
+            database=database,
+            table_name=args.table,
+            dialect=get_dialect(database),
+            global_xp=GlobalLeaderboard(),
+        )
+        if args.archive:
+            # Only whether there is one matters here
+            config.archive = MemberArchive(config, after_days=0)
+        for statement in config.queries.create_global:
+            await database.execute(statement)
+
+        drifted = await check_global(config)
+        log.info("%d members drifted", len(drifted))
+        if args.rebuild:
+            await rebuild_global(config)
+    finally:
+        await close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("url", help="postgresql:// connection string or databases URL")
+    parser.add_argument("--table", default="dislevel_data")
+    parser.add_argument("--archive", action="store_true", help="the table archives inactive members")
+    parser.add_argument(
+        "--rebuild", action="store_true", help="recompute every total instead of only reporting drift"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Inspects and corrects XP with the XP journal of a dislevel table.
+
+    python -m dislevel.journal sqlite:///leveling.db history 1234 5678
+    python -m dislevel.journal postgresql://localhost/bot revert 1234 --since 2024-05-01T18:00 --until 2024-05-01T19:00
+    python -m dislevel.journal postgresql://localhost/bot rebuild 1234
+    python -m dislevel.journal postgresql://localhost/bot compact --keep-days 30
+
+Balances are the member's checkpoint plus every journaled change after it.
+``revert`` subtracts the changes of a time range (optionally of one source)
+and journals the correction, ``rebuild`` sets balances back to what the
+journal says they are.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from ._cli import connect
+from ._tasks import PeriodicTask
+from .config import DislevelConfig, get_config, get_dialect
+from .metrics import JOURNAL_EVENTS
+from .utils import _query, update_xp_many
+
+log = logging.getLogger(__name__)
+
+
+def _ms(moment: Optional[datetime]) -> int:
+    if moment is None:
+        return int(time.time() * 1000)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+class XpJournal:
+    """
+    Appends every XP change to a ``<table>_journal`` table.
+
+    ``record`` only appends to a list, so the message path never waits on
+    the journal. The list is written in one batch every ``flush_interval``
+    seconds or as soon as it holds ``batch_size`` events. If the database is
+    unavailable, up to ``max_buffer`` events are kept for the next flush.
+    Once a day, events older than ``keep_days`` are folded into per-member
+    checkpoints and deleted, so the journal stays as long as the window.
+    """
+
+    def __init__(
+        self,
+        config,
+        flush_interval: float = 5.0,
+        batch_size: int = 1000,
+        max_buffer: int = 100_000,
+        keep_days: float = 30,
+        compact_interval: float = 86400,
+    ):
+        self.config = config
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.keep_days = keep_days
+        self.buffer: List[Tuple[int, int, int, int, str]] = []
+        self.flushing: Optional[asyncio.Future] = None
+        self.flusher = PeriodicTask("journal_flush", flush_interval, self.flush)
+        self.compactor = PeriodicTask("journal_compact", compact_interval, self.compact)
+
+    def record(self, guild_id: int, member_id: int, delta: int, source: str) -> None:
+        if not delta:
+            return
+
+        self.buffer.append((int(time.time() * 1000), guild_id, member_id, delta, source))
+        if len(self.buffer) >= self.batch_size and (self.flushing is None or self.flushing.done()):
+            self.flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        if not self.buffer:
+            return
+
+        events, self.buffer = self.buffer, []
+        rows = [
+            {"ts": ts, "guild_id": guild_id, "member_id": member_id, "delta": delta, "source": source}
+            for ts, guild_id, member_id, delta, source in events
+        ]
+
+        try:
+            with _query("journal_append"):
+                await self.config.database.execute_many(self.config.queries.journal_append, rows)
+        except Exception:
+            self.buffer = events + self.buffer
+            dropped = len(self.buffer) - self.max_buffer
+            if dropped > 0:
+                del self.buffer[:dropped]
+                JOURNAL_EVENTS.inc(dropped, result="dropped")
+            log.exception("Failed to append %d journal events, retrying next flush", len(events))
+            return
+
+        JOURNAL_EVENTS.inc(len(rows), result="written")
+
+    async def compact(self, before: datetime = None) -> None:
+        """Folds events older than ``before`` (default ``keep_days`` ago) into checkpoints"""
+        before_ms = _ms(before) if before else _ms(None) - int(self.keep_days * 86400 * 1000)
+        database = self.config.database
+
+        with _query("journal_compact"):
+            async with database.transaction():
+                await database.execute(self.config.queries.checkpoint_fold, {"before": before_ms})
+                await database.execute(self.config.queries.journal_truncate, {"before": before_ms})
+        log.info("Compacted %s journal events before %s", self.config.table_name, before_ms)
+
+    async def seed(self) -> None:
+        """
+        Checkpoints the current balances the first time the journal is enabled,
+        i.e. while it has neither checkpoints nor events. Members who already
+        have events are left to them.
+        """
+        database = self.config.database
+        if not await database.fetch_val(self.config.queries.journal_used):
+            await database.execute(self.config.queries.checkpoint_seed, {"ts": _ms(None)})
+
+    def start(self) -> None:
+        self.flusher.start()
+        self.compactor.start()
+
+    def stop(self) -> None:
+        self.flusher.stop()
+        self.compactor.stop()
+
+    async def close(self) -> None:
+        """Stops the tasks and appends everything buffered so far"""
+        self.stop()
+        await self.flush()
+
+
+async def get_xp_history(bot, guild_id: int, member_id: int, limit: int = 25) -> List[dict]:
+    """The member's latest journaled XP changes, newest first"""
+    config = get_config(bot)
+    await config.journal.flush()
+
+    rows = await config.database.fetch_all(
+        config.queries.journal_history, {"guild_id": guild_id, "member_id": member_id, "limit": limit}
+    )
+    return [
+        {
+            "at": datetime.fromtimestamp(row["ts"] / 1000, timezone.utc),
+            "delta": row["delta"],
+            "source": row["source"],
+        }
+        for row in rows
+    ]
+
+
+async def revert_xp(
+    bot, guild_id: int, since: datetime, until: datetime = None, source: str = None
+) -> Dict[int, int]:
+    """
+    Takes back the XP a guild's members gained between ``since`` and
+    ``until``, only from ``source`` if given (e.g. to undo a spam raid).
+    The correction is journaled as ``revert``, returns it per member.
+    """
+    config = get_config(bot)
+    await config.journal.flush()
+
+    values = {"guild_id": guild_id, "since": _ms(since), "until": _ms(until)}
+    if source is None:
+        rows = await config.database.fetch_all(config.queries.journal_range_sums, values)
+    else:
+        rows = await config.database.fetch_all(
+            config.queries.journal_source_range_sums, {**values, "source": source}
+        )
+
+    corrections = {row["member_id"]: -row["delta"] for row in rows if row["delta"]}
+    if corrections:
+        await update_xp_many(config, guild_id, corrections, source="revert")
+    log.info("Reverted XP of %d members of guild %s", len(corrections), guild_id)
+    return corrections
+
+
+async def rebuild_balances(bot, guild_id: int) -> Dict[int, int]:
+    """
+    Sets every journaled member's XP to their checkpoint plus their journal,
+    returns the corrections that were needed. Corrections are not journaled.
+    """
+    config = get_config(bot)
+    await config.journal.flush()
+    if config.archive is not None:
+        await config.archive.restore_guild(guild_id)
+
+    balances = await config.database.fetch_all(config.queries.journal_balances, {"guild_id": guild_id})
+    current = await config.database.fetch_all(config.queries.guild_xp, {"guild_id": guild_id})
+    current = {row["member_id"]: row["xp"] for row in current}
+
+    corrections = {
+        row["member_id"]: row["xp"] - current.get(row["member_id"], 0)
+        for row in balances
+        if row["xp"] != current.get(row["member_id"], 0)
+    }
+    if corrections:
+        await update_xp_many(config, guild_id, corrections, source=None)
+    log.info("Rebuilt XP of %d members of guild %s", len(corrections), guild_id)
+    return corrections
+
+
+async def _main(args) -> None:
+    database, close = await connect(args.url)
+    config = DislevelConfig(
+        bot=None, database=database, table_name=args.table, dialect=get_dialect(database)
+    )
+    config.journal = XpJournal(config, keep_days=getattr(args, "keep_days", 30))
+    try:
+        if args.command == "history":
+            for event in await get_xp_history(config, args.guild, args.member, args.limit):
+                print(f"{event['at']:%Y-%m-%d %H:%M:%S}  {event['delta']:+8d}  {event['source']}")
+        elif args.command == "revert":
+            since = datetime.fromisoformat(args.since)
+            until = datetime.fromisoformat(args.until) if args.until else None
+            await revert_xp(config, args.guild, since, until, args.source)
+        elif args.command == "rebuild":
+            await rebuild_balances(config, args.guild)
+        elif args.command == "compact":
+            await config.journal.compact()
+    finally:
+        # Corrections are journaled through the buffer, which has to reach the table
+        await config.journal.close()
+        await close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("url", help="postgresql:// connection string or databases URL")
+    parser.add_argument("--table", default="dislevel_data")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    history = commands.add_parser("history", help="show a member's latest XP changes")
+    history.add_argument("guild", type=int)
+    history.add_argument("member", type=int)
+    history.add_argument("--limit", type=int, default=25)
+
+    revert = commands.add_parser("revert", help="take back XP gained in a time range")
+    revert.add_argument("guild", type=int)
+    revert.add_argument("--since", required=True, help="ISO time, UTC unless it has an offset")
+    revert.add_argument("--until", help="ISO time, defaults to now")
+    revert.add_argument("--source", help="only changes from this source, e.g. update_xp or voice")
+
+    rebuild = commands.add_parser("rebuild", help="set balances to checkpoint plus journal")
+    rebuild.add_argument("guild", type=int)
+
+    compact = commands.add_parser("compact", help="fold old events into checkpoints")
+    compact.add_argument("--keep-days", type=float, default=30)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
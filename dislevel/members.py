@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+from ._cache import TTLCache
+from ._singleflight import SingleFlight
+from .metrics import CACHE_REQUESTS, MEMBER_FETCHES
+from .tracing import span
+
+log = logging.getLogger(__name__)
+
+
+class MemberResolver:
+    """
+    Resolves member ids of a guild to member objects.
+
+    Members are looked up in the gateway cache first, then in a TTL cache of
+    previously fetched members. The rest are fetched concurrently, at most
+    ``concurrency`` REST calls at a time, and members that are known to have
+    left are remembered in a negative cache so they are not fetched again.
+    A member that is already being fetched is not fetched a second time.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        negative_ttl: float = 3600,
+        concurrency: int = 5,
+        max_size: int = 10_000,
+    ):
+        self.members = TTLCache(ttl, max_size)
+        self.departed = TTLCache(negative_ttl, max_size)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.fetches = SingleFlight()
+
+    def forget(self, guild_id: int, member_id: int) -> None:
+        self.members.pop((guild_id, member_id))
+        self.departed.pop((guild_id, member_id))
+
+    def mark_departed(self, guild_id: int, member_id: int) -> None:
+        self.members.pop((guild_id, member_id))
+        self.departed.set((guild_id, member_id), True)
+
+    def is_departed(self, guild_id: int, member_id: int) -> bool:
+        return (guild_id, member_id) in self.departed
+
+    async def _fetch(self, guild, member_id: int):
+        async with self.semaphore:
+            try:
+                member = await guild.fetch_member(member_id)
+            except Exception as e:
+                # Both discord.py and nextcord report unknown members as a 404
+                if getattr(e, "status", None) == 404:
+                    MEMBER_FETCHES.inc(result="not_found")
+                    self.mark_departed(guild.id, member_id)
+                else:
+                    MEMBER_FETCHES.inc(result="error")
+                    log.warning("Could not fetch member %s of guild %s: %s", member_id, guild.id, e)
+                return None
+
+        MEMBER_FETCHES.inc(result="found")
+        self.members.set((guild.id, member_id), member)
+        return member
+
+    async def resolve(self, guild, member_ids: Iterable[int], fetch: bool = True) -> Dict[int, object]:
+        """
+        Returns member_id -> member for every id that belongs to a current
+        member. Without ``fetch``, only members found in the caches are.
+        """
+        resolved = {}
+        missing = []
+
+        for member_id in member_ids:
+            member = guild.get_member(member_id)
+            CACHE_REQUESTS.inc(cache="gateway_member", result="hit" if member else "miss")
+            if member is None:
+                member = self.members.get((guild.id, member_id))
+                CACHE_REQUESTS.inc(cache="resolved_member", result="hit" if member else "miss")
+
+            if member is not None:
+                resolved[member_id] = member
+            elif self.is_departed(guild.id, member_id):
+                CACHE_REQUESTS.inc(cache="departed_member", result="hit")
+            else:
+                missing.append(member_id)
+
+        if missing and fetch:
+            with span("fetch_members", count=len(missing)):
+                fetched = await asyncio.gather(
+                    *(
+                        self.fetches.do(("fetch_member", guild.id, member_id), self._fetch, guild, member_id)
+                        for member_id in missing
+                    )
+                )
+
+            for member_id, member in zip(missing, fetched):
+                if member is not None:
+                    resolved[member_id] = member
+
+        return resolved
+
+    async def resolve_one(self, guild, member_id: int) -> Optional[object]:
+        return (await self.resolve(guild, [member_id])).get(member_id)
+
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (16_384, 32_768, 65_536, 131_072, 262_144, 524_288, 1_048_576)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of a labelled metric family"""
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing value per label set"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    """A value per label set that can go up and down"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Cumulative bucketed observations per label set"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self.values.get(self._key(labels))
+        return int(sum(state[:-1])) if state else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds metric families and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "dislevel_db_query_seconds", "Latency of dislevel database operations", ["operation"]
+)
+POOL_ACQUIRE_SECONDS = REGISTRY.histogram(
+    "dislevel_pool_acquire_seconds", "Time spent waiting for an asyncpg pool connection"
+)
+RENDER_SECONDS = REGISTRY.histogram(
+    "dislevel_render_seconds", "Time spent rendering rank cards"
+)
+CARD_BYTES = REGISTRY.histogram(
+    "dislevel_card_bytes", "Encoded size of rendered rank cards", buckets=SIZE_BUCKETS
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "dislevel_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+MEMBER_FETCHES = REGISTRY.counter(
+    "dislevel_member_fetches_total", "Discord REST member fetches by result", ["result"]
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "dislevel_coalesced_requests_total",
+    "Reads and renders by operation and whether they ran or shared an identical one in flight",
+    ["operation", "result"],
+)
+LEVELUPS = REGISTRY.counter("dislevel_levelups_total", "Level-ups dispatched")
+DB_READS = REGISTRY.counter(
+    "dislevel_db_reads_total", "Reads by where they were routed and why", ["target", "reason"]
+)
+REPLICA_FAILURES = REGISTRY.counter(
+    "dislevel_replica_failures_total", "Reads that failed on a replica and fell back to the primary"
+)
+RENDER_QUEUE = REGISTRY.gauge("dislevel_render_queue", "Rank card renders waiting for a worker")
+RENDER_QUEUE_DECISIONS = REGISTRY.counter(
+    "dislevel_render_queue_decisions_total",
+    "Render scheduling decisions: immediate, queued, yielded to another guild or dropped",
+    ["decision"],
+)
+RENDER_SHEDDING = REGISTRY.gauge("dislevel_render_shedding", "1 while rank cards are replaced by text")
+RANK_RESPONSES = REGISTRY.counter(
+    "dislevel_rank_responses_total", "Rank responses by whether they were a card or shed to text", ["mode"]
+)
+VOICE_SESSIONS = REGISTRY.gauge("dislevel_voice_sessions", "Members currently earning voice XP")
+VOICE_XP = REGISTRY.counter("dislevel_voice_xp_total", "Voice XP written")
+JOURNAL_EVENTS = REGISTRY.counter(
+    "dislevel_journal_events_total", "XP journal events by whether they were written", ["result"]
+)
+ROLE_EDITS = REGISTRY.counter(
+    "dislevel_role_edits_total", "Level reward updates by whether they edited the member", ["result"]
+)
+API_REQUESTS = REGISTRY.counter(
+    "dislevel_api_requests_total", "Leaderboard API requests by route and status", ["route", "status"]
+)
+ARCHIVE_MOVES = REGISTRY.counter(
+    "dislevel_archive_moves_total", "Member rows moved to or back from the archive", ["direction"]
+)
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers, the request body is never used
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except Exception:
+        log.debug("Failed to serve metrics request", exc_info=True)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    host: str = "127.0.0.1", port: int = 9108, registry: Registry = REGISTRY
+) -> asyncio.AbstractServer:
+    """Serves ``GET /metrics`` in the Prometheus text format. Close the returned server to stop it"""
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_request(reader, writer, registry), host, port
+    )
+    log.info("Serving dislevel metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,143 @@
+"""
+Moves an existing dislevel table to the hash partitioned layout.
+
+    python -m dislevel.migrate postgresql://localhost/bot --table dislevel_data --partitions 16
+
+Rows are copied in primary key order, ``batch_size`` rows per statement, into
+a new partitioned table, which then replaces the original in one transaction.
+The original is kept as ``<table>_unpartitioned`` unless ``drop_old`` is set.
+An interrupted copy resumes where it stopped. Rows changed after they were
+copied are not copied again, so stop XP writes for the final run.
+"""
+
+import argparse
+import asyncio
+import logging
+
+from ._db_adapter import DbAdapter
+from ._queries import Queries
+from .config import DislevelConfig, get_config
+
+log = logging.getLogger(__name__)
+
+INDEX_SUFFIXES = ("member_idx", "active_xp_idx", "last_active_idx")
+
+
+async def migrate_to_partitioned(
+    bot, partitions: int, batch_size: int = 10_000, drop_old: bool = False
+) -> int:
+    """Copies the config's table into ``partitions`` hash partitions and swaps it in, returns the row count"""
+    config = get_config(bot)
+    database = config.database
+
+    if config.dialect != "postgresql":
+        raise ValueError("Partitioned tables are only supported on Postgres")
+
+    source = config.table_name
+    staging = f"{source}_partitioned"
+    target = Queries(staging, "postgresql", config.additional_fields, partitions)
+    columns = ", ".join(field.name for field in target.fields)
+
+    await database.execute(target.create_table)
+    for statement in target.create_partitions:
+        await database.execute(statement)
+    for statement in target.migrations:
+        try:
+            await database.execute(statement)
+        except Exception as e:
+            log.debug("Skipped migration of %s: %s", staging, e)
+
+    # Only tables that archive inactive members have this one, see ``Queries.create_archive``
+    if await database.fetch_val(
+        f"SELECT 1 FROM pg_indexes WHERE indexname = '{source}_last_active_idx'"
+    ):
+        await database.execute(f"CREATE INDEX IF NOT EXISTS {staging}_last_active_idx ON {staging} (last_active)")
+
+    after = await database.fetch_val(f"SELECT COALESCE(MAX(id), 0) FROM {staging}")
+
+    while True:
+        until = await database.fetch_val(
+            f"""
+            SELECT  MAX(id)
+              FROM  (
+                        SELECT  id
+                          FROM  {source}
+                         WHERE  id > :after
+                      ORDER BY  id
+                         LIMIT  :batch_size
+                    ) AS batch
+            """,
+            {"after": after, "batch_size": batch_size},
+        )
+        if until is None:
+            break
+
+        await database.execute(
+            f"""
+            INSERT  INTO {staging} ({columns})
+            SELECT  {columns}
+              FROM  {source}
+             WHERE  id > :after
+               AND  id <= :until
+                ON  CONFLICT DO NOTHING
+            """,
+            {"after": after, "until": until},
+        )
+        after = until
+        log.info("Copied %s up to id %s into %s", source, until, staging)
+
+    rows = await database.fetch_val(f"SELECT COUNT(*) FROM {staging}")
+    await database.execute(
+        f"SELECT setval(pg_get_serial_sequence('{staging}', 'id'), (SELECT MAX(id) FROM {staging}))"
+    )
+
+    async with database.transaction():
+        await database.execute(f"ALTER TABLE {source} RENAME TO {source}_unpartitioned")
+        for suffix in INDEX_SUFFIXES:
+            await database.execute(
+                f"ALTER INDEX IF EXISTS {source}_{suffix} RENAME TO {source}_unpartitioned_{suffix}"
+            )
+
+        await database.execute(f"ALTER TABLE {staging} RENAME TO {source}")
+        for suffix in INDEX_SUFFIXES:
+            await database.execute(f"ALTER INDEX IF EXISTS {staging}_{suffix} RENAME TO {source}_{suffix}")
+        for remainder in range(partitions):
+            await database.execute(f"ALTER TABLE {staging}_p{remainder} RENAME TO {source}_p{remainder}")
+
+        if drop_old:
+            await database.execute(f"DROP TABLE {source}_unpartitioned")
+
+    config.partitions = partitions
+    config.queries = Queries(source, "postgresql", config.additional_fields, partitions)
+    log.info("%s is now hash partitioned into %d partitions", source, partitions)
+    return rows
+
+
+async def _main(args) -> None:
+    import asyncpg
+
+    pool = await asyncpg.create_pool(args.dsn)
+    try:
+        config = DislevelConfig(
+            bot=None, database=DbAdapter(pool), table_name=args.table, dialect="postgresql"
+        )
+        await migrate_to_partitioned(config, args.partitions, args.batch_size, args.drop_old)
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("dsn", help="postgresql:// connection string")
+    parser.add_argument("--table", default="dislevel_data")
+    parser.add_argument("--partitions", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--drop-old", action="store_true", help="drop the unpartitioned table afterwards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
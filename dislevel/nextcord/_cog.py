@@ -0,0 +1,206 @@
+import asyncio
+from typing import Optional, Union
+
+from nextcord import Embed, File, Member, Role, User, VoiceState
+from nextcord.ext import commands
+
+from .._render import close_rendering, rank_card, rank_text, remember_upload, window_text
+from ..global_xp import get_global_rank
+from ..periods import leaderboard_title, parse_period
+from ..rewards import get_level_rewards, remove_level_reward, set_level_reward
+from ..tracing import span, trace
+from ..utils import (
+    get_leaderboard_data,
+    get_leaderboard_window,
+    handle_cog_load,
+    handle_cog_unload,
+    handle_member_join,
+    handle_member_remove,
+    handle_voice_state_update,
+    reset_guild_xp,
+    scale_guild_xp,
+    set_bg_image,
+    transfer_xp,
+)
+
+
+class Leveling(commands.Cog):
+    """Leveling commands"""
+
+    def __init__(self, bot: Union[commands.Bot, commands.AutoShardedBot]):
+        self.bot = bot
+        handle_cog_load(bot)
+
+    def cog_unload(self):
+        # nextcord calls this synchronously
+        asyncio.ensure_future(handle_cog_unload(self.bot))
+        asyncio.ensure_future(close_rendering())
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: Member):
+        await handle_member_remove(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: Member):
+        await handle_member_join(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        await handle_voice_state_update(self.bot, member, before, after)
+
+    @commands.command()
+    async def rank(self, ctx: commands.Context, *, member: Optional[Member] = None):
+        """Check rank of a user"""
+        member = member or ctx.author
+
+        with trace("rank", guild_id=ctx.guild.id):
+            async with ctx.typing():
+                try:
+                    card = await rank_card(
+                        self.bot, member, ctx.guild.id, member.name, member.discriminator or "0000"
+                    )
+                except ValueError as e:
+                    return await ctx.send(str(e))
+
+            if card.url is not None:
+                # The same card was uploaded before, its attachment is still valid
+                return await ctx.send(embed=Embed().set_image(url=card.url))
+            if card.image is None:
+                # The renderer is overloaded, a text rank is cheap
+                embed = Embed(title=member.display_name, description=rank_text(card.data))
+                return await ctx.send(embed=embed)
+
+            with span("upload"):
+                message = await ctx.send(file=File(fp=card.image, filename="card.png"))
+            remember_upload(card, message)
+
+    @commands.command(aliases=["lb"])
+    async def leaderboard(self, ctx: commands.Context, period: Optional[str] = None):
+        """See the server leaderboard of all time, this week, month or season"""
+        try:
+            period = parse_period(period, self.bot.dislevel_config)
+        except ValueError as e:
+            return await ctx.send(str(e))
+
+        with trace("leaderboard", guild_id=ctx.guild.id):
+            leaderboard_data = await get_leaderboard_data(self.bot, ctx.guild.id, period=period)
+
+            embed = Embed(title=leaderboard_title(period), description="")
+            embed.set_thumbnail(url=self.bot.dislevel_config.leaderboard_icon_url)
+
+            for position, data in enumerate(leaderboard_data, start=1):
+                embed.description += f"{position}. <@{data['member_id']}> - {data['xp']} XP\n"
+
+            with span("respond"):
+                await ctx.send(embed=embed)
+
+    @commands.command(aliases=["near"])
+    async def around(self, ctx: commands.Context, *, member: Optional[Member] = None):
+        """See the members ranked right above and below you or another member"""
+        member = member or ctx.author
+
+        with trace("around", guild_id=ctx.guild.id):
+            window = await get_leaderboard_window(self.bot, member.id, ctx.guild.id)
+            if window is None:
+                return await ctx.send(f"{member.display_name} has no XP yet.")
+
+            embed = Embed(title=f"Around {member.display_name}", description=window_text(window, member.id))
+            with span("respond"):
+                await ctx.send(embed=embed)
+
+    @commands.command(aliases=["grank"])
+    async def globalrank(self, ctx: commands.Context, *, member: Optional[Member] = None):
+        """Check a user's rank over every server of the bot"""
+        member = member or ctx.author
+
+        with trace("globalrank", guild_id=ctx.guild.id):
+            try:
+                rank = await get_global_rank(self.bot, member.id)
+            except ValueError as e:
+                return await ctx.send(str(e))
+            if rank is None:
+                return await ctx.send(f"{member.display_name} has no XP yet.")
+
+            embed = Embed(
+                title=f"{member.display_name} globally",
+                description=f"**{rank['rank_label']}** \u2022 Level **{rank['level']}**\n{rank['xp']:,} XP",
+            )
+            with span("respond"):
+                await ctx.send(embed=embed)
+
+    @commands.command()
+    async def setbg(self, ctx: commands.Context, *, url: str):
+        """Set background image of your card"""
+        with trace("setbg", guild_id=ctx.guild.id):
+            await set_bg_image(self.bot, ctx.author.id, ctx.guild.id, url)
+            with span("respond"):
+                await ctx.send("Background image has been updated.")
+
+    @commands.command()
+    async def resetbg(self, ctx: commands.Context):
+        """Reset background image of your card to default"""
+        await set_bg_image(self.bot, ctx.author.id, ctx.guild.id, "")
+        await ctx.send("Background image has been reset to default.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def resetxp(self, ctx: commands.Context):
+        """Reset the XP of every member of the server"""
+        with trace("resetxp", guild_id=ctx.guild.id):
+            await reset_guild_xp(self.bot, ctx.guild.id)
+            await ctx.send("XP of every member has been reset.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def scalexp(self, ctx: commands.Context, factor: float):
+        """Multiply the XP of every member of the server, e.g. 0.5 to halve it"""
+        if factor < 0:
+            return await ctx.send("The factor must not be negative.")
+
+        with trace("scalexp", guild_id=ctx.guild.id):
+            await scale_guild_xp(self.bot, ctx.guild.id, factor)
+            await ctx.send(f"XP of every member has been multiplied by {factor:g}.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def transferxp(self, ctx: commands.Context, source: User, target: Member):
+        """Move all XP of an account (e.g. an old one) to a member"""
+        moved = await transfer_xp(self.bot, ctx.guild.id, source.id, target.id, delete_source=True)
+        await ctx.send(f"Moved {moved} XP from {source.mention} to {target.mention}.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def setreward(self, ctx: commands.Context, level: int, role: Role):
+        """Grant a role to members who reach a level"""
+        try:
+            await set_level_reward(self.bot, ctx.guild.id, level, role.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        await ctx.send(embed=Embed(description=f"Members reaching level {level} will get {role.mention}."))
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def removereward(self, ctx: commands.Context, role: Role):
+        """Stop granting a role as a level reward"""
+        try:
+            await remove_level_reward(self.bot, ctx.guild.id, role.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        await ctx.send(embed=Embed(description=f"{role.mention} is no longer a level reward."))
+
+    @commands.command()
+    @commands.guild_only()
+    async def rewards(self, ctx: commands.Context):
+        """Show the level reward roles of the server"""
+        try:
+            rewards = await get_level_rewards(self.bot, ctx.guild.id)
+        except ValueError as e:
+            return await ctx.send(str(e))
+        lines = [f"Level {level}: <@&{role_id}>" for level, role_id in rewards]
+        embed = Embed(title="Level rewards", description="\n".join(lines) or "No level rewards yet.")
+        await ctx.send(embed=embed)
@@ -1,16 +1,37 @@
-import os
+import asyncio
 from typing import Optional, Union
 
-from easy_pil.utils import run_in_executor
-from nextcord import Embed, File, Interaction, Member, slash_command
+from nextcord import (
+    Embed,
+    File,
+    Interaction,
+    Member,
+    Permissions,
+    Role,
+    SlashOption,
+    User,
+    VoiceState,
+    slash_command,
+)
 from nextcord.ext import commands
 
-from ..card import get_card
+from .._render import close_rendering, rank_card, rank_text, remember_upload, window_text
+from ..global_xp import get_global_rank
+from ..periods import PERIODS, leaderboard_title, parse_period
+from ..rewards import get_level_rewards, remove_level_reward, set_level_reward
+from ..tracing import span, trace
 from ..utils import (
     get_leaderboard_data,
-    get_member_data,
-    get_member_position,
+    get_leaderboard_window,
+    handle_cog_load,
+    handle_cog_unload,
+    handle_member_join,
+    handle_member_remove,
+    handle_voice_state_update,
+    reset_guild_xp,
+    scale_guild_xp,
     set_bg_image,
+    transfer_xp,
 )
 
 
@@ -19,6 +40,24 @@ class LevelingSlash(commands.Cog):
 
     def __init__(self, bot: Union[commands.Bot, commands.AutoShardedBot]):
         self.bot = bot
+        handle_cog_load(bot)
+
+    def cog_unload(self):
+        # nextcord calls this synchronously
+        asyncio.ensure_future(handle_cog_unload(self.bot))
+        asyncio.ensure_future(close_rendering())
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: Member):
+        await handle_member_remove(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: Member):
+        await handle_member_join(self.bot, member)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        await handle_voice_state_update(self.bot, member, before, after)
 
     @slash_command(description="Check rank of a user")
     async def rank(self, interaction: Interaction, *, member: Optional[Member]):
@@ -26,46 +65,96 @@ class LevelingSlash(commands.Cog):
         if not member:
             member = interaction.user
 
-        user_data = await get_member_data(self.bot, member.id, interaction.guild.id)
-        user_data["position"] = await get_member_position(
-            self.bot, member.id, interaction.guild.id
-        )
-        user_data["profile_image"] = str(member.display_avatar.url)
-        user_data["name"] = str(member).split("#")[0]
-        user_data["descriminator"] = str(member).split("#")[1]
-
-        image = await run_in_executor(get_card, data=user_data)
-        file = File(fp=image, filename="card.png")
-
-        await interaction.send(file=file)
+        # Deferring first keeps slow cards clear of the 3 second interaction deadline
+        await interaction.response.defer()
+
+        with trace("rank", guild_id=interaction.guild.id):
+            try:
+                card = await rank_card(
+                    self.bot, member, interaction.guild.id, member.name, member.discriminator or "0000"
+                )
+            except ValueError as e:
+                return await interaction.followup.send(str(e))
+
+            if card.url is not None:
+                # The same card was uploaded before, its attachment is still valid
+                return await interaction.followup.send(embed=Embed().set_image(url=card.url))
+            if card.image is None:
+                # The renderer is overloaded, a text rank is cheap
+                embed = Embed(title=member.display_name, description=rank_text(card.data))
+                return await interaction.followup.send(embed=embed)
+
+            with span("upload"):
+                message = await interaction.followup.send(file=File(fp=card.image, filename="card.png"))
+            remember_upload(card, message)
 
     @slash_command(description="See the server leaderboard")
-    async def leaderboard(self, interaction: Interaction):
-        """See the server leaderboard"""
-        leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id)
+    async def leaderboard(
+        self,
+        interaction: Interaction,
+        period: str = SlashOption(choices=list(PERIODS), required=False, default=None),
+    ):
+        """See the server leaderboard of all time, this week, month or season"""
+        try:
+            period = parse_period(period, self.bot.dislevel_config)
+        except ValueError as e:
+            return await interaction.send(str(e), ephemeral=True)
+
+        with trace("leaderboard", guild_id=interaction.guild.id):
+            leaderboard_data = await get_leaderboard_data(self.bot, interaction.guild.id, period=period)
+
+            embed = Embed(title=leaderboard_title(period), description="")
+            embed.set_thumbnail(url=self.bot.dislevel_config.leaderboard_icon_url)
+
+            for position, data in enumerate(leaderboard_data, start=1):
+                embed.description += f"{position}. <@{data['member_id']}> - {data['xp']}\n"
+
+            with span("respond"):
+                await interaction.send(embed=embed)
+
+    @slash_command(description="See the members ranked right above and below a member")
+    async def around(self, interaction: Interaction, *, member: Optional[Member]):
+        """See the members ranked right above and below you or another member"""
+        if not member:
+            member = interaction.user
 
-        embed = Embed(title=f"Leaderboard", description="")
-        embed.set_thumbnail(url=os.environ.get("DISLEVEL_LEADERBOARD_ICON"))
+        with trace("around", guild_id=interaction.guild.id):
+            window = await get_leaderboard_window(self.bot, member.id, interaction.guild.id)
+            if window is None:
+                return await interaction.send(f"{member.display_name} has no XP yet.", ephemeral=True)
 
-        position = 0
-        for data in leaderboard_data:
-            member = None
-            if self.bot.intents.members:
-                member = interaction.guild.get_member(data["member_id"])
-            else:
-                member = await interaction.guild.fetch_member(data["member_id"])
+            embed = Embed(title=f"Around {member.display_name}", description=window_text(window, member.id))
+            with span("respond"):
+                await interaction.send(embed=embed)
 
-            if member:
-                position += 1
-                embed.description += f"{position}. {member.mention} - {data['xp']}\n"
+    @slash_command(description="Check a user's rank over every server of the bot")
+    async def globalrank(self, interaction: Interaction, *, member: Optional[Member]):
+        """Check a user's rank over every server of the bot"""
+        if not member:
+            member = interaction.user
 
-        await interaction.send(embed=embed)
+        with trace("globalrank", guild_id=interaction.guild.id):
+            try:
+                rank = await get_global_rank(self.bot, member.id)
+            except ValueError as e:
+                return await interaction.send(str(e), ephemeral=True)
+            if rank is None:
+                return await interaction.send(f"{member.display_name} has no XP yet.", ephemeral=True)
+
+            embed = Embed(
+                title=f"{member.display_name} globally",
+                description=f"**{rank['rank_label']}** \u2022 Level **{rank['level']}**\n{rank['xp']:,} XP",
+            )
+            with span("respond"):
+                await interaction.send(embed=embed)
 
     @slash_command(description="Set image of your card bg")
     async def setbg(self, interaction: Interaction, *, url: str):
         """Set image of your card bg"""
-        await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, url)
-        await interaction.send("Background image has been updated")
+        with trace("setbg", guild_id=interaction.guild.id):
+            await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, url)
+            with span("respond"):
+                await interaction.send("Background image has been updated")
 
     @slash_command(description="Reset image of your card bg")
     async def resetbg(self, interaction: Interaction):
@@ -73,6 +162,82 @@ class LevelingSlash(commands.Cog):
         await set_bg_image(self.bot, interaction.user.id, interaction.guild.id, "")
         await interaction.send("Background image has been set to default")
 
+    @slash_command(
+        description="Reset the XP of every member of the server",
+        default_member_permissions=Permissions(administrator=True),
+        dm_permission=False,
+    )
+    async def resetxp(self, interaction: Interaction):
+        """Reset the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("resetxp", guild_id=interaction.guild.id):
+            await reset_guild_xp(self.bot, interaction.guild.id)
+            await interaction.followup.send("XP of every member has been reset")
+
+    @slash_command(
+        description="Multiply the XP of every member, e.g. 0.5 to halve it",
+        default_member_permissions=Permissions(administrator=True),
+        dm_permission=False,
+    )
+    async def scalexp(self, interaction: Interaction, factor: float = SlashOption(min_value=0)):
+        """Multiply the XP of every member of the server"""
+        await interaction.response.defer()
+        with trace("scalexp", guild_id=interaction.guild.id):
+            await scale_guild_xp(self.bot, interaction.guild.id, factor)
+            await interaction.followup.send(f"XP of every member has been multiplied by {factor:g}")
+
+    @slash_command(
+        description="Move all XP of an account to a member",
+        default_member_permissions=Permissions(administrator=True),
+        dm_permission=False,
+    )
+    async def transferxp(self, interaction: Interaction, source: User, target: Member):
+        """Move all XP of an account (e.g. an old one) to a member"""
+        moved = await transfer_xp(self.bot, interaction.guild.id, source.id, target.id, delete_source=True)
+        await interaction.send(f"Moved {moved} XP from {source.mention} to {target.mention}")
+
+    @slash_command(
+        description="Grant a role to members who reach a level",
+        default_member_permissions=Permissions(administrator=True),
+        dm_permission=False,
+    )
+    async def setreward(self, interaction: Interaction, level: int = SlashOption(min_value=1), role: Role = SlashOption()
+    ):
+        """Grant a role to members who reach a level"""
+        try:
+            await set_level_reward(self.bot, interaction.guild.id, level, role.id)
+        except ValueError as e:
+            return await interaction.send(str(e), ephemeral=True)
+        embed = Embed(description=f"Members reaching level {level} will get {role.mention}.")
+        await interaction.send(embed=embed)
+
+    @slash_command(
+        description="Stop granting a role as a level reward",
+        default_member_permissions=Permissions(administrator=True),
+        dm_permission=False,
+    )
+    async def removereward(self, interaction: Interaction, role: Role):
+        """Stop granting a role as a level reward"""
+        try:
+            await remove_level_reward(self.bot, interaction.guild.id, role.id)
+        except ValueError as e:
+            return await interaction.send(str(e), ephemeral=True)
+        await interaction.send(embed=Embed(description=f"{role.mention} is no longer a level reward."))
+
+    @slash_command(
+        description="Show the level reward roles of the server",
+        dm_permission=False,
+    )
+    async def rewards(self, interaction: Interaction):
+        """Show the level reward roles of the server"""
+        try:
+            rewards = await get_level_rewards(self.bot, interaction.guild.id)
+        except ValueError as e:
+            return await interaction.send(str(e), ephemeral=True)
+        lines = [f"Level {level}: <@&{role_id}>" for level, role_id in rewards]
+        embed = Embed(title="Level rewards", description="\n".join(lines) or "No level rewards yet.")
+        await interaction.send(embed=embed)
+
 
 def setup(bot: commands.Bot):
     bot.add_cog(LevelingSlash(bot))
@@ -0,0 +1,123 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from ._tasks import PeriodicTask
+from .tracing import span
+
+log = logging.getLogger(__name__)
+
+PERIODS = ("week", "month", "season")
+PERIOD_TITLES = {"week": "this week", "month": "this month", "season": "this season"}
+
+
+def period_bucket(period: str, day: int) -> int:
+    """
+    Bucket of ``period`` that a UTC day (days since the epoch) falls in.
+    Weeks start on Monday, seasons are calendar quarters.
+    """
+    if period == "week":
+        # The epoch was a Thursday
+        return (day + 3) // 7
+
+    date = datetime.fromtimestamp(day * 86400, timezone.utc)
+    if period == "month":
+        return date.year * 12 + date.month - 1
+    if period == "season":
+        return date.year * 4 + (date.month - 1) // 3
+    raise ValueError(f"Unknown period {period!r}, expected one of {', '.join(PERIODS)}")
+
+
+def parse_period(value: Optional[str], config=None) -> Optional[str]:
+    """Command argument to a period, None for lifetime XP"""
+    if value is None or value.lower() in ("all", "lifetime", "total"):
+        return None
+    if value.lower() not in PERIODS:
+        raise ValueError(f"Period must be one of all, {', '.join(PERIODS)}")
+    if config is not None and config.periods is None:
+        raise ValueError("Period leaderboards are not enabled on this bot")
+    return value.lower()
+
+
+def leaderboard_title(period: Optional[str]) -> str:
+    return f"Leaderboard ({PERIOD_TITLES[period]})" if period else "Leaderboard"
+
+
+def current_day() -> int:
+    return int(time.time() // 86400)
+
+
+class PeriodRollup:
+    """
+    Per period XP of every member, one row per (guild, period, bucket, member).
+
+    XP gains are summed in memory and upserted in one batch every
+    ``flush_interval`` seconds, so period leaderboards trail live XP by at most
+    that long. Buckets older than the newest ``retention`` of their period are
+    deleted every ``expire_interval`` seconds.
+    """
+
+    def __init__(self, config, flush_interval: float = 10.0, retention: int = 2, expire_interval: float = 3600):
+        self.config = config
+        self.retention = retention
+        # (guild id, member id, day) -> XP gained
+        self.pending: Dict[Tuple[int, int, int], int] = defaultdict(int)
+        self.flusher = PeriodicTask("period_flush", flush_interval, self.flush)
+        self.expirer = PeriodicTask("period_expire", expire_interval, self.expire)
+
+    def record(self, guild_id: int, member_id: int, amount: int) -> None:
+        if amount:
+            self.pending[(guild_id, member_id, current_day())] += amount
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, defaultdict(int)
+        rows = [
+            {
+                "guild_id": guild_id,
+                "member_id": member_id,
+                "period": period,
+                "bucket": period_bucket(period, day),
+                "xp": amount,
+            }
+            for (guild_id, member_id, day), amount in pending.items()
+            for period in PERIODS
+        ]
+
+        try:
+            with span("period_flush", rows=len(rows)):
+                await self.config.database.execute_many(self.config.queries.period_upsert, rows)
+        except Exception:
+            log.exception("Failed to write %d period rollups, retrying next flush", len(rows))
+            for key, amount in pending.items():
+                self.pending[key] += amount
+            return
+
+        # Period leaderboards of these guilds just changed
+        for guild_id in {guild_id for guild_id, _, _ in pending}:
+            self.config.versions.bump(guild_id)
+
+    async def expire(self) -> None:
+        day = current_day()
+        for period in PERIODS:
+            oldest = period_bucket(period, day) - self.retention + 1
+            await self.config.database.execute(
+                self.config.queries.period_expire, {"period": period, "oldest": oldest}
+            )
+
+    def start(self) -> None:
+        self.flusher.start()
+        self.expirer.start()
+
+    def stop(self) -> None:
+        self.flusher.stop()
+        self.expirer.stop()
+
+    async def close(self) -> None:
+        """Stops the tasks and writes everything buffered so far"""
+        self.stop()
+        await self.flush()
@@ -0,0 +1,138 @@
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+from ._singleflight import SingleFlight
+from .metrics import CACHE_REQUESTS
+from .tracing import span
+
+log = logging.getLogger(__name__)
+
+
+class XpHistogram:
+    """
+    Counts of a guild's active members by XP.
+
+    XP below ``exact_below`` gets a bucket per value, above that buckets are
+    log-spaced by ``base``, so a bucket never spans more than 2% of its XP.
+    Counts live in a Fenwick tree, so moving a member and counting everyone
+    above an XP are both logarithmic in the bucket count.
+    """
+
+    def __init__(self, base: float = 1.02, exact_below: int = 1024, max_xp: int = 2**63):
+        self.log_base = math.log(base)
+        self.exact_below = exact_below
+        self.size = self.bucket(max_xp) + 1
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        self.built_at = time.monotonic()
+
+    def _log_position(self, xp: int) -> float:
+        return math.log(xp / self.exact_below) / self.log_base
+
+    def bucket(self, xp: int) -> int:
+        if xp < self.exact_below:
+            return max(int(xp), 0)
+        return self.exact_below + int(self._log_position(xp))
+
+    def add(self, xp: int, count: int = 1) -> None:
+        index = min(self.bucket(xp), self.size - 1) + 1
+        self.total += count
+        while index <= self.size:
+            self.tree[index] += count
+            index += index & -index
+
+    def move(self, old_xp: int, new_xp: int) -> None:
+        if self.bucket(old_xp) != self.bucket(new_xp):
+            self.add(old_xp, -1)
+            self.add(new_xp, 1)
+
+    def _count_upto(self, bucket: int) -> int:
+        """Members in buckets ``0 .. bucket``"""
+        index = min(bucket, self.size - 1) + 1
+        count = 0
+        while index > 0:
+            count += self.tree[index]
+            index -= index & -index
+        return count
+
+    def count_above(self, xp: int) -> float:
+        """Estimated members with more XP, interpolating inside the member's own bucket"""
+        bucket = min(self.bucket(xp), self.size - 1)
+        above = self.total - self._count_upto(bucket)
+        if bucket < self.exact_below:
+            return above
+
+        in_bucket = self._count_upto(bucket) - self._count_upto(bucket - 1)
+        if in_bucket <= 1:
+            return above
+
+        # Members are assumed to be spread evenly over the bucket's log range
+        fraction = bucket - self.exact_below + 1 - self._log_position(xp)
+        return above + (in_bucket - 1) * min(max(fraction, 0.0), 1.0)
+
+
+class RankEstimator:
+    """
+    Approximate ranks and percentiles for large guilds.
+
+    A guild's histogram is built from one grouped scan the first time it is
+    needed and kept up to date by ``update_xp`` and membership changes after
+    that. It is rebuilt every ``rebuild_after`` seconds to wash out drift from
+    writes of other processes. Members whose estimated position is inside the
+    top ``exact_top`` are ranked exactly by the database instead.
+    """
+
+    def __init__(self, exact_top: int = 1000, base: float = 1.02, rebuild_after: float = 3600):
+        self.exact_top = exact_top
+        self.base = base
+        self.rebuild_after = rebuild_after
+        self.histograms: Dict[int, XpHistogram] = {}
+        self.loading = SingleFlight()
+
+    def invalidate(self, guild_id: int) -> None:
+        self.histograms.pop(guild_id, None)
+
+    def _loaded(self, guild_id: int) -> Optional[XpHistogram]:
+        histogram = self.histograms.get(guild_id)
+        if histogram is not None and time.monotonic() - histogram.built_at > self.rebuild_after:
+            del self.histograms[guild_id]
+            return None
+        return histogram
+
+    def record_add(self, guild_id: int, xp: int) -> None:
+        histogram = self._loaded(guild_id)
+        if histogram is not None:
+            histogram.add(xp)
+
+    def record_remove(self, guild_id: int, xp: int) -> None:
+        histogram = self._loaded(guild_id)
+        if histogram is not None:
+            histogram.add(xp, -1)
+
+    def record_move(self, guild_id: int, old_xp: int, new_xp: int) -> None:
+        histogram = self._loaded(guild_id)
+        if histogram is not None:
+            histogram.move(old_xp, new_xp)
+
+    async def histogram(self, config, guild_id: int) -> XpHistogram:
+        histogram = self._loaded(guild_id)
+        if histogram is not None:
+            CACHE_REQUESTS.inc(cache="xp_histogram", result="hit")
+            return histogram
+
+        CACHE_REQUESTS.inc(cache="xp_histogram", result="miss")
+        # Concurrent misses share one scan
+        return await self.loading.do(("build_xp_histogram", guild_id), self._build, config, guild_id)
+
+    async def _build(self, config, guild_id: int) -> XpHistogram:
+        histogram = XpHistogram(self.base)
+        with span("build_xp_histogram"):
+            rows = await config.reads.fetch_all(config.queries.xp_counts, {"guild_id": guild_id})
+        for row in rows:
+            histogram.add(row["xp"], row["members"])
+
+        self.histograms[guild_id] = histogram
+        log.debug("Built XP histogram of guild %s from %d members", guild_id, histogram.total)
+        return histogram
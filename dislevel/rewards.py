@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from ._cache import TTLCache
+from .config import get_config
+from .metrics import ROLE_EDITS
+
+log = logging.getLogger(__name__)
+
+
+class RewardMap:
+    """A guild's level -> role rewards, sorted by level for bisecting"""
+
+    def __init__(self, rewards: List[tuple]):
+        rewards = sorted(rewards)
+        self.levels = [level for level, _ in rewards]
+        self.roles = [role_id for _, role_id in rewards]
+        self.all_roles = set(self.roles)
+
+    def __bool__(self) -> bool:
+        return bool(self.roles)
+
+    def roles_for(self, level: int, stack: bool = True) -> Set[int]:
+        """Reward roles a member of ``level`` should have, every earned one or only the highest"""
+        earned = bisect_right(self.levels, level)
+        if not earned:
+            return set()
+        if stack:
+            return set(self.roles[:earned])
+
+        top = self.levels[earned - 1]
+        return {role_id for level, role_id in zip(self.levels, self.roles) if level == top}
+
+
+class _TokenBucket:
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+class RewardsEngine:
+    """
+    Grants level reward roles.
+
+    Level-ups only queue the member's new level. Each guild has one worker
+    that drains its queue in order, at most ``rate`` role requests per
+    ``per`` seconds. A member queued again before their edit ran keeps their
+    place and only their latest level counts, so jumping several levels is
+    a single edit. That edit adds every reward role the level earns (all of
+    them, or only the highest with ``stack=False``) and removes the others,
+    and is skipped when the member already has them.
+
+    Roles are added and removed one by one rather than by replacing the
+    member's role list, because the member may come from a cache whose roles
+    are out of date, and a replaced list would drop roles granted since.
+    Every role is one request and takes one token of the guild's budget.
+    The member is dropped from the resolver's cache after each edit.
+    """
+
+    def __init__(self, config, stack: bool = True, rate: int = 5, per: float = 5.0, map_ttl: float = 300):
+        self.config = config
+        self.stack = stack
+        self.rate = rate
+        self.per = per
+        self.maps = TTLCache(map_ttl, max_size=10_000)
+        self.queues: Dict[int, "OrderedDict[int, int]"] = {}
+        self.buckets: Dict[int, _TokenBucket] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+
+    def invalidate(self, guild_id: int) -> None:
+        self.maps.pop(guild_id)
+
+    async def reward_map(self, guild_id: int) -> RewardMap:
+        rewards = self.maps.get(guild_id)
+        if rewards is None:
+            rows = await self.config.database.fetch_all(
+                self.config.queries.level_rewards, {"guild_id": guild_id}
+            )
+            rewards = RewardMap([(row["level"], row["role_id"]) for row in rows])
+            self.maps.set(guild_id, rewards)
+        return rewards
+
+    def level_changed(self, guild_id: int, member_id: int, level: int) -> None:
+        queue = self.queues.setdefault(guild_id, OrderedDict())
+        if member_id in queue:
+            ROLE_EDITS.inc(result="coalesced")
+        queue[member_id] = level
+
+        worker = self.workers.get(guild_id)
+        if worker is None or worker.done():
+            self.workers[guild_id] = asyncio.ensure_future(self._drain(guild_id))
+
+    async def levels_changed(self, guild_id: int, before: Dict[int, int], after: Dict[int, int]) -> None:
+        """
+        Queues the members of a bulk operation whose reward roles change with
+        their level, ``before`` and ``after`` map member ids to levels.
+        """
+        rewards = await self.reward_map(guild_id)
+        if not rewards:
+            return
+
+        for member_id, level in after.items():
+            old = before.get(member_id, 0)
+            if old != level and rewards.roles_for(old, self.stack) != rewards.roles_for(level, self.stack):
+                self.level_changed(guild_id, member_id, level)
+
+    async def _drain(self, guild_id: int) -> None:
+        queue = self.queues[guild_id]
+        bucket = self.buckets.setdefault(guild_id, _TokenBucket(self.rate, self.per))
+
+        while queue:
+            member_id, level = queue.popitem(last=False)
+            try:
+                roles = await self._roles(guild_id, member_id, level)
+                if roles is None:
+                    continue
+
+                member, added, removed = roles
+                reason = f"Level {level} reward"
+                # Each role is its own request, so each takes its own token
+                for role in added:
+                    await bucket.acquire()
+                    await member.add_roles(role, reason=reason, atomic=True)
+                for role in removed:
+                    await bucket.acquire()
+                    await member.remove_roles(role, reason=reason, atomic=True)
+                self.config.member_resolver.forget(guild_id, member_id)
+                ROLE_EDITS.inc(result="edited")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                ROLE_EDITS.inc(result="error")
+                log.warning("Could not update reward roles of %s in guild %s: %s", member_id, guild_id, e)
+
+        del self.queues[guild_id]
+
+    async def _roles(self, guild_id: int, member_id: int, level: int) -> Optional[tuple]:
+        """The member, the roles to add and the roles to remove, None when nothing has to change"""
+        rewards = await self.reward_map(guild_id)
+        guild = self.config.bot.get_guild(guild_id)
+        if not rewards or guild is None:
+            return None
+
+        member = await self.config.member_resolver.resolve_one(guild, member_id)
+        if member is None:
+            return None
+
+        wanted = rewards.roles_for(level, self.stack)
+        current = {role.id for role in member.roles}
+        unwanted = (current & rewards.all_roles) - wanted
+        if wanted <= current and not unwanted:
+            ROLE_EDITS.inc(result="unchanged")
+            return None
+
+        added = [role for role in map(guild.get_role, wanted - current) if role is not None]
+        removed = [role for role in member.roles if role.id in unwanted]
+        return member, added, removed
+
+    def stop(self) -> None:
+        for worker in self.workers.values():
+            worker.cancel()
+        self.workers.clear()
+
+
+def _engine(config) -> RewardsEngine:
+    if config.rewards is None:
+        raise ValueError("Level rewards are not enabled on this bot")
+    return config.rewards
+
+
+async def get_level_rewards(bot, guild_id: int) -> List[tuple]:
+    """A guild's ``(level, role_id)`` rewards, lowest level first"""
+    config = get_config(bot)
+    rewards = await _engine(config).reward_map(guild_id)
+    return list(zip(rewards.levels, rewards.roles))
+
+
+async def set_level_reward(bot, guild_id: int, level: int, role_id: int) -> None:
+    """Grants ``role_id`` from ``level`` on, a role is the reward of one level only"""
+    config = get_config(bot)
+    engine = _engine(config)
+    await config.database.execute(
+        config.queries.reward_upsert, {"guild_id": guild_id, "role_id": role_id, "level": level}
+    )
+    engine.invalidate(guild_id)
+
+
+async def remove_level_reward(bot, guild_id: int, role_id: int) -> None:
+    """Stops granting ``role_id``, members who have it already keep it"""
+    config = get_config(bot)
+    engine = _engine(config)
+    await config.database.execute(
+        config.queries.reward_delete, {"guild_id": guild_id, "role_id": role_id}
+    )
+    engine.invalidate(guild_id)
@@ -0,0 +1,203 @@
+"""
+Checks or rebuilds the leaderboard snapshot table of a dislevel table.
+
+    python -m dislevel.snapshot postgresql://localhost/bot
+    python -m dislevel.snapshot sqlite:///leveling.db --rebuild --guild 1234
+
+Snapshots are kept up to date by the processes that write XP, so they only
+drift when rows change outside dislevel or a process dies mid write.
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from ._cache import TTLCache
+from ._cli import connect
+from .config import DislevelConfig, get_config, get_dialect
+from .utils import _query
+
+log = logging.getLogger(__name__)
+
+
+class LeaderboardSnapshot:
+    """
+    Keeps the top ``size`` rows of every guild in a ``<table>_top`` table.
+
+    Writes compare the member's new XP with the guild's K-th score, cached
+    for ``threshold_ttl`` seconds, and only touch the snapshot when they
+    cross it. Removals (members leaving, deleted rows, XP going down) mark
+    the guild dirty and its snapshot is refilled from the main table's index
+    on the next read. Leaderboards read their rows inside the top ``size``
+    as a primary key range of the snapshot, whatever their page size, and
+    only the rows after it from the main table.
+    """
+
+    def __init__(self, size: int = 100, threshold_ttl: float = 60):
+        self.size = size
+        # guild id -> K-th score, or None while the guild has fewer than ``size`` rows
+        self.thresholds = TTLCache(threshold_ttl, max_size=100_000)
+        self.dirty: Set[int] = set()
+
+    def invalidate(self, guild_id: int) -> None:
+        self.dirty.add(guild_id)
+        self.thresholds.pop(guild_id)
+
+    async def _threshold(self, config: DislevelConfig, guild_id: int) -> Optional[int]:
+        if guild_id in self.dirty:
+            await self.rebuild(config, guild_id)
+
+        if guild_id in self.thresholds:
+            return self.thresholds.get(guild_id)
+
+        with _query("top_threshold"):
+            row = await config.database.fetch_one(config.queries.top_threshold, {"guild_id": guild_id})
+
+        # A guild seen for the first time may have rows written before the snapshot existed
+        if row["members"] < self.size:
+            return await self.rebuild(config, guild_id)
+
+        self.thresholds.set(guild_id, row["kth"])
+        return row["kth"]
+
+    async def record(
+        self, config: DislevelConfig, guild_id: int, writes: List[Tuple[int, Optional[int], int]]
+    ) -> None:
+        """Applies ``(member_id, old_xp, new_xp)`` writes, ``old_xp`` is None for rows that were not ranked"""
+        threshold = await self._threshold(config, guild_id)
+
+        if threshold is not None and any(
+            old is not None and old >= threshold > new for _, old, new in writes
+        ):
+            # Someone dropped out, the next row has to come from the main table
+            self.invalidate(guild_id)
+            return
+
+        entering = [
+            {"guild_id": guild_id, "member_id": member_id, "xp": new}
+            for member_id, _, new in writes
+            if threshold is None or new >= threshold
+        ]
+        if not entering:
+            return
+
+        with _query("top_upsert"):
+            await config.database.execute_many(config.queries.top_upsert, entering)
+        if threshold is not None:
+            with _query("top_trim"):
+                await config.database.execute(
+                    config.queries.top_trim, {"guild_id": guild_id, "size": self.size}
+                )
+        self.thresholds.pop(guild_id)
+
+    async def page(self, config: DislevelConfig, guild_id: int, limit: int, offset: int):
+        if guild_id in self.dirty or guild_id not in self.thresholds:
+            await self._threshold(config, guild_id)
+
+        with _query("top_leaderboard"):
+            return await config.reads.fetch_all(
+                config.queries.top_leaderboard,
+                {"guild_id": guild_id, "limit": limit, "offset": offset},
+            )
+
+    async def rebuild(self, config: DislevelConfig, guild_id: int) -> Optional[int]:
+        """Refills a guild's snapshot from the main table, returns its new threshold"""
+        self.dirty.discard(guild_id)
+        values = {"guild_id": guild_id, "size": self.size}
+
+        with _query("top_rebuild"):
+            async with config.database.transaction():
+                await config.database.execute(config.queries.top_clear, {"guild_id": guild_id})
+                await config.database.execute(config.queries.top_fill, values)
+            row = await config.database.fetch_one(config.queries.top_threshold, {"guild_id": guild_id})
+
+        threshold = row["kth"] if row["members"] >= self.size else None
+        self.thresholds.set(guild_id, threshold)
+        return threshold
+
+
+async def check_snapshot(bot, guild_id: int) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+    """
+    Compares a guild's snapshot with the main table, returns
+    ``{member_id: (snapshot xp, actual xp)}`` for every row that differs.
+    """
+    config = get_config(bot)
+    values = {"guild_id": guild_id, "size": config.snapshot.size}
+
+    expected = await config.database.fetch_all(config.queries.top_expected, values)
+    stored = await config.database.fetch_all(
+        config.queries.top_leaderboard, {"guild_id": guild_id, "limit": config.snapshot.size, "offset": 0}
+    )
+
+    expected = {row["member_id"]: row["xp"] for row in expected}
+    stored = {row["member_id"]: row["xp"] for row in stored}
+    return {
+        member_id: (stored.get(member_id), expected.get(member_id))
+        for member_id in expected.keys() | stored.keys()
+        if stored.get(member_id) != expected.get(member_id)
+    }
+
+
+async def rebuild_snapshot(bot, guild_id: int = None) -> int:
+    """Rebuilds one guild's snapshot, or every guild's, returns how many were rebuilt"""
+    config = get_config(bot)
+
+    if guild_id is not None:
+        guild_ids = [guild_id]
+    else:
+        guild_ids = [row["guild_id"] for row in await config.database.fetch_all(config.queries.guild_ids)]
+
+    for guild_id in guild_ids:
+        await config.snapshot.rebuild(config, guild_id)
+    return len(guild_ids)
+
+
+async def _main(args) -> None:
+    database, close = await connect(args.url)
+    try:
+        config = DislevelConfig(
+            bot=None,
+            database=database,
+            table_name=args.table,
+            dialect=get_dialect(database),
+            snapshot=LeaderboardSnapshot(args.size),
+        )
+        await config.database.execute(config.queries.create_top_table)
+
+        if args.guild is not None:
+            guild_ids = [args.guild]
+        else:
+            guild_ids = [row["guild_id"] for row in await database.fetch_all(config.queries.guild_ids)]
+
+        drifted = 0
+        for guild_id in guild_ids:
+            differences = await check_snapshot(config, guild_id)
+            if differences:
+                drifted += 1
+                log.info("Guild %s: %d rows differ", guild_id, len(differences))
+            if args.rebuild and (differences or args.guild is not None):
+                await config.snapshot.rebuild(config, guild_id)
+
+        log.info(
+            "%d of %d guilds drifted%s", drifted, len(guild_ids), ", rebuilt" if args.rebuild else ""
+        )
+    finally:
+        await close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("url", help="postgresql:// connection string or databases URL")
+    parser.add_argument("--table", default="dislevel_data")
+    parser.add_argument("--size", type=int, default=100, help="rows kept per guild")
+    parser.add_argument("--guild", type=int, help="only this guild")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild drifted guilds instead of only reporting them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
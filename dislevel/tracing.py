@@ -0,0 +1,186 @@
+import logging
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, List, Optional
+
+log = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Span"]] = ContextVar("dislevel_span", default=None)
+# Set while an unsampled command is timed, so commands it runs are not timed on their own
+_timing: ContextVar[bool] = ContextVar("dislevel_timing", default=False)
+
+
+class Span:
+    """A timed phase of a traced request"""
+
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: dict, start: float, end: float = None):
+        self.name = name
+        self.attrs = attrs
+        self.start = start
+        self.end = end
+        self.children: List[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def dump(self, origin: float = None, depth: int = 0) -> str:
+        """Renders the span tree with durations and offsets from the root"""
+        origin = self.start if origin is None else origin
+        attrs = " ".join(f"{key}={value}" for key, value in self.attrs.items())
+        line = f"{'  ' * depth}{self.name} {self.duration:.1f}ms"
+        if depth:
+            line += f" (+{(self.start - origin) * 1000:.1f}ms)"
+        if attrs:
+            line += f" [{attrs}]"
+
+        return "\n".join([line] + [child.dump(origin, depth + 1) for child in self.children])
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+_UNSET = object()
+
+
+class _SpanContext:
+    __slots__ = ("tracer", "span", "parent", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict, parent: Optional[Span]):
+        self.tracer = tracer
+        self.parent = parent
+        self.span = Span(name, attrs, 0.0)
+
+    def __enter__(self) -> Span:
+        self.span.start = time.perf_counter()
+        if self.parent is not None:
+            self.parent.children.append(self.span)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        _current.reset(self.token)
+
+        if self.parent is None:
+            self.tracer._finish(self.span)
+        return False
+
+
+class _TimedRoot:
+    """The root of an unsampled command, timed for the slow log without recording spans"""
+
+    __slots__ = ("tracer", "span", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.span = Span(name, attrs, 0.0)
+
+    def __enter__(self) -> None:
+        self.span.start = time.perf_counter()
+        self.token = _timing.set(True)
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        _timing.reset(self.token)
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        self.tracer._finish(self.span, sampled=False)
+        return False
+
+
+class Tracer:
+    """
+    Samples requests into span trees and logs the breakdown of slow ones.
+
+    ``trace`` starts a root span for a command (or joins the current trace),
+    ``span`` only records while a sampled trace is active, so instrumented
+    internals cost a single context variable lookup otherwise. Commands that
+    are not sampled are still timed as a whole, so every slow one is logged,
+    only without its breakdown.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, slow_threshold: float = 2.0, keep: int = 50):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.slow_traces: Deque[Span] = deque(maxlen=keep)
+
+    def trace(self, name: str, **attrs):
+        parent = _current.get()
+        if parent is None and (
+            self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate)
+        ):
+            if self.slow_threshold is None or _timing.get():
+                return _NOOP
+            return _TimedRoot(self, name, attrs)
+        return _SpanContext(self, name, attrs, parent)
+
+    def span(self, name: str, **attrs):
+        parent = _current.get()
+        if parent is None:
+            return _NOOP
+        return _SpanContext(self, name, attrs, parent)
+
+    def record(self, name: str, start: float, end: float, **attrs) -> None:
+        """Attaches an already measured phase to the current trace"""
+        parent = _current.get()
+        if parent is not None:
+            parent.children.append(Span(name, attrs, start, end))
+
+    def _finish(self, root: Span, sampled: bool = True) -> None:
+        if self.slow_threshold is None or root.duration < self.slow_threshold * 1000:
+            return
+
+        self.slow_traces.append(root)
+        if sampled:
+            log.warning("Slow dislevel request %s:\n%s", root.name, root.dump())
+        else:
+            log.warning("Slow dislevel request %s (not sampled, no breakdown): %s", root.name, root.dump())
+
+
+TRACER = Tracer()
+
+
+def configure_tracing(sample_rate: float = None, slow_threshold: float = _UNSET, keep: int = None) -> Tracer:
+    """
+    Configures the shared tracer, arguments left out keep their current value.
+
+    sample_rate: fraction of commands traced, 0 disables span breakdowns
+    slow_threshold: seconds after which a command is logged, with its span breakdown
+        when it was sampled. None disables the slow log
+    keep: how many slow traces to keep in ``TRACER.slow_traces``
+    """
+    if sample_rate is not None:
+        TRACER.sample_rate = sample_rate
+    if slow_threshold is not _UNSET:
+        TRACER.slow_threshold = slow_threshold
+    if keep is not None:
+        TRACER.slow_traces = deque(TRACER.slow_traces, maxlen=keep)
+    return TRACER
+
+
+def trace(name: str, **attrs):
+    return TRACER.trace(name, **attrs)
+
+
+def span(name: str, **attrs):
+    return TRACER.span(name, **attrs)
+
+
+def record_span(name: str, start: float, end: float, **attrs) -> None:
+    TRACER.record(name, start, end, **attrs)
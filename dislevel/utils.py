@@ -1,49 +1,102 @@
-import os
-import discord  # Add this import to resolve discord-specific exceptions
-from typing import List, Union
-
-from ._models import Field
-
-
-leveling_table: str = None
-
-
-async def prepare_db(database, additional_fields: List[Field] = list()) -> None:
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from ._models import Leaderboard, MemberStats
+from .config import DislevelConfig, get_config
+from .metrics import DB_QUERY_SECONDS, LEVELUPS
+from .periods import current_day, period_bucket
+from .tracing import span, trace
+
+log = logging.getLogger(__name__)
+
+
+@contextmanager
+def _query(operation: str):
+    """Times a database operation into both the metrics and the current trace"""
+    with span(f"db.{operation}"), DB_QUERY_SECONDS.time(operation=operation):
+        yield
+
+
+@asynccontextmanager
+async def _xp_write(config: DislevelConfig):
+    """A transaction around an XP write and its change to the global totals, none when those are off"""
+    if config.global_xp is None:
+        yield
+        return
+    async with config.database.transaction():
+        yield
+
+
+def _written(config: DislevelConfig, guild_id: int, member_id: int = None) -> None:
+    """
+    Pins reads of a written member (or whole guild) to the primary and moves
+    the guild's version. Call it once the write is done: reads of the guild
+    started before that may return the old rows, so callers from now on do
+    not join them.
+    """
+    config.reads.note_write(guild_id if member_id is None else (guild_id, member_id))
+    config.versions.bump(guild_id)
+    if config.flights.calls:
+        config.flights.forget(lambda key: key[1] == guild_id)
+
+
+async def prepare_db(config: DislevelConfig) -> None:
     """Prepares the database for leveling"""
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
-
-    default_fields = [
-        Field(name="id", type="BIGSERIAL", primary=True),
-        Field(name="member_id", type="BIGINT", null=False),
-        Field(name="guild_id", type="BIGINT", null=False),
-        Field(name="xp", type="BIGINT", null=False, default=0),
-        Field(name="level", type="BIGINT", null=False, default=1),
-        Field(name="bg_image", type="TEXT"),
-    ]
-
-    all_fields = default_fields + additional_fields
-    field_schema = ""
+    database = config.database
+    queries = config.queries
 
-    for index, field in enumerate(all_fields):
-        statement = f"{field.name} {field.type}"
-
-        if field.primary:
-            statement += " PRIMARY KEY"
-
-        if not field.null:
-            statement += " NOT NULL"
-
-        if field.default != None:
-            statement = f"{statement} DEFAULT %r" % field.default
-
-        field_schema += statement + (", " if index < len(all_fields) - 1 else "")
-
-    schema = f"CREATE TABLE IF NOT EXISTS {leveling_table}({field_schema})"
+    if config.partitions and not queries.partitions:
+        log.warning("Partitioning is only supported on Postgres, %s is not partitioned", config.table_name)
 
     try:
-        await database.execute(schema)
+        await database.execute(queries.create_table)
     except Exception as e:
-        print(e)
+        log.warning("Could not prepare %s: %s", config.table_name, e)
+
+    if queries.partitions:
+        # A table from before partitioning was turned on keeps its layout until it is migrated
+        if await database.fetch_val(queries.is_partitioned):
+            for statement in queries.create_partitions:
+                await database.execute(statement)
+        else:
+            log.warning(
+                "%s exists and is not partitioned, move it with python -m dislevel.migrate",
+                config.table_name,
+            )
+
+    for statement in queries.migrations:
+        try:
+            await database.execute(statement)
+        except Exception as e:
+            log.debug("Skipped migration of %s: %s", config.table_name, e)
+
+    if config.snapshot is not None:
+        await database.execute(queries.create_top_table)
+    if config.periods is not None:
+        for statement in queries.create_period_table:
+            await database.execute(statement)
+    if config.journal is not None:
+        for statement in queries.create_journal:
+            await database.execute(statement)
+        await config.journal.seed()
+    if config.rewards is not None:
+        await database.execute(queries.create_rewards)
+    if config.archive is not None:
+        for statement in queries.create_archive:
+            await database.execute(statement)
+    if config.global_xp is not None:
+        for statement in queries.create_global:
+            await database.execute(statement)
+        await config.global_xp.seed(config)
+
+    if config.dialect == "sqlite":
+        try:
+            await database.fetch_val(queries.level_probe)
+        except Exception:
+            log.debug("SQLite has no power(), bulk operations recompute levels in Python")
+            queries.levels_in_sql = False
 
 
 def get_percentage(data):
@@ -60,188 +113,874 @@ def get_percentage(data):
     return data
 
 
-async def get_member_data(bot, member_id: int, guild_id: int) -> Union[dict, None]:
-    """Returns data of an member"""
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
+async def _load_member_data(config: DislevelConfig, member_id: int, guild_id: int):
+    with _query("get_member_data"):
+        row = await config.reads.fetch_one(
+            config.queries.member_data,
+            {"guild_id": guild_id, "member_id": member_id},
+            key=(guild_id, member_id),
+        )
+    if row is None and config.archive is not None:
+        row = await _restore_member(config, member_id, guild_id)
+    return row
 
-    data = await database.fetch_one(
-        f"""
-        SELECT  * 
-        FROM    {leveling_table} 
-        WHERE   guild_id = :guild_id 
-        AND     member_id = :member_id
-        """,
-        {"guild_id": guild_id, "member_id": member_id},
-    )
 
-    if not data:
+async def _restore_member(config: DislevelConfig, member_id: int, guild_id: int):
+    """Moves an archived member back into the table and returns their row, None if they are not archived"""
+    if not await config.archive.restore(guild_id, [member_id]):
+        return None
+
+    with _query("get_member_data"):
+        return await config.database.fetch_one(
+            config.queries.member_data, {"guild_id": guild_id, "member_id": member_id}
+        )
+
+
+async def get_member_data(bot, member_id: int, guild_id: int) -> Optional[MemberStats]:
+    """Returns data of an member. Concurrent calls for the same member share one query"""
+    config = get_config(bot)
+
+    row = await config.flights.do(
+        ("get_member_data", guild_id, member_id), _load_member_data, config, member_id, guild_id
+    )
+    if not row:
         return None
 
-    return get_percentage(dict(data))
-
-
-async def get_leaderboard_data(bot, guild_id: int):
-    """Get a guild's leaderboard data"""
-    print(f"DEBUG: Fetching leaderboard data for guild {guild_id}.")  # Debug logging
-    
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
-    
-    # Fetch raw leaderboard data from the database
-    raw_data = await database.fetch_all(
-        f"""
-        SELECT   member_id, xp
-        FROM     {leveling_table}
-        WHERE    guild_id = :guild_id
-        ORDER BY xp DESC
-        LIMIT 10
-        """,
-        {"guild_id": guild_id},
+    return MemberStats.from_row(row, config.queries.extra_fields)
+
+
+def _tracked(config: DislevelConfig, guild_id: int) -> bool:
+    """
+    Whether a guild's active flags can be trusted. Members may have left while
+    the bot was down or before tracking was on, so only flags reconciled since
+    startup count, other guilds validate members like untracked ones.
+    """
+    return config.track_members and guild_id in config.reconciled
+
+
+def _period_values(config: DislevelConfig, period: str) -> dict:
+    if config.periods is None:
+        raise ValueError("Period leaderboards are not enabled, see init_dislevel(period_leaderboards=True)")
+    return {"period": period, "bucket": period_bucket(period, current_day())}
+
+
+async def get_leaderboard_data(
+    bot,
+    guild_id: int,
+    limit: int = 10,
+    overfetch: int = 2,
+    period: Optional[str] = None,
+    fetch_members: bool = True,
+):
+    """
+    Get a guild's leaderboard data, of lifetime XP or of the current
+    ``"week"``, ``"month"`` or ``"season"``.
+
+    When membership is tracked (and the guild was reconciled since startup),
+    rows of departed members are inactive and the top ``limit`` active rows
+    are the leaderboard. Otherwise rows are fetched
+    ``limit * overfetch`` at a time and resolved to members in one concurrent
+    batch, so departed members are skipped without leaving the board short.
+    Every returned row carries its ``member``, which is ``None`` for tracked
+    guilds whose member is not in the gateway cache. Without
+    ``fetch_members``, untracked guilds list only members already cached and
+    read a single page of ``limit * overfetch`` rows, so the call makes no
+    REST requests and its cost is bounded, e.g. for the public API.
+
+    Concurrent calls for the same page share one set of queries and member
+    lookups, e.g. everyone opening the leaderboard after an announcement,
+    and the same read only ``Leaderboard``.
+    """
+    config = get_config(bot)
+    leaderboard = await config.flights.do(
+        ("get_leaderboard_data", guild_id, limit, overfetch, period, fetch_members),
+        _load_leaderboard,
+        config,
+        guild_id,
+        limit,
+        overfetch,
+        period,
+        fetch_members,
     )
-    print(f"DEBUG: Raw leaderboard data: {raw_data}")
-    
-    # Validate that the members exist in the guild
-    guild = bot.get_guild(guild_id)
+    return leaderboard
+
+
+async def _load_leaderboard(
+    config: DislevelConfig,
+    guild_id: int,
+    limit: int,
+    overfetch: int,
+    period: Optional[str],
+    fetch_members: bool,
+) -> Leaderboard:
+    leaderboard = Leaderboard()
+    guild = config.bot.get_guild(guild_id)
     if guild is None:
-        print(f"ERROR: Guild with ID {guild_id} not found.")
-        return []
-    
-    validated_data = []
-    for row in raw_data:
-        member_id = row["member_id"]
-        try:
-            member = guild.get_member(member_id)
-            if not member:
-                print(f"DEBUG: Member ID {member_id} not in cache, attempting API fetch.")
-                member = await guild.fetch_member(member_id)
-    
-            # Add valid members to the leaderboard data
-            if member:
-                validated_data.append(dict(row))
-                print(f"DEBUG: Valid member {member} added to leaderboard.")
-        except discord.NotFound:
-            print(f"WARNING: Member ID {member_id} not found in guild. Skipping.")
-            continue
-        except discord.Forbidden:
-            print(f"WARNING: Insufficient permissions to fetch member ID {member_id}. Skipping.")
-            continue
-        except Exception as e:
-            print(f"ERROR: Unexpected error with member ID {member_id}: {e}")
-            continue
-    
-    print(f"DEBUG: Validated leaderboard data: {validated_data}")
-    return validated_data
+        log.warning("Guild with ID %s not found", guild_id)
+        return leaderboard
+
+    tracked = _tracked(config, guild_id)
+    offset = 0
+    period_values = _period_values(config, period) if period else None
+
+    while len(leaderboard) < limit:
+        page_size = limit - len(leaderboard) if tracked else limit * overfetch
+        if period_values is not None:
+            with _query("get_period_leaderboard_data"):
+                raw_data = await config.reads.fetch_all(
+                    config.queries.period_leaderboard,
+                    {"guild_id": guild_id, "limit": page_size, "offset": offset, **period_values},
+                )
+        elif config.snapshot is not None and offset < config.snapshot.size:
+            # Pages end where the snapshot does, the rows after it come from the table
+            page_size = min(page_size, config.snapshot.size - offset)
+            raw_data = await config.snapshot.page(config, guild_id, page_size, offset)
+        else:
+            with _query("get_leaderboard_data"):
+                raw_data = await config.reads.fetch_all(
+                    config.queries.leaderboard,
+                    {"guild_id": guild_id, "limit": page_size, "offset": offset},
+                )
+
+        if tracked:
+            for row in raw_data:
+                leaderboard.append(row["member_id"], row["xp"], guild.get_member(row["member_id"]))
+        else:
+            with span("resolve_members", rows=len(raw_data)):
+                members = await config.member_resolver.resolve(
+                    guild, [row["member_id"] for row in raw_data], fetch=fetch_members
+                )
+
+            for row in raw_data:
+                member = members.get(row["member_id"])
+                if member is not None and len(leaderboard) < limit:
+                    leaderboard.append(row["member_id"], row["xp"], member)
+            if not fetch_members:
+                break
+
+        if len(raw_data) < page_size:
+            break
+        offset += page_size
+
+    log.debug("Resolved %d leaderboard members for guild %s", len(leaderboard), guild_id)
+    return leaderboard
+
+
+async def get_member_position(bot, member_id: int, guild_id: int, period: Optional[str] = None):
+    """Get position of a member among the guild's active members, by lifetime or period XP"""
+    config = get_config(bot)
+    return await config.flights.do(
+        ("get_member_position", guild_id, member_id, period),
+        _load_member_position,
+        config,
+        member_id,
+        guild_id,
+        period,
+    )
 
 
+async def _load_member_position(
+    config: DislevelConfig, member_id: int, guild_id: int, period: Optional[str]
+) -> Optional[int]:
+    if period:
+        with _query("get_period_position"):
+            return await config.reads.fetch_val(
+                config.queries.period_position,
+                {"guild_id": guild_id, "member_id": member_id, **_period_values(config, period)},
+            )
 
+    with _query("get_member_position"):
+        position = await config.reads.fetch_val(
+            config.queries.member_position,
+            {"guild_id": guild_id, "member_id": member_id},
+            key=(guild_id, member_id),
+        )
+
+    return position
 
-async def get_member_position(bot, member_id: int, guild_id: int):
-    """Get position of a member"""
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
 
-    data = await database.fetch_all(
-        f"""SELECT  *
-             FROM   {leveling_table} 
-            WHERE   guild_id = :guild_id 
-         ORDER BY   xp 
-             DESC
-        """,
-        {"guild_id": guild_id},
+async def _archived_counts(config: DislevelConfig, guild_id: int, xp: int) -> Tuple[int, int]:
+    """Archived members above ``xp`` and in total, when ranks count them"""
+    if config.archive is None or not config.archive.count_in_ranks:
+        return 0, 0
+    return await config.archive.counts_above(guild_id, int(max(xp, 0) ** (1 / 5)))
+
+
+async def get_member_rank(bot, member_id: int, guild_id: int, xp: int) -> dict:
+    """
+    Position of a member with ``xp`` XP, plus their percentile and a label
+    for the card. With approximate ranks on, positions outside the exact top
+    come from the guild's XP histogram and ``exact`` is False. When the
+    archive counts in ranks, archived members of higher levels are added.
+    """
+    config = get_config(bot)
+    estimator = config.ranking
+
+    if estimator is None:
+        position = await get_member_position(config, member_id, guild_id)
+        position += (await _archived_counts(config, guild_id, xp))[0]
+        return {"position": position, "percentile": None, "exact": True, "rank_label": f"#{position}"}
+
+    with span("approximate_rank"):
+        histogram = await estimator.histogram(config, guild_id)
+        position = int(histogram.count_above(xp)) + 1
+
+    exact = position <= estimator.exact_top
+    if exact:
+        position = await get_member_position(config, member_id, guild_id)
+
+    archived_above, archived = await _archived_counts(config, guild_id, xp)
+    position += archived_above
+    percentile = 100 * position / max(histogram.total + archived, position)
+    if config.rank_display == "percentile" and not exact:
+        label = f"Top {max(percentile, 0.1):.3g}%"
+    else:
+        label = f"#{position}" if exact else f"~#{position}"
+
+    return {"position": position, "percentile": percentile, "exact": exact, "rank_label": label}
+
+
+async def get_leaderboard_window(
+    bot, member_id: int, guild_id: int, radius: int = 5, overfetch: int = 2, fetch_members: bool = True
+) -> Optional[Leaderboard]:
+    """
+    The ``radius`` members ranked right above and right below a member, and
+    the member, in leaderboard order. ``start`` of the returned ``Leaderboard``
+    is the position of its first row, counted from the member's rank.
+
+    The rows are read with two scans of the XP index that start at the
+    member's XP and stop after ``radius`` rows (``radius * overfetch`` when
+    departed members are skipped as in ``get_leaderboard_data``), so they cost
+    the same anywhere on the board. The position comes from ``get_member_rank``:
+    with approximate ranks on it costs the same anywhere too, outside the
+    exact top. Without them it is an exact count of the rows above the member,
+    an index range scan that grows with their rank, so turn approximate ranks
+    on for guilds where windows deep down the board are requested often.
+    Returns None when the member has no active XP in the guild.
+    Without ``fetch_members``, members are only looked up in the caches, as
+    in ``get_leaderboard_data``.
+    """
+    config = get_config(bot)
+    return await config.flights.do(
+        ("get_leaderboard_window", guild_id, member_id, radius, overfetch, fetch_members),
+        _load_leaderboard_window,
+        config,
+        member_id,
+        guild_id,
+        radius,
+        overfetch,
+        fetch_members,
     )
 
-    position = 0
-    for row in data:
-        position += 1
-        if member_id == row["member_id"]:
-            break
 
-    return position
+async def _load_leaderboard_window(
+    config: DislevelConfig, member_id: int, guild_id: int, radius: int, overfetch: int, fetch_members: bool
+) -> Optional[Leaderboard]:
+    guild = config.bot.get_guild(guild_id)
+    if guild is None:
+        log.warning("Guild with ID %s not found", guild_id)
+        return None
 
+    stats = await get_member_data(config, member_id, guild_id)
+    if stats is None or not stats.active:
+        return None
 
-async def update_xp(bot, member_id: int, guild_id: int, amount: int = 0) -> None:
-    """Increate xp of a member"""
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
-
-    user_data = await get_member_data(bot, member_id, guild_id)
-
-    if user_data:
-        level = user_data["level"]
-        new_xp = user_data["xp"] + amount
-        new_level = int(new_xp ** (1 / 5))
-
-        await database.execute(
-            f"""
-            UPDATE  {leveling_table} 
-                SET  xp = :xp, 
-                    level = :level 
-                WHERE  member_id = :member_id 
-                AND  guild_id = :guild_id
-            """,
-            {
-                "xp": new_xp,
-                "level": new_level,
-                "guild_id": guild_id,
-                "member_id": member_id,
-            },
-        )
+    tracked = _tracked(config, guild_id)
+    values = {
+        "guild_id": guild_id,
+        "member_id": member_id,
+        "xp": stats.xp,
+        "limit": radius if tracked else radius * overfetch,
+    }
+    with _query("get_leaderboard_window"):
+        # Nearest first on both sides
+        above = await config.reads.fetch_all(config.queries.window_above, values)
+        below = await config.reads.fetch_all(config.queries.window_below, values)
+
+    member_ids = [row["member_id"] for row in above] + [member_id] + [row["member_id"] for row in below]
+    if tracked:
+        members = {row_id: guild.get_member(row_id) for row_id in member_ids}
+    else:
+        with span("resolve_members", rows=len(member_ids)):
+            members = await config.member_resolver.resolve(guild, member_ids, fetch=fetch_members)
+        above = [row for row in above if members.get(row["member_id"]) is not None]
+        below = [row for row in below if members.get(row["member_id"]) is not None]
+    above, below = above[:radius], below[:radius]
+
+    rank = await get_member_rank(config, member_id, guild_id, stats.xp)
+    window = Leaderboard(start=max(rank["position"] - len(above), 1))
+    for row in reversed(above):
+        window.append(row["member_id"], row["xp"], members.get(row["member_id"]))
+    window.append(member_id, stats.xp, members.get(member_id))
+    for row in below:
+        window.append(row["member_id"], row["xp"], members.get(row["member_id"]))
+
+    return window
+
+
+def _dispatch_levelup(config: DislevelConfig, guild_id: int, member_id: int, level: int) -> None:
+    LEVELUPS.inc()
+    # Command line tools write XP without a bot
+    if config.bot is None:
+        return
+    config.bot.dispatch(
+        "dislevel_levelup",
+        guild_id=guild_id,
+        member_id=member_id,
+        level=level,
+    )
 
-        if new_level > level:
-            bot.dispatch(
-                "dislevel_levelup",
-                guild_id=guild_id,
-                member_id=member_id,
-                level=new_level,
-            )
 
-    else:
-        level = int(amount ** (1 / 5))
-        await database.execute(
-            f"""
-            INSERT  INTO {leveling_table}
-                    (member_id, guild_id, xp, level) 
-            VALUES  (:member_id, :guild_id, :xp, :level)
-            """,
-            {
-                "xp": amount,
-                "level": level,
-                "guild_id": guild_id,
-                "member_id": member_id,
-            },
-        )
+def _level_changed(
+    config: DislevelConfig, guild_id: int, member_id: int, old_level: Optional[int], new_level: int
+) -> None:
+    """Queues reward roles and dispatches level-ups, ``old_level`` is None for new rows"""
+    if config.rewards is not None and new_level != (old_level or 0):
+        config.rewards.level_changed(guild_id, member_id, new_level)
+
+    # New rows start at level 1, only starting above it is a level-up
+    if new_level > (1 if old_level is None else old_level):
+        _dispatch_levelup(config, guild_id, member_id, new_level)
+
+
+async def _after_write(
+    config: DislevelConfig, guild_id: int, writes: List[Tuple[int, Any, int]], source: Optional[str]
+) -> None:
+    """
+    Brings everything derived from XP in step with ``(member_id, previous row
+    or None, new xp)`` writes: the rank histogram, the period rollups, the
+    journal and the leaderboard snapshot.
+    """
+    for member_id, row, new_xp in writes:
+        ranked = row is not None and row["active"]
+        amount = new_xp - (row["xp"] if row is not None else 0)
+
+        if config.ranking is not None:
+            if ranked:
+                config.ranking.record_move(guild_id, row["xp"], new_xp)
+            else:
+                config.ranking.record_add(guild_id, new_xp)
+        if config.periods is not None:
+            config.periods.record(guild_id, member_id, amount)
+        if config.journal is not None and source:
+            config.journal.record(guild_id, member_id, amount, source)
+
+    if config.snapshot is not None:
+        ranked_writes = [
+            (member_id, row["xp"] if row is not None and row["active"] else None, new_xp)
+            for member_id, row, new_xp in writes
+        ]
+        await config.snapshot.record(config, guild_id, ranked_writes)
+
+
+async def update_xp(
+    bot, member_id: int, guild_id: int, amount: int = 0, source: Optional[str] = "update_xp"
+) -> None:
+    """Increate xp of a member. ``source`` labels the change in the XP journal"""
+    with trace("update_xp", guild_id=guild_id):
+        config = get_config(bot)
+        database = config.database
+
+        # Read-modify-write, so this read has to see the primary
+        with _query("get_member_data"):
+            user_data = await database.fetch_one(
+                config.queries.member_data,
+                {"guild_id": guild_id, "member_id": member_id},
+            )
+        if user_data is None and config.archive is not None:
+            user_data = await _restore_member(config, member_id, guild_id)
+
+        if user_data:
+            level = user_data["level"]
+            # XP never goes below zero, so removing more than a member has empties it
+            new_xp = max(user_data["xp"] + amount, 0)
+            new_level = int(new_xp ** (1 / 5))
+
+            async with _xp_write(config):
+                with _query("update_xp"):
+                    await database.execute(
+                        config.queries.update_xp,
+                        {
+                            "xp": new_xp,
+                            "level": new_level,
+                            "guild_id": guild_id,
+                            "member_id": member_id,
+                        },
+                    )
+                if config.global_xp is not None:
+                    await config.global_xp.record(config, {member_id: new_xp - user_data["xp"]})
+            _written(config, guild_id, member_id)
+
+            await _after_write(config, guild_id, [(member_id, user_data, new_xp)], source)
+            _level_changed(config, guild_id, member_id, level, new_level)
+
+        else:
+            amount = max(amount, 0)
+            level = int(amount ** (1 / 5))
+            async with _xp_write(config):
+                with _query("insert_member"):
+                    await database.execute(
+                        config.queries.insert_member,
+                        {
+                            "xp": amount,
+                            "level": level,
+                            "guild_id": guild_id,
+                            "member_id": member_id,
+                        },
+                    )
+                if config.global_xp is not None:
+                    await config.global_xp.record(config, {member_id: amount})
+            _written(config, guild_id, member_id)
+            await _after_write(config, guild_id, [(member_id, None, amount)], source)
+            _level_changed(config, guild_id, member_id, None, level)
+
+
+async def update_xp_many(
+    bot,
+    guild_id: int,
+    amounts: Dict[int, int],
+    batch_size: int = 500,
+    source: Optional[str] = "update_xp",
+) -> None:
+    """
+    Adds XP to many members of a guild at once, e.g. batched voice XP. Costs
+    one read and up to two batched writes per ``batch_size`` members instead
+    of a round trip per member, and dispatches level-ups like ``update_xp``.
+    Changes without a ``source`` are not journaled.
+    """
+    with trace("update_xp_many", guild_id=guild_id, members=len(amounts)):
+        config = get_config(bot)
+        database = config.database
+        member_ids = list(amounts)
+
+        for start in range(0, len(member_ids), batch_size):
+            chunk = member_ids[start : start + batch_size]
+            values = {f"m{index}": member_id for index, member_id in enumerate(chunk)}
+            values["guild_id"] = guild_id
+
+            with _query("get_member_data_many"):
+                rows = await database.fetch_all(config.queries.member_data_many(len(chunk)), values)
+            found = {row["member_id"] for row in rows}
+            missing = [member_id for member_id in chunk if member_id not in found]
+            if missing and config.archive is not None and await config.archive.restore(guild_id, missing):
+                with _query("get_member_data_many"):
+                    rows = await database.fetch_all(config.queries.member_data_many(len(chunk)), values)
+            current = {row["member_id"]: row for row in rows}
+
+            updates, inserts, levels, written, deltas = [], [], [], [], {}
+            for member_id in chunk:
+                row = current.get(member_id)
+                old_xp = row["xp"] if row else 0
+                xp = max(old_xp + amounts[member_id], 0)
+                level = int(xp ** (1 / 5))
+                values = {"xp": xp, "level": level, "guild_id": guild_id, "member_id": member_id}
+
+                written.append((member_id, row, xp))
+                deltas[member_id] = xp - old_xp
+                levels.append((member_id, row["level"] if row else None, level))
+                if row is None:
+                    inserts.append(values)
+                else:
+                    updates.append(values)
+
+            async with _xp_write(config):
+                if updates:
+                    with _query("update_xp_many"):
+                        await database.execute_many(config.queries.update_xp, updates)
+                if inserts:
+                    with _query("insert_member_many"):
+                        await database.execute_many(config.queries.insert_member, inserts)
+                if config.global_xp is not None:
+                    await config.global_xp.record(config, deltas)
+            for member_id in chunk:
+                _written(config, guild_id, member_id)
+
+            await _after_write(config, guild_id, written, source)
+            for member_id, old_level, level in levels:
+                _level_changed(config, guild_id, member_id, old_level, level)
 
 
 async def delete_member_data(bot, member_id: int, guild_id: int) -> None:
     """Deletes a member's data. Usefull when you want to delete member's data if they leave server"""
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
-
-    await database.executec(
-        f"""
-        DELETE  FROM {leveling_table}
-         WHERE  member_id = :member_id
-           AND  guild_id = :guild_id
-        """,
-        {
-            "guild_id": guild_id,
-            "member_id": member_id,
-        },
+    config = get_config(bot)
+    if config.archive is not None:
+        await config.archive.restore(guild_id, [member_id])
+
+    row = None
+    if config.journal is not None or config.global_xp is not None:
+        row = await config.database.fetch_one(
+            config.queries.member_data, {"guild_id": guild_id, "member_id": member_id}
+        )
+    if config.journal is not None and row is not None:
+        config.journal.record(guild_id, member_id, -row["xp"], "delete")
+
+    async with _xp_write(config):
+        with _query("delete_member_data"):
+            await config.database.execute(
+                config.queries.delete_member,
+                {
+                    "guild_id": guild_id,
+                    "member_id": member_id,
+                },
+            )
+        if config.global_xp is not None and row is not None:
+            await config.global_xp.record(config, {member_id: -row["xp"]})
+    _written(config, guild_id, member_id)
+    if config.ranking is not None:
+        config.ranking.invalidate(guild_id)
+    if config.snapshot is not None:
+        config.snapshot.invalidate(guild_id)
+
+
+async def _guild_chunks(config: DislevelConfig, guild_id: int, batch_size: int):
+    """Yields ``(after, until)`` member id ranges of about ``batch_size`` rows of a guild"""
+    after = -1
+    while True:
+        with _query("chunk_end"):
+            until = await config.database.fetch_val(
+                config.queries.chunk_end,
+                {"guild_id": guild_id, "after": after, "batch_size": batch_size},
+            )
+        if until is None:
+            return
+        yield after, until
+        after = until
+
+
+async def _recompute_levels(config: DislevelConfig, guild_id: int, after: int, until: int) -> None:
+    values = {"guild_id": guild_id, "after": after, "until": until}
+    if config.queries.levels_in_sql:
+        with _query("recompute_levels"):
+            await config.database.execute(config.queries.recompute_levels, values)
+        return
+
+    rows = await config.database.fetch_all(config.queries.chunk_xp, values)
+    levels = [
+        {"level": int(max(row["xp"], 0) ** (1 / 5)), "guild_id": guild_id, "member_id": row["member_id"]}
+        for row in rows
+    ]
+    with _query("recompute_levels"):
+        await config.database.execute_many(config.queries.set_level, levels)
+
+
+def _bulk_written(config: DislevelConfig, *guild_ids: int) -> None:
+    """Drops everything cached about guilds after a bulk operation"""
+    for guild_id in guild_ids:
+        _written(config, guild_id)
+        if config.ranking is not None:
+            config.ranking.invalidate(guild_id)
+        if config.snapshot is not None:
+            config.snapshot.invalidate(guild_id)
+
+
+async def _bulk_prepare(config: DislevelConfig, *guild_ids: int) -> bool:
+    """
+    Gets guilds ready for a bulk operation: restores their archived members
+    and writes buffered period gains, so the operation sees every row. Returns
+    whether the target guild (the last one) has reward roles whose holders
+    have to be compared before and after each chunk.
+    """
+    for guild_id in guild_ids:
+        if config.archive is not None:
+            await config.archive.restore_guild(guild_id)
+    if config.periods is not None:
+        await config.periods.flush()
+    return config.rewards is not None and bool(await config.rewards.reward_map(guild_ids[-1]))
+
+
+async def _chunk_levels(config: DislevelConfig, guild_id: int, after: int, until: int) -> Dict[int, int]:
+    rows = await config.database.fetch_all(
+        config.queries.chunk_levels, {"guild_id": guild_id, "after": after, "until": until}
     )
+    return {row["member_id"]: row["level"] for row in rows}
+
+
+async def _bulk_update(
+    config: DislevelConfig,
+    guild_id: int,
+    statement: str,
+    period_statement: str,
+    new_xp: str,
+    extra: dict,
+    source: str,
+    batch_size: int,
+) -> None:
+    """
+    Runs ``statement`` over a guild chunk by chunk, each chunk with its
+    journal, global totals, period rollups and levels in one transaction.
+    Members whose reward roles change are queued once their chunk committed.
+    """
+    database = config.database
+    rewarded = await _bulk_prepare(config, guild_id)
+    async for after, until in _guild_chunks(config, guild_id, batch_size):
+        values = {"guild_id": guild_id, "after": after, "until": until}
+
+        with _query(source):
+            async with database.transaction():
+                if rewarded:
+                    old_levels = await _chunk_levels(config, guild_id, after, until)
+                if config.journal is not None:
+                    await database.execute(
+                        config.queries.journal_bulk(new_xp),
+                        {**values, **extra, "ts": int(time.time() * 1000), "source": source},
+                    )
+                if config.global_xp is not None:
+                    await database.execute(config.queries.global_bulk(new_xp), {**values, **extra})
+                if config.periods is not None:
+                    await database.execute(period_statement, {**values, **extra})
+                await database.execute(statement, {**values, **extra})
+                await _recompute_levels(config, guild_id, after, until)
+                if rewarded:
+                    new_levels = await _chunk_levels(config, guild_id, after, until)
+
+        if rewarded:
+            await config.rewards.levels_changed(guild_id, old_levels, new_levels)
+
+    _bulk_written(config, guild_id)
+
+
+async def reset_guild_xp(bot, guild_id: int, batch_size: int = 1000) -> None:
+    """
+    Sets the XP and level of every member of a guild to 0 and clears their
+    period XP, ``batch_size`` rows per statement
+    """
+    config = get_config(bot)
+    with trace("reset_guild_xp", guild_id=guild_id):
+        await _bulk_update(
+            config,
+            guild_id,
+            config.queries.reset_xp,
+            config.queries.period_reset,
+            "0",
+            {},
+            "reset",
+            batch_size,
+        )
+
+
+async def scale_guild_xp(bot, guild_id: int, factor: float, batch_size: int = 1000) -> None:
+    """Multiplies the lifetime and period XP of every member of a guild by ``factor`` (rounded down) and recomputes levels"""
+    if factor < 0:
+        raise ValueError("factor must not be negative")
+
+    config = get_config(bot)
+    with trace("scale_guild_xp", guild_id=guild_id):
+        await _bulk_update(
+            config,
+            guild_id,
+            config.queries.scale_xp,
+            config.queries.period_scale,
+            config.queries.scaled_xp,
+            {"factor": factor},
+            "scale",
+            batch_size,
+        )
+
+
+async def transfer_xp(
+    bot, guild_id: int, from_member_id: int, to_member_id: int, delete_source: bool = False
+) -> int:
+    """
+    Moves all of a member's XP to another member of the guild, e.g. a new
+    account. The source keeps an empty row unless ``delete_source`` is set.
+    Returns the XP moved.
+    """
+    config = get_config(bot)
+
+    with _query("get_member_data"):
+        row = await config.database.fetch_one(
+            config.queries.member_data, {"guild_id": guild_id, "member_id": from_member_id}
+        )
+    if row is None and config.archive is not None:
+        row = await _restore_member(config, from_member_id, guild_id)
+    if row is None or from_member_id == to_member_id:
+        return 0
+
+    moved = row["xp"]
+    await update_xp_many(config, guild_id, {to_member_id: moved, from_member_id: -moved}, source="transfer")
+    if delete_source:
+        await delete_member_data(config, from_member_id, guild_id)
+    return moved
+
+
+async def merge_guilds(bot, source_guild_id: int, guild_id: int, batch_size: int = 1000) -> None:
+    """
+    Moves every member of ``source_guild_id`` into ``guild_id``, adding XP
+    (lifetime and per period) to members present in both, and deletes the
+    source guild's rows. Runs one chunk of ``batch_size`` source members at a
+    time. There is no command for it: it deletes another guild's data, which
+    no permission in the target guild can authorize.
+    """
+    config = get_config(bot)
+    database = config.database
+    queries = config.queries
+
+    with trace("merge_guilds", guild_id=guild_id):
+        rewarded = await _bulk_prepare(config, source_guild_id, guild_id)
+
+        async for after, until in _guild_chunks(config, source_guild_id, batch_size):
+            values = {
+                "guild_id": guild_id,
+                "source_guild_id": source_guild_id,
+                "after": after,
+                "until": until,
+            }
+            source_values = {"source_guild_id": source_guild_id, "after": after, "until": until}
+
+            with _query("merge_guilds"):
+                async with database.transaction():
+                    if rewarded:
+                        old_levels = await _chunk_levels(config, guild_id, after, until)
+                    if config.journal is not None:
+                        await database.execute(
+                            queries.merge_journal, {**values, "ts": int(time.time() * 1000), "source": "merge"}
+                        )
+                    if config.periods is not None:
+                        await database.execute(queries.period_merge_add, values)
+                        await database.execute(queries.period_merge_delete, source_values)
+                    await database.execute(queries.merge_add, values)
+                    await database.execute(queries.merge_insert, values)
+                    await database.execute(queries.merge_delete, source_values)
+                    await _recompute_levels(config, guild_id, after, until)
+                    if rewarded:
+                        new_levels = await _chunk_levels(config, guild_id, after, until)
+
+            if rewarded:
+                await config.rewards.levels_changed(guild_id, old_levels, new_levels)
+
+    _bulk_written(config, source_guild_id, guild_id)
 
 
 async def set_bg_image(bot, member_id: int, guild_id: int, url) -> None:
     """Set bg image"""
-    database = bot.dislevel_database
-    leveling_table = os.environ.get("DISLEVEL_TABLE")
-
-    await database.execute(
-        f"""
-        UPDATE  {leveling_table}
-        SET     bg_image = :bg_image
-        WHERE   guild_id = :guild_id
-        AND     member_id = :member_id 
-        """,
-        {"bg_image": url, "guild_id": guild_id, "member_id": member_id},
-    )
+    config = get_config(bot)
+
+    with _query("set_bg_image"):
+        await config.database.execute(
+            config.queries.set_bg_image,
+            {"bg_image": url, "guild_id": guild_id, "member_id": member_id},
+        )
+    _written(config, guild_id, member_id)
+
+
+async def set_member_active(bot, member_id: int, guild_id: int, active: bool) -> None:
+    """Marks a member as present in or departed from a guild"""
+    config = get_config(bot)
+
+    # The histogram needs the row's XP and previous flag, only read them if it is built
+    previous = None
+    if config.ranking is not None and guild_id in config.ranking.histograms:
+        previous = await config.database.fetch_one(
+            config.queries.member_data, {"guild_id": guild_id, "member_id": member_id}
+        )
+
+    with _query("set_member_active"):
+        await config.database.execute(
+            config.queries.set_active,
+            {"active": active, "guild_id": guild_id, "member_id": member_id},
+        )
+    _written(config, guild_id, member_id)
+
+    if previous is not None and bool(previous["active"]) != active:
+        if active:
+            config.ranking.record_add(guild_id, previous["xp"])
+        else:
+            config.ranking.record_remove(guild_id, previous["xp"])
+
+    if config.snapshot is not None:
+        config.snapshot.invalidate(guild_id)
+
+    if active:
+        config.member_resolver.forget(guild_id, member_id)
+    else:
+        config.member_resolver.mark_departed(guild_id, member_id)
+
+
+async def handle_member_remove(bot, member) -> None:
+    """Membership listener body shared by the cogs"""
+    await set_member_active(bot, member.id, member.guild.id, False)
+
+
+async def handle_member_join(bot, member) -> None:
+    """Membership listener body shared by the cogs"""
+    await set_member_active(bot, member.id, member.guild.id, True)
+
+
+async def handle_voice_state_update(bot, member, before, after) -> None:
+    """Voice listener body shared by the cogs"""
+    tracker = get_config(bot).voice
+    if tracker is not None:
+        tracker.update(member, after)
+
+
+def handle_cog_load(bot) -> None:
+    """Load hook shared by the cogs, resumes voice XP a previous unload stopped"""
+    config = getattr(bot, "dislevel_config", None)
+    if config is not None and config.voice is not None and not config.voice.running:
+        config.voice.start()
+
+
+async def handle_cog_unload(bot) -> None:
+    """Unload hook shared by the cogs, writes the voice XP accrued so far"""
+    config = getattr(bot, "dislevel_config", None)
+    if config is not None and config.voice is not None:
+        await config.voice.close()
+
+
+async def reconcile_guild(bot, guild, batch_size: int = 500) -> int:
+    """
+    Brings the active flags of a guild in line with its gateway member list.
+    Only chunked guilds are reconciled, returns how many rows were flipped.
+    """
+    if not getattr(guild, "chunked", False):
+        return 0
+
+    config = get_config(bot)
+    present = {member.id for member in guild.members}
+
+    with _query("reconcile_scan"):
+        rows = await config.database.fetch_all(
+            config.queries.guild_memberships, {"guild_id": guild.id}
+        )
+
+    departed = [row["member_id"] for row in rows if row["active"] and row["member_id"] not in present]
+    returned = [row["member_id"] for row in rows if not row["active"] and row["member_id"] in present]
+
+    for active, member_ids in ((False, departed), (True, returned)):
+        for start in range(0, len(member_ids), batch_size):
+            chunk = member_ids[start : start + batch_size]
+            values = {f"m{index}": member_id for index, member_id in enumerate(chunk)}
+            values.update(active=active, guild_id=guild.id)
+
+            with _query("reconcile_update"):
+                await config.database.execute(config.queries.set_active_many(len(chunk)), values)
+
+    for member_id in departed:
+        config.member_resolver.mark_departed(guild.id, member_id)
+    config.reconciled.add(guild.id)
+    if departed or returned:
+        _written(config, guild.id)
+
+    if (departed or returned) and config.ranking is not None:
+        config.ranking.invalidate(guild.id)
+    if (departed or returned) and config.snapshot is not None:
+        config.snapshot.invalidate(guild.id)
+
+    if departed or returned:
+        log.info(
+            "Reconciled guild %s: %d departed, %d returned", guild.id, len(departed), len(returned)
+        )
+    return len(departed) + len(returned)
+
+
+async def reconcile_members(bot) -> int:
+    """Reconciles every chunked guild of the bot, once the bot is ready"""
+    config = get_config(bot)
+    wait_until_ready = getattr(config.bot, "wait_until_ready", None)
+    if wait_until_ready is not None:
+        await wait_until_ready()
+
+    flipped = 0
+    for guild in list(config.bot.guilds):
+        flipped += await reconcile_guild(config, guild)
+    return flipped
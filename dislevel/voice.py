@@ -0,0 +1,154 @@
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from ._tasks import PeriodicTask
+from .metrics import VOICE_SESSIONS, VOICE_XP
+from .utils import update_xp_many
+
+log = logging.getLogger(__name__)
+
+
+class _Session:
+    __slots__ = ("since", "slot")
+
+    def __init__(self, since: float, slot: int):
+        self.since = since
+        self.slot = slot
+
+
+class VoiceTracker:
+    """
+    Accrues XP for time spent in voice channels.
+
+    Only members who can earn (unmuted, undeafened, not in the AFK channel and
+    not bots) have a session, which is just the time they started earning.
+    Time is credited when a voice state change ends the session, so a member
+    costs nothing while nothing changes. Long sessions are checkpointed by a
+    timer wheel: every ``tick`` seconds one slot of the wheel comes due and
+    only the sessions in it are credited, so each session is touched once per
+    ``checkpoint_interval``. Credited XP is written in one batch per guild
+    every ``flush_interval`` seconds through ``update_xp_many``.
+    """
+
+    def __init__(
+        self,
+        config,
+        xp_per_minute: float = 10,
+        flush_interval: float = 60.0,
+        checkpoint_interval: float = 600.0,
+        tick: float = 5.0,
+    ):
+        self.config = config
+        self.xp_per_second = xp_per_minute / 60
+        self.tick_interval = tick
+        self.sessions: Dict[int, Dict[int, _Session]] = defaultdict(dict)
+        self.wheel: List[Set[Tuple[int, int]]] = [
+            set() for _ in range(max(1, round(checkpoint_interval / tick)))
+        ]
+        self.cursor = 0
+        # guild id -> member id -> seconds credited but not written yet
+        self.pending: Dict[int, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        self.ticker = PeriodicTask("voice_tick", tick, self.tick)
+        self.flusher = PeriodicTask("voice_flush", flush_interval, self.flush)
+
+    @staticmethod
+    def can_earn(member, state) -> bool:
+        if state is None or state.channel is None or getattr(member, "bot", False):
+            return False
+        if state.self_mute or state.mute or state.self_deaf or state.deaf:
+            return False
+        return state.channel != getattr(member.guild, "afk_channel", None)
+
+    def update(self, member, state) -> None:
+        """Starts or ends the member's session from their new voice state"""
+        guild_id = member.guild.id
+        session = self.sessions.get(guild_id, {}).get(member.id)
+        earning = self.can_earn(member, state)
+
+        if earning and session is None:
+            # Lands in the slot that comes due a full revolution from now
+            slot = self.cursor
+            self.sessions[guild_id][member.id] = _Session(time.monotonic(), slot)
+            self.wheel[slot].add((guild_id, member.id))
+            VOICE_SESSIONS.inc()
+
+        elif not earning and session is not None:
+            self._credit(guild_id, member.id, session, time.monotonic())
+            self.wheel[session.slot].discard((guild_id, member.id))
+            del self.sessions[guild_id][member.id]
+            if not self.sessions[guild_id]:
+                del self.sessions[guild_id]
+            VOICE_SESSIONS.dec()
+
+    def scan(self, guild) -> None:
+        """Opens sessions for members already in voice, e.g. on startup"""
+        for channel in getattr(guild, "voice_channels", ()):
+            for member in channel.members:
+                self.update(member, member.voice)
+
+    def _credit(self, guild_id: int, member_id: int, session: _Session, now: float) -> None:
+        self.pending[guild_id][member_id] += now - session.since
+        session.since = now
+
+    async def tick(self) -> None:
+        """Credits the sessions of the slot that came due, they stay in it for the next revolution"""
+        self.cursor = (self.cursor + 1) % len(self.wheel)
+        now = time.monotonic()
+        for guild_id, member_id in self.wheel[self.cursor]:
+            self._credit(guild_id, member_id, self.sessions[guild_id][member_id], now)
+
+    async def flush(self) -> None:
+        """Writes credited XP, keeping fractions of a point for the next flush"""
+        pending, self.pending = self.pending, defaultdict(lambda: defaultdict(float))
+
+        for guild_id, seconds in pending.items():
+            amounts = {}
+            for member_id, earned in seconds.items():
+                xp = earned * self.xp_per_second
+                if int(xp):
+                    amounts[member_id] = int(xp)
+                remainder = xp - int(xp)
+                if remainder:
+                    self.pending[guild_id][member_id] += remainder / self.xp_per_second
+
+            if not amounts:
+                continue
+            try:
+                await update_xp_many(self.config, guild_id, amounts, source="voice")
+            except Exception:
+                log.exception("Failed to write voice XP of guild %s, retrying next flush", guild_id)
+                for member_id, xp in amounts.items():
+                    self.pending[guild_id][member_id] += xp / self.xp_per_second
+                continue
+            VOICE_XP.inc(sum(amounts.values()))
+
+    @property
+    def running(self) -> bool:
+        return self.ticker.running
+
+    def start(self) -> None:
+        for guild in getattr(self.config.bot, "guilds", ()):
+            self.scan(guild)
+        self.ticker.start()
+        self.flusher.start()
+
+    def stop(self) -> None:
+        self.ticker.stop()
+        self.flusher.stop()
+
+    async def close(self) -> None:
+        """Stops the tasks and writes everything accrued so far"""
+        self.stop()
+        now = time.monotonic()
+        for guild_id, sessions in self.sessions.items():
+            for member_id, session in sessions.items():
+                self._credit(guild_id, member_id, session, now)
+                VOICE_SESSIONS.dec()
+        # Nothing sees members leave voice while stopped, ``start`` opens their sessions anew
+        self.sessions.clear()
+        for slot in self.wheel:
+            slot.clear()
+        await self.flush()
+